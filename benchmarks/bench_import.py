@@ -0,0 +1,58 @@
+"""Measure the cost of starting the ledgerlinker CLI.
+
+Each measurement runs in a fresh interpreter so module caches do not hide import
+costs. The "eager" case imports everything the client used to import at start up
+(every provider module and the config parser) to show what lazy loading saves.
+
+    python benchmarks/bench_import.py [--runs 20]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'interpreter': 'pass',
+    'lazy client': 'import ledgerlinker.client',
+    'lazy client + one provider': (
+        'import ledgerlinker.client; '
+        'from ledgerlinker.providers import PROVIDERS; '
+        'PROVIDERS["ledgerlinker"]'
+    ),
+    'eager (all providers + commentjson)': (
+        'import ledgerlinker.client, commentjson, '
+        'ledgerlinker.providers.prosper, ledgerlinker.providers.adp, '
+        'ledgerlinker.providers.ledgerlinker_service'
+    ),
+}
+
+TIMER = 'import time; _start = time.perf_counter(); {statement}; print(time.perf_counter() - _start)'
+
+
+def time_statement(statement : str, runs : int) -> float:
+    """Median seconds taken by a statement in a fresh interpreter."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', TIMER.format(statement=statement)],
+            cwd=REPO_ROOT)
+        timings.append(float(output))
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ledgerlinker start up imports.')
+    parser.add_argument('--runs', type=int, default=20, help='Fresh interpreters to time per case.')
+    args = parser.parse_args()
+
+    name_width = max(len(name) for name in CASES)
+    for name, statement in CASES.items():
+        median = time_statement(statement, args.runs)
+        print(f'{name:<{name_width}}  {median * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
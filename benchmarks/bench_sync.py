@@ -0,0 +1,121 @@
+"""End to end sync throughput against the local stub service.
+
+Run standalone to print rows/sec, peak RSS and bytes written:
+
+    python benchmarks/bench_sync.py --transactions 100000 --exports 2
+    python benchmarks/bench_sync.py --transactions 1000000 --csv-passthrough
+
+or through pytest-benchmark to track regressions between releases:
+
+    python -m pytest benchmarks/bench_sync.py --benchmark-only
+"""
+from typing import Dict, Optional
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ledgerlinker.client import LedgerLinkerClient
+from stub_service import StubService
+
+
+def write_config(output_dir : str, base_url : str, **provider_options) -> str:
+    config_path = os.path.join(output_dir, 'bench-config.json')
+    provider_config = {
+        'name': 'bench',
+        'provider': 'ledgerlinker',
+        'token': 'bench-token',
+        'service_base_url': base_url,
+    }
+    provider_config.update(provider_options)
+
+    with open(config_path, 'w') as config_file:
+        json.dump({'output_dir': os.path.join(output_dir, 'outputs'), 'providers': [provider_config]}, config_file)
+    return config_path
+
+
+def get_bytes_written(directory : str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(directory)
+        for file_name in file_names
+    )
+
+
+def get_peak_rss() -> int:
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_sync(base_url : str, output_dir : str, **provider_options) -> Dict:
+    """Sync every stub export into a fresh output directory and measure it."""
+    config_path = write_config(output_dir, base_url, **provider_options)
+    client = LedgerLinkerClient(config_path)
+
+    start_time = time.perf_counter()
+    results = client.sync()
+    wall_time = time.perf_counter() - start_time
+
+    if not all(result.succeeded for result in results):
+        raise RuntimeError('Benchmark sync failed.')
+
+    rows = sum(result.rows_written for result in results)
+    return {
+        'rows': rows,
+        'seconds': wall_time,
+        'rows_per_second': rows / wall_time if wall_time else 0,
+        'peak_rss_bytes': get_peak_rss(),
+        'bytes_written': get_bytes_written(os.path.join(output_dir, 'outputs')),
+    }
+
+
+def test_sync_throughput(benchmark):
+    """pytest-benchmark entry point syncing 10k transactions from two exports."""
+    with StubService(exports=2, transactions=10000) as service:
+        def sync_into_new_dir():
+            with tempfile.TemporaryDirectory() as output_dir:
+                return run_sync(service.base_url, output_dir)
+
+        stats = benchmark(sync_into_new_dir)
+
+    benchmark.extra_info.update(stats)
+    assert stats['rows'] == 20000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LedgerLinkerClient.sync against a local stub service.')
+    parser.add_argument('--transactions', type=int, default=10000, help='Transactions per export.')
+    parser.add_argument('--exports', type=int, default=1, help='Number of exports served.')
+    parser.add_argument('--transactions-per-day', type=int, default=20)
+    parser.add_argument('--export-concurrency', type=int, default=4)
+    parser.add_argument('--csv-passthrough', action='store_true', help='Download the CSV rendering of exports.')
+    parser.add_argument('--output-format', default='csv', help='Output sink, e.g. csv, sqlite or parquet.')
+    args = parser.parse_args()
+
+    provider_options = {
+        'export_concurrency': args.export_concurrency,
+        'csv_passthrough': args.csv_passthrough,
+        'output_format': args.output_format,
+    }
+
+    with StubService(args.exports, args.transactions, args.transactions_per_day) as service:
+        with tempfile.TemporaryDirectory() as output_dir:
+            stats = run_sync(service.base_url, output_dir, **provider_options)
+
+    print(f"rows:          {stats['rows']}")
+    print(f"seconds:       {stats['seconds']:.2f}")
+    print(f"rows/sec:      {stats['rows_per_second']:.0f}")
+    print(f"peak RSS:      {stats['peak_rss_bytes'] / 1024 / 1024:.1f} MiB")
+    print(f"bytes written: {stats['bytes_written']}")
+
+
+if __name__ == '__main__':
+    main()
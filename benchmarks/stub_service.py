@@ -0,0 +1,152 @@
+"""A local stand-in for the LedgerLinker service serving synthetic exports.
+
+The stub implements the endpoints the LedgerLinker provider uses:
+
+    GET /api/exports/                  the export list
+    GET /exports/<slug>/download/      an export as JSON
+    GET /exports/<slug>/download/csv/  an export as CSV
+
+Export bodies are generated while they are sent so exports of millions of
+transactions cost the stub no memory.
+"""
+from typing import Iterator
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process, Queue
+from urllib.parse import urlparse
+import json
+
+FIELDNAMES = ['date', 'amount', 'description', 'account', 'categories', 'transaction_id']
+CATEGORIES = [['Food', 'Groceries'], ['Travel'], ['Bills', 'Utilities'], ['Income', 'Salary']]
+FIRST_DATE = date(2015, 1, 1)
+ROWS_PER_CHUNK = 1000
+
+
+def export_slug(export_index : int) -> str:
+    return f'bench-export-{export_index}'
+
+
+def synthetic_transaction(slug : str, row : int, transactions_per_day : int) -> dict:
+    return {
+        'date': (FIRST_DATE + timedelta(days=row // transactions_per_day)).isoformat(),
+        'amount': round((row % 9973) * 1.37 - 4000, 2),
+        'description': f'SYNTHETIC MERCHANT {row % 487} PURCHASE',
+        'account': f'Assets:Bank:{slug}',
+        'categories': CATEGORIES[row % len(CATEGORIES)],
+        'transaction_id': f'{slug}-{row}',
+    }
+
+
+def latest_date(transactions : int, transactions_per_day : int) -> date:
+    return FIRST_DATE + timedelta(days=max(transactions - 1, 0) // transactions_per_day)
+
+
+def iter_json_export(slug : str, transactions : int, transactions_per_day : int) -> Iterator[bytes]:
+    yield ('{"fieldnames": ' + json.dumps(FIELDNAMES) + ', "transactions": [').encode('utf-8')
+    for start in range(0, transactions, ROWS_PER_CHUNK):
+        rows = (
+            json.dumps(synthetic_transaction(slug, row, transactions_per_day))
+            for row in range(start, min(start + ROWS_PER_CHUNK, transactions))
+        )
+        yield ((', ' if start else '') + ', '.join(rows)).encode('utf-8')
+
+    latest = latest_date(transactions, transactions_per_day).isoformat()
+    yield ('], "latest_transaction": "' + latest + '"}').encode('utf-8')
+
+
+def iter_csv_export(slug : str, transactions : int, transactions_per_day : int) -> Iterator[bytes]:
+    yield (','.join(FIELDNAMES) + '\r\n').encode('utf-8')
+    for start in range(0, transactions, ROWS_PER_CHUNK):
+        lines = []
+        for row in range(start, min(start + ROWS_PER_CHUNK, transactions)):
+            transaction = synthetic_transaction(slug, row, transactions_per_day)
+            transaction['categories'] = ':'.join(transaction['categories'])
+            lines.append(','.join(str(transaction[field]) for field in FIELDNAMES) + '\r\n')
+        yield ''.join(lines).encode('utf-8')
+
+
+def make_handler(exports : int, transactions : int, transactions_per_day : int):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            path = urlparse(self.path).path.strip('/').split('/')
+            base_url = f'http://{self.headers["Host"]}'
+
+            if path == ['api', 'exports']:
+                body = json.dumps([
+                    {
+                        'slug': export_slug(index),
+                        'name': f'Benchmark Export {index}',
+                        'json_download_url': f'{base_url}/exports/{export_slug(index)}/download/',
+                        'csv_download_url': f'{base_url}/exports/{export_slug(index)}/download/csv/',
+                    }
+                    for index in range(exports)
+                ]).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            if len(path) >= 3 and path[0] == 'exports' and path[2] == 'download':
+                if path[3:] == ['csv']:
+                    chunks = iter_csv_export(path[1], transactions, transactions_per_day)
+                    content_type = 'text/csv'
+                else:
+                    chunks = iter_json_export(path[1], transactions, transactions_per_day)
+                    content_type = 'application/json'
+                self.send_chunked(content_type, chunks)
+                return
+
+            self.send_error(404)
+
+        def send_chunked(self, content_type : str, chunks : Iterator[bytes]):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+
+    return StubHandler
+
+
+def _serve(port_queue, exports, transactions, transactions_per_day):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(exports, transactions, transactions_per_day))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class StubService:
+    """Run the stub service in a child process so it does not count towards the client's memory.
+
+        with StubService(exports=2, transactions=10000) as service:
+            config['service_base_url'] = service.base_url
+    """
+
+    def __init__(self, exports : int = 1, transactions : int = 10000, transactions_per_day : int = 20):
+        self.exports = exports
+        self.transactions = transactions
+        self.transactions_per_day = transactions_per_day
+
+    def __enter__(self):
+        port_queue = Queue()
+        self._process = Process(
+            target=_serve,
+            args=(port_queue, self.exports, self.transactions, self.transactions_per_day),
+            daemon=True)
+        self._process.start()
+        self.base_url = f'http://127.0.0.1:{port_queue.get(timeout=10)}'
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
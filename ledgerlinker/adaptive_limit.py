@@ -0,0 +1,187 @@
+"""Adapt the number of requests in flight to each upstream host to how it is coping.
+
+Each host gets an `AdaptiveLimit` using additive increase, multiplicative decrease
+(AIMD), as TCP does for its congestion window:
+
+* While responses keep coming back at the usual latency and the limit is in use, the
+  limit grows by about one request per round of `limit` responses.
+* A throttled or failed request (429, a 5xx status, a connection error or timeout),
+  or a latency spike, cuts the limit by `backoff_ratio`. After a cut the limit is only
+  cut again once a full round of requests sent under the new limit has completed.
+
+A latency spike is a short term moving average of the time to the response headers
+exceeding the long term average by `latency_tolerance` times. A request holds its slot
+until its body is read, so the limit bounds downloads too, but the limit is adjusted
+(`observe`) once the headers arrive: the time to read a body depends on its size rather
+than on how the host copes.
+"""
+from typing import Callable, Deque, Dict, Optional
+from collections import deque
+import asyncio
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 32
+DEFAULT_BACKOFF_RATIO = 0.5
+DEFAULT_LATENCY_TOLERANCE = 2.0
+
+# Weights of a new latency sample in the short and long term moving averages.
+SHORT_TERM_WEIGHT = 0.3
+LONG_TERM_WEIGHT = 0.02
+
+CONGESTION_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class AdaptiveLimit:
+    """The concurrency limit of requests to one host. Must be used from a single event loop."""
+
+    def __init__(
+        self,
+        initial_limit : int = DEFAULT_INITIAL_LIMIT,
+        min_limit : int = DEFAULT_MIN_LIMIT,
+        max_limit : int = DEFAULT_MAX_LIMIT,
+        backoff_ratio : float = DEFAULT_BACKOFF_RATIO,
+        latency_tolerance : float = DEFAULT_LATENCY_TOLERANCE,
+        on_change : Optional[Callable[[int], None]] = None
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._on_change = on_change
+
+        self.in_flight = 0
+        self.short_term_latency : Optional[float] = None
+        self.long_term_latency : Optional[float] = None
+        self._waiters : Deque[asyncio.Future] = deque()
+        # Requests started before the last cut; their outcome says nothing about the new limit.
+        self._started = 0
+        self._cut_at = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    async def acquire(self):
+        """Wait for a free slot, returning a ticket to pass to `observe` or `release`."""
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # Hand the wake up on to the next waiter.
+                    self._wake_waiters()
+                raise
+
+        self.in_flight += 1
+        self._started += 1
+        return self._started
+
+    def release(
+        self,
+        ticket : int,
+        seconds : Optional[float],
+        status_code : Optional[int] = None,
+        error : Optional[BaseException] = None
+    ):
+        """Adjust the limit to the outcome of a request and free its slot."""
+        self.observe(ticket, seconds, status_code, error)
+        self.free()
+
+    def observe(
+        self,
+        ticket : int,
+        seconds : Optional[float],
+        status_code : Optional[int] = None,
+        error : Optional[BaseException] = None
+    ):
+        """Adjust the limit to the outcome of a request whose slot is still held.
+
+        seconds: The time to the response headers, or None if the request was abandoned.
+        """
+        saturated = self.in_flight >= self.limit
+
+        if error is not None or status_code in CONGESTION_STATUSES:
+            self._decrease(ticket)
+        elif seconds is not None:
+            self._observe_latency(seconds)
+            if self.short_term_latency > self.latency_tolerance * self.long_term_latency:
+                self._decrease(ticket)
+            elif saturated:
+                self._set_limit(min(self.max_limit, self._limit + 1 / self._limit))
+
+        self._wake_waiters()
+
+    def free(self):
+        """Free the slot of a request observed earlier, e.g. once its body was read."""
+        self.in_flight -= 1
+        self._wake_waiters()
+
+    def _observe_latency(self, seconds : float):
+        if self.long_term_latency is None:
+            self.short_term_latency = self.long_term_latency = seconds
+            return
+        self.short_term_latency += SHORT_TERM_WEIGHT * (seconds - self.short_term_latency)
+        self.long_term_latency += LONG_TERM_WEIGHT * (seconds - self.long_term_latency)
+
+    def _decrease(self, ticket : int):
+        if ticket <= self._cut_at:
+            return
+        self._cut_at = self._started
+        self._set_limit(max(self.min_limit, self._limit * self.backoff_ratio))
+        # Latency measured under the old limit is not the new normal.
+        self.short_term_latency = self.long_term_latency
+
+    def _set_limit(self, limit : float):
+        previous = self.limit
+        self._limit = limit
+        if self.limit != previous and self._on_change is not None:
+            self._on_change(self.limit)
+
+    def _wake_waiters(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class AdaptiveLimiter:
+    """An `AdaptiveLimit` per host, created on the first request to the host.
+
+    on_change: Called with a host and its new limit whenever a limit is created or changes.
+    """
+
+    def __init__(
+        self,
+        initial_limit : int = DEFAULT_INITIAL_LIMIT,
+        max_limit : int = DEFAULT_MAX_LIMIT,
+        on_change : Optional[Callable[[str, int], None]] = None,
+        **limit_options
+    ):
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.limit_options = limit_options
+        self.on_change = on_change
+        self._limits : Dict[str, AdaptiveLimit] = {}
+
+    def get_limit(self, host : str) -> AdaptiveLimit:
+        host = (host or '').lower()
+        if host not in self._limits:
+            on_change = None
+            if self.on_change is not None:
+                on_change = lambda limit: self.on_change(host, limit)
+            self._limits[host] = AdaptiveLimit(
+                self.initial_limit, max_limit=self.max_limit, on_change=on_change, **self.limit_options)
+            if on_change is not None:
+                on_change(self._limits[host].limit)
+        return self._limits[host]
+
+    def get_limits(self) -> Dict[str, int]:
+        return {host: limit.limit for host, limit in self._limits.items()}
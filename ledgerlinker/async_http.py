@@ -0,0 +1,358 @@
+"""The HTTP client shared by providers implementing `AsyncProvider`.
+
+One client serves every provider synced on the client's event loop. With aiohttp
+installed (`pip install ledgerlinker[async]`) all requests are made from the loop's
+thread, so hundreds can be in flight at once. Otherwise each request is made with
+requests on a thread pool, which behaves the same with fewer requests in flight.
+
+Requests are retried and reported to hooks as described in `ledgerlinker.transport`.
+Only getting the response headers is retried; a body cut short raises while it is read.
+
+The number of requests in flight to each host is limited by an `AdaptiveLimiter`,
+which raises the limit while the host keeps up and cuts it when the host throttles,
+fails or slows down. A response holds its slot until its body is read or it is closed,
+so every response must be read or closed before more are awaited from its host.
+
+Response bodies are either read on the loop (`read`, `json`, `aiter_content`) or
+streamed into blocking code running on a worker thread (`iter_content`), e.g. the
+incremental export parser.
+"""
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlparse
+import asyncio
+import json
+import threading
+import time
+from ledgerlinker import transport
+from ledgerlinker.adaptive_limit import AdaptiveLimiter
+from ledgerlinker.transport import RequestEvent, RetryPolicy
+
+# The most requests in flight at once, across all hosts.
+DEFAULT_ASYNC_POOL_SIZE = 100
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# How often a request waiting for a slot of the process-wide host limiter checks for one.
+HOST_SLOT_POLL_INTERVAL = 0.01
+
+
+def load_aiohttp():
+    """Load aiohttp if installed. Without it requests are made on a thread pool."""
+    try:
+        import aiohttp
+    except ModuleNotFoundError:
+        return None
+    return aiohttp
+
+
+class AsyncResponse:
+    """A response whose body has not been read yet."""
+
+    def __init__(self, status_code : int, headers):
+        self.status_code = status_code
+        self.headers = headers
+        # The number of times the request was retried before this response.
+        self.retries = 0
+        self._free_slot : Optional[Callable[[], None]] = None
+        self._slot_loop : Optional[asyncio.AbstractEventLoop] = None
+        self._slot_lock = threading.Lock()
+
+    def _hold_slot(self, free_slot : Callable[[], None], loop : asyncio.AbstractEventLoop):
+        """Keep a slot of the host's limit until the body is read or the response closed."""
+        self._free_slot = free_slot
+        self._slot_loop = loop
+
+    def _release_slot(self):
+        """Free the held slot, from any thread. Only the first call frees it."""
+        with self._slot_lock:
+            free_slot, self._free_slot = self._free_slot, None
+        if free_slot is None:
+            return
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._slot_loop:
+            free_slot()
+        elif not self._slot_loop.is_closed():
+            self._slot_loop.call_soon_threadsafe(free_slot)
+
+    async def read(self) -> bytes:
+        raise NotImplementedError
+
+    async def json(self):
+        return json.loads(await self.read())
+
+    def aiter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+    def iter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """Iterate the body from a worker thread. Must not be used on the event loop's thread."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the connection. Safe to call from any thread and more than once."""
+        raise NotImplementedError
+
+
+class AsyncHTTPClient:
+    """Make HTTP requests from coroutines.
+
+    retry: The default retry policy, which each request can override.
+    hooks: Functions called with a `RequestEvent` after every attempt at a request.
+    limiter: Limits the requests in flight to each host. Defaults to an `AdaptiveLimiter`.
+    backend: 'requests' to make requests on a thread pool even with aiohttp installed,
+        e.g. to read bodies with `iter_content` on the loop's thread.
+    """
+
+    def __init__(
+        self,
+        pool_size : int = DEFAULT_ASYNC_POOL_SIZE,
+        retry : Optional[RetryPolicy] = None,
+        connect_timeout : float = transport.DEFAULT_CONNECT_TIMEOUT,
+        read_timeout : float = transport.DEFAULT_READ_TIMEOUT,
+        hooks : Optional[List[Callable[[RequestEvent], None]]] = None,
+        limiter : Optional[AdaptiveLimiter] = None,
+        backend : Optional[str] = None
+    ):
+        self.pool_size = pool_size
+        self.retry = retry or RetryPolicy()
+        self.limiter = limiter or AdaptiveLimiter(max_limit=pool_size)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.hooks = list(hooks or [])
+        self._aiohttp = load_aiohttp() if backend != 'requests' else None
+        self._session = None
+        self._executor = None
+        self._transient_errors : Tuple = ()
+
+    def add_hook(self, hook : Callable[[RequestEvent], None]):
+        self.hooks.append(hook)
+
+    @property
+    def backend(self) -> str:
+        return 'aiohttp' if self._aiohttp is not None else 'requests'
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None:
+            if self._aiohttp is not None:
+                # Decompression is left to aiohttp, which sends the matching Accept-Encoding.
+                self._session = self._aiohttp.ClientSession(
+                    connector=self._aiohttp.TCPConnector(limit=self.pool_size),
+                    timeout=self._aiohttp.ClientTimeout(
+                        total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout))
+                self._transient_errors = (self._aiohttp.ClientConnectionError, asyncio.TimeoutError)
+            else:
+                import requests
+                self._session = transport.create_session(pool_size=self.pool_size)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.pool_size, thread_name_prefix='ledgerlinker-http')
+                self._transient_errors = (requests.ConnectionError, requests.Timeout)
+        return self._session
+
+    async def get(
+        self,
+        url : str,
+        headers : Optional[Dict[str, str]] = None,
+        params : Optional[Dict] = None,
+        allow_redirects : bool = True,
+        retry : Optional[RetryPolicy] = None
+    ) -> AsyncResponse:
+        """Send a GET request and return once the response headers have arrived.
+
+        Failed connections and transient responses are retried. Once retries run out the
+        last response is returned, or the last connection error raised. The response holds
+        a slot of the host's limit until its body is read or it is closed.
+        """
+        retry = retry or self.retry
+        host_limit = self.limiter.get_limit(urlparse(url).hostname)
+        attempt = 0
+        while True:
+            ticket = await host_limit.acquire()
+            start_time = time.perf_counter()
+            try:
+                response = await self._send(url, headers, params, allow_redirects)
+            except self._transient_errors as error:
+                seconds = time.perf_counter() - start_time
+                host_limit.release(ticket, seconds, error=error)
+                self._call_hooks(RequestEvent(url, seconds, attempt, error=error))
+                if not retry.should_retry(attempt):
+                    raise
+                delay = retry.get_delay(attempt)
+            except BaseException:
+                host_limit.release(ticket, None)
+                raise
+            else:
+                seconds = time.perf_counter() - start_time
+                response.retries = attempt
+                status_code = response.status_code
+                host_limit.observe(ticket, seconds, status_code)
+                response._hold_slot(host_limit.free, asyncio.get_running_loop())
+                self._call_hooks(RequestEvent(url, seconds, attempt, status_code))
+                if not retry.should_retry(attempt, status_code):
+                    return response
+                delay = retry.get_delay(attempt, status_code, response.headers)
+                if delay is None:
+                    return response
+                response.close()
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _call_hooks(self, event : RequestEvent):
+        for hook in self.hooks:
+            hook(event)
+
+    async def _send(
+        self,
+        url : str,
+        headers : Optional[Dict[str, str]],
+        params : Optional[Dict],
+        allow_redirects : bool
+    ) -> AsyncResponse:
+        session = self._get_session()
+        if self._aiohttp is None:
+            response = await asyncio.get_running_loop().run_in_executor(self._executor, partial(
+                session.get,
+                url,
+                headers=headers,
+                params=params,
+                allow_redirects=allow_redirects,
+                stream=True,
+                timeout=(self.connect_timeout, self.read_timeout)))
+            return _RequestsResponse(response, self._executor)
+
+        # Host limits are shared with other processes, so their slots can't be awaited. They
+        # are polled for rather than waited for on worker threads, which would take the
+        # threads the blocking stages reading the responses holding the slots need.
+        limiter = transport.get_host_limiter()
+        semaphore = limiter.get_semaphore(urlparse(url).hostname) if limiter else None
+        loop = asyncio.get_running_loop()
+        if semaphore is not None:
+            while not semaphore.acquire(False):
+                await asyncio.sleep(HOST_SLOT_POLL_INTERVAL)
+
+        try:
+            response = await session.get(
+                url,
+                headers=headers,
+                params=_encode_params(params),
+                allow_redirects=allow_redirects)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+        return _AiohttpResponse(response, loop, semaphore)
+
+    async def close(self):
+        if self._session is None:
+            return
+
+        if self._aiohttp is not None:
+            await self._session.close()
+        else:
+            self._session.close()
+            self._executor.shutdown(wait=False)
+        self._session = None
+
+
+def _encode_params(params : Optional[Dict]) -> Optional[Dict[str, str]]:
+    # requests renders any value with str(), aiohttp only accepts strings and numbers.
+    if params is None:
+        return None
+    return {key: str(value) for key, value in params.items()}
+
+
+class _RequestsResponse(AsyncResponse):
+
+    def __init__(self, response, executor : ThreadPoolExecutor):
+        super().__init__(response.status_code, response.headers)
+        self._response = response
+        self._executor = executor
+
+    async def read(self) -> bytes:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: self._response.content)
+        finally:
+            self._release_slot()
+
+    async def aiter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        chunks = self._response.iter_content(chunk_size=chunk_size)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._release_slot()
+
+    def iter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        try:
+            yield from self._response.iter_content(chunk_size=chunk_size)
+        finally:
+            self._release_slot()
+
+    def close(self):
+        self._response.close()
+        self._release_slot()
+
+
+class _AiohttpResponse(AsyncResponse):
+
+    def __init__(self, response, loop : asyncio.AbstractEventLoop, semaphore=None):
+        super().__init__(response.status, response.headers)
+        self._response = response
+        self._loop = loop
+        self._semaphore = semaphore
+
+    async def read(self) -> bytes:
+        try:
+            return await self._response.read()
+        finally:
+            self._release()
+
+    async def aiter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._response.content.iter_chunked(chunk_size):
+                yield chunk
+        finally:
+            self._release()
+
+    def iter_content(self, chunk_size : int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        # Each chunk is read on the loop and handed to the calling thread.
+        chunks = self.aiter_content(chunk_size).__aiter__()
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), self._loop).result()
+            except StopAsyncIteration:
+                return
+
+    def _release(self):
+        self._response.release()
+        if self._semaphore is not None:
+            self._semaphore.release()
+            self._semaphore = None
+        self._release_slot()
+
+    def close(self):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._release()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._release)
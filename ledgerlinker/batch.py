@@ -0,0 +1,204 @@
+"""Sync many config files, e.g. one per customer, from a single command.
+
+Configs are handed out to a pool of worker processes from a shared queue, so a slow
+config only holds up its own worker. Each config is synced by its own client with its
+own output dir, update tracker and metrics, and a failing config, even one that does
+not load, is reported without affecting the others. Configs sharing an output dir are
+refused before any is synced.
+
+Requests to each upstream host can be limited across all workers, see `HostLimiter`.
+"""
+from typing import Dict, Iterable, List, Optional, Set
+from contextlib import redirect_stdout
+from functools import partial
+import io
+import multiprocessing
+import os
+import time
+import traceback
+from ledgerlinker.client import LedgerLinkerClient, ProviderSyncResult, resolve_output_dir
+from ledgerlinker.transport import HostLimiter, set_host_limiter
+
+CONFIG_FILE_EXTENSIONS = ('.json',)
+
+
+class BatchException(Exception):
+    pass
+
+
+class ConfigSyncResult:
+    """The outcome of syncing every provider of one config file."""
+
+    def __init__(
+        self,
+        config_path : str,
+        wall_time : float,
+        provider_results : List[ProviderSyncResult],
+        error : Optional[str] = None,
+        output : str = ''
+    ):
+        self.config_path = config_path
+        self.wall_time = wall_time
+        self.provider_results = provider_results
+        self.error = error
+        self.output = output
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and all(result.succeeded for result in self.provider_results)
+
+    @property
+    def rows_written(self) -> int:
+        return sum(result.rows_written for result in self.provider_results)
+
+
+def find_config_files(paths : Iterable[str]) -> List[str]:
+    """Expand directories into the config files they contain."""
+    config_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            config_files.extend(sorted(
+                os.path.join(path, file_name)
+                for file_name in os.listdir(path)
+                if file_name.endswith(CONFIG_FILE_EXTENSIONS) and not file_name.startswith('.')
+            ))
+        else:
+            config_files.append(path)
+    return config_files
+
+
+def get_output_dirs(config_path : str) -> Set[str]:
+    """The output dirs a config file writes to, or none if it does not load."""
+    # Imported here as the comment aware parser is slow to import.
+    import commentjson
+
+    try:
+        with open(config_path, 'r') as config_file:
+            config = commentjson.load(config_file)
+        output_dirs = {config['output_dir']} | {
+            provider_config['output_dir']
+            for provider_config in config.get('providers', [])
+            if 'output_dir' in provider_config
+        }
+    except Exception:
+        # Configs that do not load are reported when their sync fails.
+        return set()
+    return {os.path.realpath(resolve_output_dir(config_path, output_dir)) for output_dir in output_dirs}
+
+
+def check_output_dirs(config_paths : List[str]):
+    """Refuse configs that would write to the same output dir at the same time."""
+    owners = {}
+    for config_path in config_paths:
+        for output_dir in get_output_dirs(config_path):
+            if output_dir in owners:
+                raise BatchException(
+                    f'{config_path} and {owners[output_dir]} both write to {output_dir}.'
+                    ' Each config needs its own output_dir.')
+            owners[output_dir] = config_path
+
+
+def sync_config(config_path : str, jobs : int = 1) -> ConfigSyncResult:
+    """Sync all providers of a config file, capturing its output and any failure."""
+    output = io.StringIO()
+    provider_results = []
+    error = None
+    start_time = time.monotonic()
+
+    with redirect_stdout(output):
+        try:
+            client = LedgerLinkerClient(config_path)
+            try:
+                provider_results = client.sync(jobs=jobs)
+            finally:
+                client.close()
+        except SystemExit as exit_error:
+            # The client prints why and exits on invalid configs; that must not stop the worker.
+            printed = output.getvalue().strip().splitlines()
+            error = printed[-1] if printed else f'Exited with status {exit_error.code}'
+        except Exception as sync_error:
+            error = str(sync_error) or type(sync_error).__name__
+            traceback.print_exc(file=output)
+
+    # Exceptions may not survive being sent back to the parent process.
+    provider_results = [
+        ProviderSyncResult(
+            result.provider_name,
+            result.wall_time,
+            result.rows_written,
+            None if result.error is None else str(result.error) or type(result.error).__name__)
+        for result in provider_results
+    ]
+    return ConfigSyncResult(config_path, time.monotonic() - start_time, provider_results, error, output.getvalue())
+
+
+def _init_worker(host_limiter : Optional[HostLimiter]):
+    set_host_limiter(host_limiter)
+
+
+class BatchRunner:
+    """Sync config files on a pool of worker processes."""
+
+    def __init__(
+        self,
+        config_paths : List[str],
+        processes : Optional[int] = None,
+        jobs : int = 1,
+        max_requests_per_host : Optional[int] = None,
+        host_limits : Optional[Dict[str, int]] = None
+    ):
+        check_output_dirs(config_paths)
+        self.config_paths = config_paths
+        self.processes = processes or os.cpu_count() or 1
+        self.jobs = jobs
+        self._context = multiprocessing.get_context()
+
+        self.host_limiter = None
+        if max_requests_per_host is not None or host_limits:
+            self.host_limiter = HostLimiter(
+                default_limit=max_requests_per_host,
+                host_limits=host_limits,
+                semaphore_factory=self._context.BoundedSemaphore)
+
+    def run(self, verbose : bool = False) -> List[ConfigSyncResult]:
+        results = []
+        processes = max(1, min(self.processes, len(self.config_paths)))
+        with self._context.Pool(processes, initializer=_init_worker, initargs=(self.host_limiter,)) as pool:
+            # One config per task so idle workers take the next config from the shared queue.
+            for result in pool.imap_unordered(partial(sync_config, jobs=self.jobs), self.config_paths, chunksize=1):
+                self.print_result(result, verbose)
+                results.append(result)
+
+        self.print_summary(results)
+        return results
+
+    def print_result(self, result : ConfigSyncResult, verbose : bool = False):
+        status = 'ok' if result.succeeded else 'FAILED'
+        print(f'{result.config_path}: {status} in {result.wall_time:.2f}s, {result.rows_written} rows')
+        if result.error is not None:
+            print(f'  {result.error}')
+        for provider_result in result.provider_results:
+            if not provider_result.succeeded:
+                print(f'  {provider_result.provider_name}: {provider_result.error}')
+        if verbose or not result.succeeded:
+            for line in result.output.splitlines():
+                print(f'    {line}')
+
+    def print_summary(self, results : List[ConfigSyncResult]):
+        failed = [result for result in results if not result.succeeded]
+        print(
+            f'Synced {len(results) - len(failed)} of {len(results)} configs,'
+            f' {sum(result.rows_written for result in results)} rows.')
+        for result in failed:
+            print(f'  FAILED {result.config_path}')
+
+
+def parse_host_limits(values : Iterable[str]) -> Dict[str, int]:
+    """Parse `HOST=LIMIT` command line values."""
+    host_limits = {}
+    for value in values:
+        host, separator, limit = value.partition('=')
+        if not separator or not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f'Invalid host limit {value}. Expected HOST=LIMIT, e.g. app.ledgerlinker.com=8.')
+        host_limits[host] = int(limit)
+    return host_limits
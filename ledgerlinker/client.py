@@ -1,14 +1,19 @@
 from typing import Optional, List, Dict
+import asyncio
 import os
 import sys
+import time
 import argparse
 import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
 from json import JSONDecodeError
 from datetime import date
-import commentjson
+from ledgerlinker.metrics import MetricsRecorder
 from ledgerlinker.providers import get_providers
-from ledgerlinker.providers.base import Provider, ProviderConfig
-from ledgerlinker.update_tracker import LastUpdateTracker
+from ledgerlinker.providers.base import AsyncProvider, Provider, ProviderConfig
+from ledgerlinker.update_tracker import StagedUpdateTracker, get_update_tracker
 
 
 DEFAULT_CONFIG_FILE = '~/.ledgerlink-config.json'
@@ -16,36 +21,317 @@ DEFAULT_CONFIG_FILE = '~/.ledgerlink-config.json'
 class LedgerLinkerException(Exception):
     pass
 
+class ProviderSyncResult:
+    """The outcome of syncing a single provider."""
+
+    def __init__(self, provider_name : str, wall_time : float, rows_written : int, error : Optional[Exception] = None):
+        self.provider_name = provider_name
+        self.wall_time = wall_time
+        self.rows_written = rows_written
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
 class ClientConfig:
     def __init__(self, global_config, providers):
         self.providers = providers
         self.config = global_config
 
+def resolve_output_dir(config_file_path : str, output_dir : str) -> str:
+    """Resolve an output_dir from a config file; relative paths are relative to the config file."""
+    config_dir = os.path.dirname(os.path.abspath(config_file_path))
+    return os.path.normpath(os.path.join(config_dir, os.path.expanduser(output_dir)))
+
+
 class LedgerLinkerClient:
     """A client for using LedgerLinker Providers."""
 
-    def __init__(self, config_file_path):
+    def __init__(
+        self,
+        config_file_path,
+        metrics_file : Optional[str] = None,
+        metrics : Optional[MetricsRecorder] = None
+    ):
+        self.config_file_path = config_file_path
         self.config = self._load_config_file(config_file_path)
-        self.providers = get_providers(self.config.providers)
-        self.last_update_tracker = LastUpdateTracker(self._last_link_path)
+        self.metrics = metrics or MetricsRecorder()
+        self.metrics_file = metrics_file
+        self.providers = self._create_providers(self.config.providers)
+        self.last_update_tracker = self._open_update_tracker()
+        self.http_limiter = None
+        self._http_client = None
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+
+    def _create_providers(self, provider_configs : Dict[str, ProviderConfig]) -> Dict[str, Provider]:
+        providers = get_providers(provider_configs)
+        for provider in providers.values():
+            provider.set_metrics(self.metrics)
+        return providers
+
+    def get_metrics_file(self) -> Optional[str]:
+        """The file metrics are written to after each sync; the command line wins over the config."""
+        metrics_file = self.metrics_file or self.config.config.get('metrics_file')
+        if metrics_file is None:
+            return None
+        return os.path.expanduser(metrics_file)
+
+    def _open_update_tracker(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Tracker updates are committed once per provider rather than once per export.
+        return get_update_tracker(
+            self.output_dir,
+            backend=self.config.config.get('state_backend', 'json'),
+            autocommit=False)
+
+    def reload_config(self):
+        """Reload the config file, keeping the instances of providers whose config is unchanged.
+
+        Kept providers hold on to their HTTP sessions and logins.
+        """
+        previous_output_dir = self.output_dir
+        previous_backend = self.config.config.get('state_backend', 'json')
+        try:
+            self.config = self._load_config_file(self.config_file_path)
+        except (Exception, SystemExit):
+            self.output_dir = previous_output_dir
+            raise
+
+        providers = {}
+        for provider_name, provider_config in self.config.providers.items():
+            existing_provider = self.providers.get(provider_name)
+            if existing_provider is not None and vars(existing_provider.config) == vars(provider_config):
+                providers[provider_name] = existing_provider
+            else:
+                providers.update(self._create_providers({provider_name: provider_config}))
+        self.providers = providers
+
+        if (self.output_dir, self.config.config.get('state_backend', 'json')) != (previous_output_dir, previous_backend):
+            self.last_update_tracker.close()
+            self.last_update_tracker = self._open_update_tracker()
 
-    def sync(self, desired_providers : List[str] = None):
+    def sync(
+        self,
+        desired_providers : List[str] = None,
+        jobs : int = 1,
+        profile_dir : Optional[str] = None
+    ) -> List[ProviderSyncResult]:
         """Sync all loaded providers.
 
         desired_providers: A list of provider names to sync. If not provided, all providers will be synced.
+        jobs: The number of providers to sync at the same time.
+        profile_dir: If provided, write CPU and allocation profiles of each provider's sync to
+            this directory. Providers are then synced one at a time, whatever `jobs` is.
+
+        Async providers run on one event loop sharing an HTTP client, others on worker threads.
+        """
+        provider_names = [
+            provider_name
+            for provider_name in self.providers.keys()
+            if not desired_providers or provider_name in desired_providers
+        ]
+
+        with ExitStack() as stack:
+            profiler = None
+            if profile_dir is not None:
+                # Imported here as profiling is rarely enabled.
+                from ledgerlinker.profiling import SyncProfiler
+                profiler = stack.enter_context(SyncProfiler(profile_dir))
+                if jobs > 1:
+                    print('Profiling syncs one provider at a time.')
+                    jobs = 1
+
+            results = self._get_event_loop().run_until_complete(
+                self.sync_providers_async(provider_names, jobs, profiler))
+
+        if profile_dir is not None:
+            print(f'Wrote profiles to {profile_dir}')
+
+        self.print_summary(results)
+        self.write_metrics()
+        return results
+
+    def write_metrics(self):
+        metrics_file = self.get_metrics_file()
+        if metrics_file is None:
+            return
+
+        try:
+            self.metrics.write(metrics_file)
+        except OSError as error:
+            print(f'Failed to write metrics to {metrics_file}: {error}')
+
+    def sync_provider(self, provider_name : str, profiler = None) -> ProviderSyncResult:
+        """Sync a single provider, capturing any failure so other providers can continue.
+
+        profiler: An optional `SyncProfiler` to profile the sync with.
+        """
+        provider = self.providers[provider_name]
+        rows_before = provider.rows_written
+        error = None
+
+        print(f'Running sync for {provider_name}...')
+        start_time = time.monotonic()
+        # Tracker updates are only committed once the provider's outputs are flushed.
+        update_tracker = StagedUpdateTracker(self.last_update_tracker)
+        try:
+            sync_options = {}
+            if profiler is not None and isinstance(provider, AsyncProvider):
+                # cProfile only sees the thread it runs on, so the blocking stages run on it too.
+                sync_options['inline'] = True
+            with profiler.profile(provider_name) if profiler is not None else nullcontext():
+                provider.sync(update_tracker, **sync_options)
+        except Exception as sync_error:
+            error = sync_error
+            print(f'Sync failed for {provider_name}: {sync_error}')
+            traceback.print_exc()
+        finally:
+            provider.close()
+            update_tracker.commit()
+
+        result = ProviderSyncResult(
+            provider_name,
+            time.monotonic() - start_time,
+            provider.rows_written - rows_before,
+            error)
+        self.record_sync_metrics(result)
+        return result
+
+    async def sync_providers_async(
+        self,
+        provider_names : List[str],
+        jobs : int = 1,
+        profiler = None
+    ) -> List[ProviderSyncResult]:
+        """Sync providers on the running event loop, at most `jobs` at a time."""
+        http_client = self.get_http_client()
+        semaphore = asyncio.Semaphore(max(jobs, 1))
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+
+            async def sync_provider(provider_name):
+                async with semaphore:
+                    provider = self.providers[provider_name]
+                    # cProfile only sees the thread it runs on, so profiled providers get their own.
+                    if isinstance(provider, AsyncProvider) and profiler is None:
+                        return await self.sync_provider_async(provider_name, http_client)
+                    return await loop.run_in_executor(executor, self.sync_provider, provider_name, profiler)
+
+            return list(await asyncio.gather(*(sync_provider(provider_name) for provider_name in provider_names)))
+
+    def get_http_limiter(self) -> 'AdaptiveLimiter':
+        """The per host limits of async providers' requests, kept across syncs.
+
+        A new limiter, starting over from the initial limit, is only created when the
+        `http_initial_concurrency` or `http_max_concurrency` options change.
         """
+        # Imported here so the HTTP libraries are only loaded once a sync starts.
+        from ledgerlinker.adaptive_limit import AdaptiveLimiter, DEFAULT_INITIAL_LIMIT, DEFAULT_MAX_LIMIT
+
+        initial_limit = self.config.config.get('http_initial_concurrency', DEFAULT_INITIAL_LIMIT)
+        max_limit = self.config.config.get('http_max_concurrency', DEFAULT_MAX_LIMIT)
+        limiter = self.http_limiter
+        if limiter is None or (limiter.initial_limit, limiter.max_limit) != (initial_limit, max_limit):
+            self.http_limiter = AdaptiveLimiter(
+                initial_limit=initial_limit, max_limit=max_limit, on_change=self.record_concurrency_limit)
+        return self.http_limiter
 
-        for provider_name, provider in self.providers.items():
-            if desired_providers:
-                if provider_name not in desired_providers:
-                    continue
+    def get_http_client(self) -> 'AsyncHTTPClient':
+        """The HTTP client shared by async providers, kept with its connections across syncs."""
+        from ledgerlinker.async_http import AsyncHTTPClient
 
-            print(f'Running sync for {provider_name}...')
-            provider.sync(self.last_update_tracker)
+        if self._http_client is None:
+            self._http_client = AsyncHTTPClient(hooks=[self.record_request_event], limiter=self.get_http_limiter())
+        else:
+            self._http_client.limiter = self.get_http_limiter()
+        return self._http_client
 
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        # Syncs share a loop, as the HTTP client's connections belong to the loop they were made on.
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def close(self):
+        """Close the shared HTTP client and its event loop, and the update tracker."""
+        if self._loop is not None:
+            if self._http_client is not None:
+                self._loop.run_until_complete(self._http_client.close())
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+            self._loop.close()
+        self._loop = None
+        self._http_client = None
+        self.last_update_tracker.close()
+
+    async def sync_provider_async(self, provider_name : str, http_client) -> ProviderSyncResult:
+        """Sync a single async provider with the shared HTTP client, capturing any failure."""
+        provider = self.providers[provider_name]
+        rows_before = provider.rows_written
+        error = None
+
+        print(f'Running sync for {provider_name}...')
+        start_time = time.monotonic()
+        update_tracker = StagedUpdateTracker(self.last_update_tracker)
+        provider.set_http_client(http_client)
+        try:
+            await provider.sync_async(update_tracker)
+        except Exception as sync_error:
+            error = sync_error
+            print(f'Sync failed for {provider_name}: {sync_error}')
+            traceback.print_exc()
+        finally:
+            provider.set_http_client(None)
+            provider.close()
+            update_tracker.commit()
+
+        result = ProviderSyncResult(
+            provider_name,
+            time.monotonic() - start_time,
+            provider.rows_written - rows_before,
+            error)
+        self.record_sync_metrics(result)
+        return result
+
+    def record_request_event(self, event):
+        """Record the latency and outcome of each attempt at a request, per upstream host."""
+        status = 'error' if event.status_code is None else str(event.status_code)
+        self.metrics.observe('http_attempt_seconds', event.seconds, host=event.host)
+        self.metrics.increment('http_attempts', host=event.host, status=status)
+
+    def record_concurrency_limit(self, host : str, limit : int):
+        self.metrics.set_gauge('http_concurrency_limit', limit, host=host)
+
+    def record_sync_metrics(self, result : ProviderSyncResult):
+        now = time.time()
+        self.metrics.observe('provider_sync_seconds', result.wall_time, provider=result.provider_name)
+        self.metrics.increment('provider_syncs', provider=result.provider_name)
+        self.metrics.set_gauge('provider_last_sync_timestamp_seconds', now, provider=result.provider_name)
+        if result.succeeded:
+            self.metrics.set_gauge('provider_last_success_timestamp_seconds', now, provider=result.provider_name)
+        else:
+            self.metrics.increment('provider_sync_failures', provider=result.provider_name)
+
+    def print_summary(self, results : List[ProviderSyncResult]):
+        """Print the wall time and rows written for each synced provider."""
+        if not results:
+            return
+
+        name_width = max(len(result.provider_name) for result in results)
+        print('Sync summary:')
+        for result in results:
+            status = 'ok' if result.succeeded else 'FAILED'
+            print(
+                f'  {result.provider_name:<{name_width}}  {status:<6}'
+                f'  {result.wall_time:8.2f}s  {result.rows_written:>8} rows')
 
     def _load_config_file(self, config_file_path : str):
         """Load the config file from the given path."""
+        # Imported here as the comment aware parser is only needed once per run and is slow to import.
+        import commentjson
+
         try:
             with open(config_file_path, 'r') as config_file:
                 config = commentjson.load(config_file)
@@ -65,7 +351,8 @@ class LedgerLinkerClient:
             print('No output_dir found in config file.')
             sys.exit(1)
 
-        self.output_dir = config['output_dir']
+        # Not the cwd, so that configs run by `ledgerlinker batch` write to their own files.
+        self.output_dir = resolve_output_dir(config_file_path, config['output_dir'])
 
         providers = {}
         for provider_config in config['providers']:
@@ -78,26 +365,122 @@ class LedgerLinkerClient:
                 print(f'Provider with name {provider_name} already exists.')
                 sys.exit(1)
 
-            if 'output_dir' not in provider_config:
+            if 'output_dir' in provider_config:
+                provider_config['output_dir'] = resolve_output_dir(config_file_path, provider_config['output_dir'])
+            else:
                 provider_config['output_dir'] = self.output_dir
 
-            config = ProviderConfig(**provider_config)
-            providers[provider_config['name']] = config
+            providers[provider_config['name']] = ProviderConfig(**provider_config)
 
-        self._last_link_path = f'{self.output_dir}/.last_links.json'
         return ClientConfig(config, providers)
 
 
+def run_daemon(args):
+    import signal
+    from ledgerlinker.daemon import SyncDaemon
+
+    daemon = SyncDaemon(args.config, jobs=args.jobs, metrics_file=args.metrics_file)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+def run_batch(args):
+    from ledgerlinker.batch import BatchException, BatchRunner, find_config_files, parse_host_limits
+
+    try:
+        host_limits = parse_host_limits(args.host_limit)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+
+    config_paths = find_config_files(args.configs)
+    if not config_paths:
+        print('No config files found.')
+        sys.exit(1)
+
+    try:
+        runner = BatchRunner(
+            config_paths,
+            processes=args.processes,
+            jobs=args.jobs,
+            max_requests_per_host=args.max_requests_per_host,
+            host_limits=host_limits)
+    except BatchException as error:
+        print(error)
+        sys.exit(1)
+    results = runner.run(verbose=args.verbose)
+    if not all(result.succeeded for result in results):
+        sys.exit(1)
+
+
+def run_rerender(args):
+    from ledgerlinker.rerender import Rerenderer
+
+    client = LedgerLinkerClient(args.config)
+    providers = client.providers
+    if args.providers:
+        providers = {name: provider for name, provider in providers.items() if name in args.providers}
+    try:
+        results = Rerenderer(providers, processes=args.processes, force=args.force).run(verbose=args.verbose)
+    finally:
+        client.close()
+    if not all(result.succeeded for result in results):
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Sync client for the LedgerLinker Service.')
-    parser.add_argument('-c', '--config', required=True, help='Path to LedgerLinker Sync config file')
+    parser.add_argument('command', nargs='?', default='sync', choices=['sync', 'daemon', 'batch', 'rerender'], help='Sync once (default), keep running and sync each provider on its interval, sync many config files, or rebuild outputs from archived responses.')
+    parser.add_argument('configs', nargs='*', default=[], help='batch: config files, or directories of .json config files, to sync.')
+    parser.add_argument('-c', '--config', help='Path to LedgerLinker Sync config file')
     parser.add_argument('-p', '--providers', nargs='*', default=[], help='A list of providers to sync by "name". If not provided, all providers will be synced.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of providers to sync in parallel.')
+    parser.add_argument('--profile', action='store_true', help='Write CPU profiles, collapsed stacks for flamegraphs and memory allocation reports per provider to a .profile directory in the output dir.')
+    parser.add_argument('--metrics-file', default=None, help='Write sync metrics to this file after each sync. A `.prom` file is written in the Prometheus text format, anything else as JSON.')
+    parser.add_argument('--processes', type=int, default=None, help='batch: the number of configs to sync in parallel. rerender: the number of exports to render in parallel. Defaults to the number of CPUs.')
+    parser.add_argument('--max-requests-per-host', type=int, default=None, help='batch: the most requests in flight to any one upstream host across all configs.')
+    parser.add_argument('--host-limit', action='append', default=[], metavar='HOST=N', help='batch: the most requests in flight to HOST across all configs. May be repeated.')
+    parser.add_argument('--force', action='store_true', help='rerender: also rebuild exports whose archive starts after their first sync, dropping the rows synced before it.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='batch, rerender: print the output of every config or export, not just failed ones.')
 
     args = parser.parse_args()
-    client = LedgerLinkerClient(args.config)
-    client.sync(
-        desired_providers=args.providers
-    )
+    if args.command == 'batch':
+        if not args.configs:
+            parser.error('batch requires at least one config file or directory')
+        run_batch(args)
+        return
+
+    if args.configs:
+        parser.error('config paths are only accepted by batch, use -c/--config')
+    if args.config is None:
+        parser.error('the following arguments are required: -c/--config')
+    if args.command == 'daemon':
+        run_daemon(args)
+        return
+    if args.command == 'rerender':
+        run_rerender(args)
+        return
+
+    client = LedgerLinkerClient(args.config, metrics_file=args.metrics_file)
+    profile_dir = None
+    if args.profile:
+        from ledgerlinker.profiling import get_default_profile_dir
+        profile_dir = get_default_profile_dir(client.output_dir)
+
+    try:
+        results = client.sync(
+            desired_providers=args.providers,
+            jobs=args.jobs,
+            profile_dir=profile_dir
+        )
+    finally:
+        client.close()
+
+    if not all(result.succeeded for result in results):
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
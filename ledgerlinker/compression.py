@@ -0,0 +1,116 @@
+"""Compressed output files that can be appended to.
+
+gzip members and zstd frames can be concatenated: a file holding several of them
+decompresses to the concatenation of their contents. Each append adds a new member
+to the end of the file, so earlier data is never rewritten and reading the header
+only decompresses the start of the file.
+
+zstd support requires the zstandard package.
+"""
+from typing import BinaryIO, Optional, TextIO
+import gzip
+import io
+import os
+
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+# Matches the default of the gzip command line tool, trading a little size for speed.
+GZIP_COMPRESS_LEVEL = 6
+
+# The zstandard default level.
+ZSTD_COMPRESS_LEVEL = 3
+
+
+class CompressionException(Exception):
+    pass
+
+
+def get_extension(compression : Optional[str]) -> str:
+    """The file name suffix of a compression, or an empty string for uncompressed files."""
+    if compression is None:
+        return ''
+
+    try:
+        return COMPRESSION_EXTENSIONS[compression]
+    except KeyError:
+        raise CompressionException(
+            f'Unknown compression {compression}. Available compressions: {", ".join(COMPRESSION_EXTENSIONS)}')
+
+
+def load_zstandard():
+    """Load zstandard, which is only required when zstd compression is configured."""
+    try:
+        import zstandard
+    except ModuleNotFoundError:
+        raise CompressionException(
+            'Cannot use zstd compression because zstandard is not installed. Please install the zstandard package.'
+            'pip install zstandard'
+        )
+    return zstandard
+
+
+def open_binary_reader(path : str, compression : Optional[str]) -> BinaryIO:
+    """Open a possibly compressed file for reading bytes, decompressing it as it is read."""
+    get_extension(compression)
+    if compression is None:
+        return open(path, 'rb')
+
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+
+    return io.BufferedReader(load_zstandard().ZstdDecompressor().stream_reader(
+        open(path, 'rb'), read_across_frames=True, closefd=True))
+
+
+def open_reader(path : str, compression : Optional[str]) -> TextIO:
+    """Open a possibly compressed text file for reading, decompressing it as it is read."""
+    if compression is None:
+        return open(path, 'r', newline='', encoding='utf-8')
+
+    return io.TextIOWrapper(open_binary_reader(path, compression), encoding='utf-8', newline='')
+
+
+class CompressedAppender:
+    """Append one new compressed member to a file.
+
+    Writes are buffered and compressed as the buffer fills. `close` finishes the
+    member and syncs the file to disk. Pass `binary=True` to write bytes instead of text.
+    """
+
+    def __init__(self, path : str, compression : str, buffer_size : int = io.DEFAULT_BUFFER_SIZE, binary : bool = False):
+        get_extension(compression)
+        self.path = path
+        self._file = open(path, 'ab')
+
+        if compression == 'gzip':
+            compressor = gzip.GzipFile(fileobj=self._file, mode='ab', compresslevel=GZIP_COMPRESS_LEVEL)
+        else:
+            compressor = load_zstandard().ZstdCompressor(level=ZSTD_COMPRESS_LEVEL).stream_writer(
+                self._file, closefd=False, write_return_read=True)
+
+        self._stream : BinaryIO = io.BufferedWriter(compressor, buffer_size)
+        if not binary:
+            self._stream = io.TextIOWrapper(self._stream, encoding='utf-8', newline='')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data):
+        return self._stream.write(data)
+
+    def flush(self):
+        """Hand buffered data to the compressor. It only becomes readable once the appender is closed."""
+        self._stream.flush()
+
+    def close(self):
+        # Closing the compressor writes the end of the member but leaves the file open.
+        self._stream.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
@@ -0,0 +1,133 @@
+"""Run providers on their own schedules in a long running process.
+
+Keeping the process alive lets providers reuse their HTTP sessions and logins and
+keeps the update tracker loaded between runs. Each provider is synced every
+`sync_interval` seconds (set per provider or globally in the config), delayed by
+up to `sync_jitter` seconds so providers sharing an interval do not fire together.
+The config file is reloaded whenever its modification time changes.
+"""
+from typing import Callable, Dict, List, Optional
+import os
+import random
+import threading
+import time
+from ledgerlinker.client import LedgerLinkerClient
+from ledgerlinker.metrics import MetricsRecorder
+
+DEFAULT_SYNC_INTERVAL = 15 * 60
+DEFAULT_SYNC_JITTER = 0
+
+# Longest time to sleep before checking the config file for changes again.
+MAX_SLEEP = 60
+
+
+class SyncDaemon:
+    """Sync each configured provider on its own interval.
+
+    metrics: The recorder the client records every sync into, kept across config reloads.
+    """
+
+    def __init__(
+        self,
+        config_file_path : str,
+        jobs : int = 1,
+        clock : Callable[[], float] = time.monotonic,
+        client_class = LedgerLinkerClient,
+        metrics_file : Optional[str] = None,
+        metrics : Optional[MetricsRecorder] = None
+    ):
+        self.config_file_path = config_file_path
+        self.jobs = jobs
+        self._clock = clock
+        self._stop_event = threading.Event()
+
+        self.client = client_class(config_file_path, metrics_file=metrics_file, metrics=metrics)
+        self.metrics = self.client.metrics
+        self._config_mtime = self._get_config_mtime()
+        self._next_run : Dict[str, float] = {}
+        self._schedule_new_providers()
+
+    def _get_config_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.config_file_path)
+        except FileNotFoundError:
+            return None
+
+    def _get_option(self, provider_name : str, option : str, default : float) -> float:
+        provider_config = self.client.providers[provider_name].config
+        if hasattr(provider_config, option):
+            return getattr(provider_config, option)
+        return self.client.config.config.get(option, default)
+
+    def get_interval(self, provider_name : str) -> float:
+        return self._get_option(provider_name, 'sync_interval', DEFAULT_SYNC_INTERVAL)
+
+    def get_jitter(self, provider_name : str) -> float:
+        return self._get_option(provider_name, 'sync_jitter', DEFAULT_SYNC_JITTER)
+
+    def _schedule_new_providers(self):
+        """Run newly added providers straight away and forget removed ones."""
+        now = self._clock()
+        self._next_run = {
+            provider_name: self._next_run.get(provider_name, now)
+            for provider_name in self.client.providers
+        }
+
+    def _schedule(self, provider_name : str, now : float):
+        jitter = self.get_jitter(provider_name)
+        self._next_run[provider_name] = now + self.get_interval(provider_name) + random.uniform(0, jitter)
+
+    def reload_config_if_changed(self) -> bool:
+        """Reload the config if the file changed. A broken config keeps the previous one."""
+        mtime = self._get_config_mtime()
+        if mtime is None or mtime == self._config_mtime:
+            return False
+
+        self._config_mtime = mtime
+        print(f'Config file {self.config_file_path} changed. Reloading...')
+        try:
+            self.client.reload_config()
+        except (Exception, SystemExit) as error:
+            print(f'Failed to reload config, keeping the previous one: {error}')
+            return False
+
+        self._schedule_new_providers()
+        return True
+
+    def get_due_providers(self) -> List[str]:
+        now = self._clock()
+        return [
+            provider_name
+            for provider_name, next_run in self._next_run.items()
+            if next_run <= now
+        ]
+
+    def run_once(self) -> List[str]:
+        """Sync the providers that are due and schedule their next run."""
+        due_providers = self.get_due_providers()
+        if due_providers:
+            self.client.sync(desired_providers=due_providers, jobs=self.jobs)
+
+            now = self._clock()
+            for provider_name in due_providers:
+                self._schedule(provider_name, now)
+
+        return due_providers
+
+    def seconds_until_next_run(self) -> float:
+        if not self._next_run:
+            return MAX_SLEEP
+        return max(0, min(min(self._next_run.values()) - self._clock(), MAX_SLEEP))
+
+    def run_forever(self):
+        print(f'Starting daemon for {self.config_file_path}.')
+        while not self._stop_event.is_set():
+            self.reload_config_if_changed()
+            self.run_once()
+            self._stop_event.wait(self.seconds_until_next_run())
+
+        self.client.close()
+        print('Daemon stopped.')
+
+    def stop(self):
+        self._stop_event.set()
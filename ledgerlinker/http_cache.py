@@ -0,0 +1,90 @@
+"""A local cache for small JSON API responses that rarely change.
+
+Entries are keyed by the credential and url they were fetched with. A fresh entry
+(younger than the TTL) is used without any request; a stale one is revalidated with
+`If-None-Match`/`If-Modified-Since` so an unchanged response costs a 304 only.
+Entries are also kept in memory so a long running process never re-parses them.
+"""
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ResponseCache:
+    """A directory of cached JSON responses with their validators."""
+
+    def __init__(self, cache_dir : str, ttl : float = 0):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._entries : Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(credential : str, url : str) -> str:
+        return hashlib.sha256(f'{credential}\n{url}'.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key : str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def lookup(self, key : str) -> Optional[Dict]:
+        """Return the cached entry for a key, if any."""
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+        try:
+            with open(self._entry_path(key), 'r') as entry_file:
+                entry = json.load(entry_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def is_fresh(self, entry : Dict) -> bool:
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry : Optional[Dict]) -> Dict[str, str]:
+        """Headers asking the server to answer 304 if the cached response is still current."""
+        headers = {}
+        if entry is None:
+            return headers
+
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key : str, data : Any, response) -> Dict:
+        """Cache the decoded body of a response along with its validators."""
+        entry = {
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'data': data,
+        }
+        self._write(key, entry)
+        return entry
+
+    def refresh(self, key : str, entry : Dict) -> Dict:
+        """Mark an entry as revalidated by a 304 response."""
+        entry = dict(entry, fetched_at=time.time())
+        self._write(key, entry)
+        return entry
+
+    def _write(self, key : str, entry : Dict):
+        with self._lock:
+            self._entries[key] = entry
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temp_path, self._entry_path(key))
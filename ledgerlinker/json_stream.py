@@ -0,0 +1,126 @@
+"""Incremental parsing of large JSON objects.
+
+The LedgerLinker service returns exports as a single JSON object whose `transactions`
+array can hold years of history. `iter_json_object` walks the top level of such an
+object while it is being downloaded, yielding the elements of selected arrays one at
+a time so the whole payload never has to be held in memory.
+"""
+from typing import Any, Iterable, Iterator, Tuple, Union
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+# Drop consumed text from the buffer once it grows past this many characters.
+COMPACT_THRESHOLD = 64 * 1024
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class _Reader:
+    """A text buffer over a stream of byte or str chunks."""
+
+    def __init__(self, chunks : Iterable[Union[bytes, str]]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> bool:
+        """Append the next chunk to the buffer. Returns False once the stream is exhausted."""
+        if self.eof:
+            return False
+
+        if self.pos > COMPACT_THRESHOLD:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                self.buffer += chunk
+                return True
+
+        self.buffer += self._decoder.decode(b'', final=True)
+        self.eof = True
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.read_more():
+                raise JSONStreamError('Unexpected end of JSON stream.')
+
+    def expect(self, characters : str) -> str:
+        """Consume the next character, which must be one of `characters`."""
+        character = self.peek()
+        if character not in characters:
+            raise JSONStreamError(f'Expected one of {characters!r} at offset {self.pos}, found {character!r}.')
+        self.pos += 1
+        return character
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+
+            # A number ending exactly at the end of the buffer may continue in the next chunk.
+            if end == len(self.buffer) and not self.eof:
+                self.read_more()
+                continue
+
+            self.pos = end
+            return value
+
+
+def iter_json_object(
+    chunks : Iterable[Union[bytes, str]],
+    stream_keys : Tuple[str, ...] = ()
+) -> Iterator[Tuple[str, Any]]:
+    """Iterate over the top level `(key, value)` pairs of a JSON object read from `chunks`.
+
+    Arrays stored under one of `stream_keys` are not materialized; instead a
+    `(key, element)` pair is yielded for each of their elements.
+    """
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise JSONStreamError(f'Expected an object key at offset {reader.pos}.')
+        reader.expect(':')
+
+        if key in stream_keys and reader.peek() == '[':
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            yield key, reader.value()
+
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,180 @@
+"""Instrumentation of sync runs.
+
+Providers record counters, timings and gauges labelled by provider and export into a
+`MetricsRecorder`. After a sync the client writes the recorded metrics either as a
+Prometheus textfile (for node_exporter's textfile collector) or as a JSON summary.
+"""
+from typing import Dict, Iterable, Iterator, Tuple
+from contextlib import contextmanager
+import json
+import os
+import tempfile
+import threading
+import time
+
+METRIC_PREFIX = 'ledgerlinker_'
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels : Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRecorder:
+    """A thread safe collection of counters, timings and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters : Dict[Tuple[str, Labels], float] = {}
+        self._timings : Dict[Tuple[str, Labels], list] = {}
+        self._gauges : Dict[Tuple[str, Labels], float] = {}
+
+    def increment(self, name : str, value : float = 1, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name : str, seconds : float, **labels):
+        """Record one duration. Count, sum and maximum are kept per label set."""
+        key = (name, _labels_key(labels))
+        with self._lock:
+            timing = self._timings.setdefault(key, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def set_gauge(self, name : str, value : float, **labels):
+        with self._lock:
+            self._gauges[(name, _labels_key(labels))] = value
+
+    @contextmanager
+    def timer(self, name : str, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def get_counter(self, name : str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, _labels_key(labels)), 0)
+
+    def get_timing(self, name : str, **labels) -> Tuple[int, float, float]:
+        """Return the count, sum and maximum of a timing."""
+        with self._lock:
+            return tuple(self._timings.get((name, _labels_key(labels)), (0, 0.0, 0.0)))
+
+    def get_gauge(self, name : str, **labels) -> float:
+        with self._lock:
+            return self._gauges.get((name, _labels_key(labels)))
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'generated_at': time.time(),
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'timings': [
+                    {'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': maximum}
+                    for (name, labels), (count, total, maximum) in sorted(self._timings.items())
+                ],
+                'gauges': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+            }
+
+    def to_prometheus(self) -> str:
+        """Render metrics in the Prometheus text exposition format."""
+        lines = []
+        for family, metric_type, samples in _group_samples(self.to_dict()):
+            lines.append(f'# TYPE {family} {metric_type}')
+            lines.extend(samples)
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path : str):
+        """Write the metrics as a Prometheus textfile if `path` ends in `.prom`, otherwise as JSON."""
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+
+        # Replace the file atomically so collectors never read a partial file.
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as metrics_file:
+            metrics_file.write(content)
+        os.replace(temp_path, path)
+
+
+def _format_labels(labels : Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    rendered = ','.join(
+        '{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + rendered + '}'
+
+
+def _group_samples(summary : Dict) -> Iterator[Tuple[str, str, list]]:
+    """Group the samples of a metrics summary into Prometheus metric families."""
+    families : Dict[Tuple[str, str], list] = {}
+
+    for counter in summary['counters']:
+        name = f"{METRIC_PREFIX}{counter['name']}_total"
+        families.setdefault((name, 'counter'), []).append(
+            f"{name}{_format_labels(counter['labels'])} {counter['value']}")
+
+    for timing in summary['timings']:
+        name = METRIC_PREFIX + timing['name']
+        labels = _format_labels(timing['labels'])
+        families.setdefault((name, 'summary'), []).extend([
+            f"{name}_sum{labels} {timing['sum']}",
+            f"{name}_count{labels} {timing['count']}",
+        ])
+        families.setdefault((f'{name}_max', 'gauge'), []).append(f"{name}_max{labels} {timing['max']}")
+
+    for gauge in summary['gauges']:
+        name = METRIC_PREFIX + gauge['name']
+        families.setdefault((name, 'gauge'), []).append(
+            f"{name}{_format_labels(gauge['labels'])} {gauge['value']}")
+
+    for (name, metric_type), samples in families.items():
+        yield name, metric_type, samples
+
+
+class TimedIterable:
+    """Wrap an iterable, accumulating the time spent producing its items."""
+
+    def __init__(self, iterable : Iterable):
+        self._iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start_time = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.seconds += time.perf_counter() - start_time
+
+
+class MeteredChunks(TimedIterable):
+    """Wrap a response body iterator, counting bytes and the time spent reading them."""
+
+    def __init__(self, chunks : Iterable[bytes]):
+        super().__init__(chunks)
+        self.bytes = 0
+
+    def __next__(self):
+        chunk = super().__next__()
+        self.bytes += len(chunk)
+        return chunk
@@ -0,0 +1,315 @@
+"""A small sidecar file describing a CSV output.
+
+`.<file>.index.json` records the output's fieldnames, row count, size in bytes, last
+row and a CRC-32 of its content as of the last time it was closed cleanly. Opening an
+output then only needs the sidecar and the last few kilobytes of the file, whatever
+the size of the output:
+
+* If the file ends where the index says, its header is taken from the index.
+* If the file is longer, a sync was interrupted while appending. Complete rows are
+  kept and indexed and a torn last line is truncated. For compressed files the
+  unfinished member is dropped, as it cannot be read.
+* If the file is shorter or its tail differs, it was changed by something else and
+  the index is rebuilt by scanning the file once.
+
+Outputs written before indexes existed are scanned once to create their index. Only
+bytes past the indexed size are ever truncated: an output that was changed or never
+indexed and lacks a final newline gets one if its last row is complete, and otherwise
+cannot be appended to until it is fixed.
+"""
+from typing import Dict, Iterable, List, Optional
+from csv import reader as csv_reader
+from functools import partial
+import io
+import json
+import os
+import tempfile
+import zlib
+from ledgerlinker.compression import CompressedAppender, open_binary_reader
+
+INDEX_VERSION = 1
+
+# Bytes at the end of the indexed content compared on open to detect a replaced file.
+TAIL_SIZE = 4096
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class OutputIndexException(Exception):
+    pass
+
+
+def get_index_path(path : str) -> str:
+    directory, file_name = os.path.split(path)
+    return os.path.join(directory, f'.{file_name}.index.json')
+
+
+def parse_records(records : List[bytes]) -> List[List[str]]:
+    """Parse complete CSV records, as split by `CSVRecordSplitter`."""
+    return list(csv_reader(io.StringIO(b'\n'.join(records).decode('utf-8'), newline='')))
+
+
+class CSVRecordSplitter:
+    """Split CSV encoded bytes into complete records, wherever the chunks they arrive in end.
+
+    A newline inside a quoted field is part of its record. The `\r\n` or `\n` ending a
+    record is removed; nothing inside a record is changed.
+    """
+
+    def __init__(self):
+        self._pending = b''
+        # How far `_pending` has been scanned, and whether that point is inside quotes.
+        self._scanned = 0
+        self._in_quotes = False
+
+    def feed(self, data : bytes) -> List[bytes]:
+        """Add the next chunk, returning the records it completes."""
+        pending = self._pending + data
+        records = []
+        start = 0
+        position = self._scanned
+        in_quotes = self._in_quotes
+        while True:
+            newline = pending.find(b'\n', position)
+            if newline < 0:
+                break
+            # An escaped quote ("") toggles twice, so the parity of quotes tells whether
+            # the newline is inside a quoted field.
+            if pending.count(b'"', position, newline) % 2:
+                in_quotes = not in_quotes
+            position = newline + 1
+            if not in_quotes:
+                end = newline - 1 if newline > start and pending[newline - 1] == 13 else newline
+                records.append(pending[start:end])
+                start = position
+
+        self._pending = pending[start:]
+        self._scanned = position - start
+        self._in_quotes = in_quotes
+        return records
+
+    @property
+    def pending_size(self) -> int:
+        """The number of bytes fed after the last complete record."""
+        return len(self._pending)
+
+    def finish(self) -> List[bytes]:
+        """Return the last record if the data did not end with a newline."""
+        pending, self._pending = self._pending, b''
+        self._scanned = 0
+        self._in_quotes = False
+        return [pending.rstrip(b'\r')] if pending.strip() else []
+
+
+def render_row(values : Iterable, fieldnames : List[str]) -> Dict[str, str]:
+    """Render row values as the CSV writer does."""
+    return {
+        fieldname: '' if value is None else str(value)
+        for fieldname, value in zip(fieldnames, values)
+    }
+
+
+class OutputIndex:
+    """The sidecar index of one output file."""
+
+    def __init__(self, path : str, compression : Optional[str] = None):
+        self.path = path
+        self.compression = compression
+        self.index_path = get_index_path(path)
+
+        self.fieldnames : Optional[List[str]] = None
+        self.row_count = 0
+        self.size = 0
+        self.crc32 = 0
+        self.tail_crc32 = 0
+        self.last_row : Optional[Dict[str, str]] = None
+
+    @classmethod
+    def open(cls, path : str, compression : Optional[str] = None) -> Optional['OutputIndex']:
+        """Load the index of an existing output, recovering from interrupted appends.
+
+        Returns None if the output does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+
+        index = cls(path, compression)
+        if not index.load():
+            print(f'Indexing {path}...')
+            index.rebuild()
+            return index
+
+        size = os.path.getsize(path)
+        if size < index.size or index.read_tail_crc32(index.size) != index.tail_crc32:
+            print(f'Warning: {path} was changed since it was last synced. Rebuilding its index.')
+            index.rebuild()
+        elif size > index.size:
+            index.recover(size)
+
+        return index
+
+    def load(self) -> bool:
+        try:
+            with open(self.index_path, 'r') as index_file:
+                data = json.load(index_file)
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            print(f'Warning: ignoring corrupt output index {self.index_path}.')
+            return False
+
+        if data.get('version') != INDEX_VERSION or data.get('compression') != self.compression:
+            return False
+
+        self.fieldnames = data['fieldnames']
+        self.row_count = data['row_count']
+        self.size = data['size']
+        self.crc32 = data['crc32']
+        self.tail_crc32 = data['tail_crc32']
+        self.last_row = data['last_row']
+        return True
+
+    def save(self):
+        """Replace the sidecar atomically so a crash never leaves it half written."""
+        directory = os.path.dirname(os.path.abspath(self.index_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.index.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump({
+                    'version': INDEX_VERSION,
+                    'compression': self.compression,
+                    'fieldnames': self.fieldnames,
+                    'row_count': self.row_count,
+                    'size': self.size,
+                    'crc32': self.crc32,
+                    'tail_crc32': self.tail_crc32,
+                    'last_row': self.last_row,
+                }, index_file)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            os.replace(temp_path, self.index_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def _read_range(self, start : int, end : int) -> Iterable[bytes]:
+        with open(self.path, 'rb') as fp:
+            fp.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = fp.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+    def read_tail_crc32(self, end : int) -> int:
+        return zlib.crc32(b''.join(self._read_range(max(0, end - TAIL_SIZE), end)))
+
+    def _extend(self, end : int):
+        """Add the bytes between the indexed size and `end` to the checksums."""
+        for chunk in self._read_range(self.size, end):
+            self.crc32 = zlib.crc32(chunk, self.crc32)
+        self.size = end
+        self.tail_crc32 = self.read_tail_crc32(end)
+
+    def record_append(self, rows_added : int, last_row : Optional[Dict[str, str]]):
+        """Index rows appended since the output was opened. Called once the output is closed."""
+        self._extend(os.path.getsize(self.path))
+        self.row_count += rows_added
+        if last_row is not None:
+            self.last_row = last_row
+        self.save()
+
+    def recover(self, size : int):
+        """Index or drop the bytes appended by a sync that was interrupted before closing the output."""
+        if self.fieldnames is None:
+            # Nothing but the header can have been appended to an empty file.
+            self.rebuild()
+            return
+
+        if self.compression is not None:
+            print(f'Warning: dropping an unfinished compressed member from the end of {self.path}.')
+            self._truncate(self.size)
+            return
+
+        appended = b''.join(self._read_range(self.size, size))
+        splitter = CSVRecordSplitter()
+        records = splitter.feed(appended)
+        if splitter.pending_size:
+            print(f'Warning: truncating a torn last line from {self.path}.')
+            self._truncate(size - splitter.pending_size)
+
+        rows = parse_records(records)
+        if rows:
+            print(f'Indexed {len(rows)} rows appended to {self.path} by an interrupted sync.')
+        self.record_append(len(rows), dict(zip(self.fieldnames or [], rows[-1])) if rows else None)
+
+    def _truncate(self, size : int):
+        with open(self.path, 'r+b') as fp:
+            fp.truncate(size)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def rebuild(self):
+        """Index an output by scanning all of it."""
+        self.fieldnames = None
+        self.row_count = 0
+        self.last_row = None
+        splitter = CSVRecordSplitter()
+        try:
+            with open_binary_reader(self.path, self.compression) as fp:
+                for chunk in iter(partial(fp.read, READ_CHUNK_SIZE), b''):
+                    self._index_records(splitter.feed(chunk))
+        except Exception as error:
+            # A compressed member cut short by a crash cannot be decompressed.
+            raise OutputIndexException(f'Cannot read {self.path}, it may be truncated: {error}')
+
+        last_record = splitter.finish()
+        if last_record:
+            self._complete_last_line(last_record[0])
+            self._index_records(last_record)
+
+        if self.last_row is not None:
+            self.last_row = dict(zip(self.fieldnames, self.last_row))
+
+        self.size = 0
+        self.crc32 = 0
+        self._extend(os.path.getsize(self.path))
+        self.save()
+
+    def _index_records(self, records : List[bytes]):
+        rows = parse_records(records)
+        if self.fieldnames is None and rows:
+            self.fieldnames = rows.pop(0)
+        if rows:
+            self.row_count += len(rows)
+            self.last_row = rows[-1]
+
+    def _complete_last_line(self, record : bytes):
+        """End a file whose last row lacks a newline, so rows can be appended after it."""
+        # An odd number of quotes leaves a quoted field open.
+        torn = record.count(b'"') % 2
+        if not torn and self.fieldnames is not None:
+            torn = len(parse_records([record])[0]) != len(self.fieldnames)
+        if torn:
+            raise OutputIndexException(
+                f'{self.path} ends with an incomplete row. Complete or remove it before syncing again.')
+
+        print(f'Warning: adding a missing newline to the end of {self.path}.')
+        if self.compression is not None:
+            with CompressedAppender(self.path, self.compression, binary=True) as fp:
+                fp.write(b'\n')
+            return
+
+        with open(self.path, 'ab') as fp:
+            fp.write(b'\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def verify(self) -> bool:
+        """Check the whole output against the indexed checksum."""
+        crc32 = 0
+        for chunk in self._read_range(0, self.size):
+            crc32 = zlib.crc32(chunk, crc32)
+        return crc32 == self.crc32 and os.path.getsize(self.path) == self.size
@@ -0,0 +1,166 @@
+"""Profile sync runs without wrapping the client by hand.
+
+A `SyncProfiler` captures, for each provider it is asked to profile:
+
+    <provider>.pstats     cProfile data for `python -m pstats` or snakeviz
+    <provider>.txt        the profile sorted by cumulative and by internal time
+    <provider>.collapsed  sampled stacks in the collapsed format read by flamegraph.pl
+                          and speedscope
+    <provider>.alloc.txt  the lines that allocated the most memory during the sync
+
+    with SyncProfiler(profile_dir) as profiler:
+        with profiler.profile('my-bank'):
+            provider.sync(update_tracker)
+
+cProfile only sees the thread it is enabled in, and from Python 3.12 only one profiler
+can be enabled in a process at a time. Profiled blocks therefore run one at a time:
+a block entered while another is being profiled waits for it to finish. That also
+keeps tracemalloc, which is process wide, from mixing the allocations of providers.
+"""
+from typing import Counter as CounterType, Optional
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+TRACEMALLOC_FRAMES = 10
+STATS_LIMIT = 50
+ALLOCATIONS_LIMIT = 30
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = os.path.basename(code.co_filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class StackSampler:
+    """Sample the stack of one thread at a fixed interval, counting identical stacks."""
+
+    def __init__(self, thread_id : int, interval : float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks : CounterType[str] = Counter()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ledgerlinker-stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(labels))] += 1
+
+    def write_collapsed(self, path : str):
+        with open(path, 'w') as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write(f'{stack} {count}\n')
+
+
+class SyncProfiler:
+    """Write CPU profiles, sampled stacks and allocation reports per provider into `profile_dir`."""
+
+    def __init__(self, profile_dir : str, sample_interval : float = DEFAULT_SAMPLE_INTERVAL):
+        self.profile_dir = profile_dir
+        self.sample_interval = sample_interval
+        self._started_tracemalloc = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def get_path(self, name : str, suffix : str) -> str:
+        return os.path.join(self.profile_dir, f'{name}{suffix}')
+
+    @contextmanager
+    def profile(self, name : str):
+        """Profile the code run in this block on the current thread, after any other profiled block."""
+        with self._lock:
+            with self._profile(name):
+                yield
+
+    @contextmanager
+    def _profile(self, name : str):
+        sampler = StackSampler(threading.get_ident(), self.sample_interval)
+        profile = cProfile.Profile()
+        snapshot_before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            snapshot_after = tracemalloc.take_snapshot() if snapshot_before is not None else None
+
+            profile.dump_stats(self.get_path(name, '.pstats'))
+            self.write_stats(profile, self.get_path(name, '.txt'))
+            sampler.write_collapsed(self.get_path(name, '.collapsed'))
+            if snapshot_after is not None:
+                self.write_allocations(snapshot_before, snapshot_after, self.get_path(name, '.alloc.txt'))
+
+    @staticmethod
+    def write_stats(profile : cProfile.Profile, path : str):
+        output = io.StringIO()
+        stats = pstats.Stats(profile, stream=output)
+        for sort_key in (pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME):
+            stats.sort_stats(sort_key).print_stats(STATS_LIMIT)
+
+        with open(path, 'w') as stats_file:
+            stats_file.write(output.getvalue())
+
+    @staticmethod
+    def write_allocations(
+        snapshot_before : tracemalloc.Snapshot,
+        snapshot_after : tracemalloc.Snapshot,
+        path : str,
+        limit : int = ALLOCATIONS_LIMIT
+    ):
+        # Leave out the memory tracemalloc and this module use for their own bookkeeping.
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        differences = snapshot_after.filter_traces(filters).compare_to(
+            snapshot_before.filter_traces(filters), 'lineno')
+
+        with open(path, 'w') as alloc_file:
+            alloc_file.write(f'Top {limit} lines by memory allocated during the sync:\n')
+            for difference in differences[:limit]:
+                alloc_file.write(f'{difference}\n')
+
+
+def get_default_profile_dir(output_dir : str, run_name : Optional[str] = None) -> str:
+    """Profiles are kept in a hidden directory of the output dir, one directory per run."""
+    if run_name is None:
+        run_name = datetime.now().strftime('%Y%m%dT%H%M%S')
+    return os.path.join(output_dir, '.profile', run_name)
@@ -1,16 +1,83 @@
-from typing import Dict, List
-from .base import Provider, ProviderConfig
-from .prosper import ProsperProvider
-from .adp import ADPProvider
-from .ledgerlinker_service import LedgerLinkerServiceProvider
-
-PROVIDERS = {
-        'prosper': ProsperProvider,
-        'adp': ADPProvider,
-        'ledgerlinker': LedgerLinkerServiceProvider
-}
-
-def get_available_providers() -> Dict[str, Provider]:
+"""Registry of the providers available to the client.
+
+Provider modules are only imported once a config references them, so syncing one
+provider does not pay for the dependencies of all the others. Third-party packages
+can add providers by declaring an entry point in the `ledgerlinker.providers` group
+that points at a `Provider` subclass.
+"""
+from typing import Dict, Iterator, Mapping, Type
+from importlib import import_module
+from .base import AsyncProvider, Provider, ProviderConfig, ProviderException
+
+ENTRY_POINT_GROUP = 'ledgerlinker.providers'
+
+
+class ProviderRegistry(Mapping):
+    """A mapping of provider names to provider classes that imports each class on first access."""
+
+    def __init__(self, builtin_providers : Dict[str, str]):
+        self._paths = dict(builtin_providers)
+        self._classes : Dict[str, Type[Provider]] = {}
+        self._entry_points_loaded = False
+
+    def __getitem__(self, name : str) -> Type[Provider]:
+        if name not in self._classes:
+            if name not in self._paths:
+                self._load_entry_points()
+            if name not in self._paths:
+                raise KeyError(name)
+
+            self._classes[name] = self._import(self._paths[name])
+
+        return self._classes[name]
+
+    def __iter__(self) -> Iterator[str]:
+        self._load_entry_points()
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        self._load_entry_points()
+        return len(self._paths)
+
+    @staticmethod
+    def _import(path):
+        if not isinstance(path, str):
+            # An entry point discovered from an installed package.
+            return path.load()
+
+        module_name, class_name = path.split(':')
+        return getattr(import_module(module_name), class_name)
+
+    def _load_entry_points(self):
+        """Discover providers registered by installed packages. Built in names take precedence."""
+        if self._entry_points_loaded:
+            return
+        self._entry_points_loaded = True
+
+        for entry_point in iter_entry_points(ENTRY_POINT_GROUP):
+            self._paths.setdefault(entry_point.name, entry_point)
+
+
+def iter_entry_points(group : str):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # importlib.metadata is not available before Python 3.8.
+        return []
+
+    discovered = entry_points()
+    if hasattr(discovered, 'select'):
+        return discovered.select(group=group)
+    return discovered.get(group, [])
+
+
+PROVIDERS = ProviderRegistry({
+    'prosper': 'ledgerlinker.providers.prosper:ProsperProvider',
+    'adp': 'ledgerlinker.providers.adp:ADPProvider',
+    'ledgerlinker': 'ledgerlinker.providers.ledgerlinker_service:LedgerLinkerServiceProvider',
+})
+
+def get_available_providers() -> Mapping[str, Type[Provider]]:
     return PROVIDERS
 
 def get_providers(provider_configs : Dict[str, ProviderConfig]) -> Dict[str, Provider]:
@@ -19,7 +86,10 @@ def get_providers(provider_configs : Dict[str, ProviderConfig]) -> Dict[str, Pro
     available_providers = get_available_providers()
 
     for provider_name, provider_config in provider_configs.items():
-        provider_class = available_providers[provider_config.provider]
+        try:
+            provider_class = available_providers[provider_config.provider]
+        except KeyError:
+            raise ProviderException(f'Unknown provider {provider_config.provider} for {provider_name}.')
         provider = provider_class(provider_config)
         providers[provider_name] = provider
 
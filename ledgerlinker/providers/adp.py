@@ -1,13 +1,36 @@
 """Provider to download ADP pay statements."""
-from typing import Optional
+from typing import Dict, List, Optional
+import asyncio
 import json
-import requests
 import csv
+import os
+import sqlite3
 from datetime import date, datetime
-from .base import Provider, ProviderConfig
-from ledgerlinker.update_tracker import LastUpdateTracker
+from .base import AsyncProvider, ProviderConfig
+from ledgerlinker.async_http import AsyncHTTPClient
+from ledgerlinker.metrics import MetricsRecorder
+from ledgerlinker.transport import RetryPolicy
+from ledgerlinker.update_tracker import UpdateTracker
 
-class ADPProvider(Provider):
+DEFAULT_MAX_RETRIES = 3
+
+LEGACY_CACHE_FILE = 'adp_statement_cache.json'
+
+
+class ADPDownloadException(Exception):
+    """Some statements failed to download.
+
+    `statements` holds everything downloaded or cached, and `failed_pay_dates` the pay
+    dates of the statements that failed.
+    """
+
+    def __init__(self, message : str, statements : Dict[str, Dict], failed_pay_dates : List[date]):
+        super().__init__(message)
+        self.statements = statements
+        self.failed_pay_dates = failed_pay_dates
+
+
+class ADPProvider(AsyncProvider):
 
     def __init__(self, config : ProviderConfig):
         super().__init__(config)
@@ -17,17 +40,46 @@ class ADPProvider(Provider):
         else:
             session_cookie = input('Please log into ADP and retrieve the session cookie:')
 
-        self._statement_downloader = ADPStatementDownloader(session_cookie)
+        os.makedirs(config.output_dir, exist_ok=True)
+        self._statement_downloader = ADPStatementDownloader(
+            session_cookie,
+            concurrency=getattr(config, 'concurrency', None),
+            retry_policy=self.get_retry_policy(),
+            cache_path=os.path.join(config.output_dir, f'.{config.name}-adp-statements.sqlite'),
+            legacy_cache_path=os.path.join(config.output_dir, LEGACY_CACHE_FILE),
+            metrics_labels={'provider': self.name, 'output': f'{config.name}-adp-statements'})
+
+    def set_metrics(self, metrics : MetricsRecorder):
+        super().set_metrics(metrics)
+        self._statement_downloader.metrics = metrics
+
+    def set_http_client(self, http_client : Optional[AsyncHTTPClient]):
+        super().set_http_client(http_client)
+        self._statement_downloader.http_client = http_client
 
-    def sync(self, update_tracker : LastUpdateTracker):
-        """Sync the latest transactions from the LedgerLinker service."""
+    async def sync_async(self, update_tracker : UpdateTracker):
+        """Sync the latest pay statements from ADP."""
 
         export_name = f"{self.config.name}-adp-statements"
         last_update_date = update_tracker.get(export_name)
 
-        statement_data = self._statement_downloader.download_statements(start_date=last_update_date)
-
-        statements = list(statement_data.values())
+        download_error = None
+        try:
+            statement_data = await self._statement_downloader.download_statements(start_date=last_update_date)
+        except ADPDownloadException as error:
+            # Store what precedes the first failed statement so the tracker never moves past
+            # it; the next run fetches it again, and loads the later ones from the cache.
+            download_error = error
+            statement_data = error.statements
+
+        first_failed_date = min(download_error.failed_pay_dates) if download_error else None
+        # The statement on the last synced pay date was stored by the previous run.
+        statements = [
+            statement
+            for statement in statement_data.values()
+            if (last_update_date is None or statement['payDate'] > last_update_date)
+            and (first_failed_date is None or statement['payDate'] < first_failed_date)
+        ]
         statements = sorted(statements, key=lambda statement: statement['payDate'])
 
         if hasattr(self.config, 'desired_fields'):
@@ -37,38 +89,121 @@ class ADPProvider(Provider):
             for statement in statement_data.values():
                 desired_fields.update(statement.keys())
 
-        self.register_output(export_name, f"{self.config.name}.csv", desired_fields)
-        self.store(export_name, statements)
+        if not statements:
+            print('No ADP statements to store.')
+        else:
+            await self.run_blocking(self.register_output, export_name, f"{self.config.name}.csv", desired_fields)
+            await self.run_blocking(self.store, export_name, statements)
+
+            # Save the date of the last paycheck as the most recent update date.
+            last_update_date = statements[-1]['payDate']
+            update_tracker.update(export_name, last_update_date)
+
+        if download_error is not None:
+            raise download_error
+
+
+class ADPStatementCache:
+    """An append-only cache of downloaded statements keyed by detail url and indexed by pay date."""
 
-        # Save the date of the last paycheck as the most recent update date.
-        last_update_date = statements[-1]['payDate']
-        update_tracker.update(export_name, last_update_date)
+    def __init__(self, cache_path : str):
+        self.cache_path = cache_path
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS statements (url TEXT PRIMARY KEY, pay_date TEXT NOT NULL, data TEXT NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS statements_pay_date ON statements (pay_date)')
+        self._connection.commit()
+
+    def load(self, start_date : Optional[date] = None) -> Dict[str, Dict]:
+        """Load cached statements paid on or after the start date."""
+        if start_date is None:
+            cursor = self._connection.execute('SELECT url, data FROM statements')
+        else:
+            cursor = self._connection.execute(
+                'SELECT url, data FROM statements WHERE pay_date >= ?', (start_date.isoformat(),))
+
+        statements = {}
+        for url, data in cursor:
+            statement = json.loads(data)
+            statement['payDate'] = date.fromisoformat(statement['payDate'])
+            statements[url] = statement
+        return statements
+
+    def add(self, url : str, statement : Dict):
+        """Add a statement and commit it straight away so progress is never lost."""
+        self._connection.execute(
+            'INSERT OR REPLACE INTO statements (url, pay_date, data) VALUES (?, ?, ?)',
+            (url, statement['payDate'].isoformat(), json.dumps(statement, default=_json_serializer)))
+        self._connection.commit()
+
+    def is_empty(self) -> bool:
+        return self._connection.execute('SELECT 1 FROM statements LIMIT 1').fetchone() is None
+
+    def clear(self):
+        self._connection.execute('DELETE FROM statements')
+        self._connection.commit()
+
+
+def _json_serializer(obj):
+    """JSON serializer for objects not serializable by default json code"""
+
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return obj
 
 
 class ADPStatementDownloader:
-    """Download ADP pay statements."""
+    """Download ADP pay statements with an `AsyncHTTPClient`."""
 
     STATEMENT_LIST_URL = 'https://my.adp.com/myadp_prefix/v1_0/O/A/payStatements?adjustments=yes&numberoflastpaydates=160'
     STATEMENT_DETAIL_BASE_URL = 'https://my.adp.com/myadp_prefix'
 
-    def __init__(self, session_cookie):
+    def __init__(
+        self,
+        session_cookie,
+        concurrency : Optional[int] = None,
+        max_retries : int = DEFAULT_MAX_RETRIES,
+        cache_path : str = 'adp_statement_cache.sqlite',
+        legacy_cache_path : Optional[str] = None,
+        metrics_labels : Optional[Dict[str, str]] = None,
+        http_client : Optional[AsyncHTTPClient] = None,
+        retry_policy : Optional[RetryPolicy] = None
+    ):
         self.session_cookie = session_cookie
+        self.http_client = http_client
+        self.metrics = MetricsRecorder()
+        self.metrics_labels = metrics_labels or {}
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=max_retries)
+        self.cache = ADPStatementCache(cache_path)
+        # The legacy JSON cache is only looked up at the path given for this account.
+        if legacy_cache_path is not None and self.cache.is_empty() and os.path.exists(legacy_cache_path):
+            print(f'Importing statements from {legacy_cache_path}...')
+            for url, statement in self.load_cache_file(legacy_cache_path).items():
+                self.cache.add(url, statement)
+
+        self.headers = {
+            'User-Agent': (
+                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36'),
+            'Cookie': f'SMSESSION={session_cookie}',
+        }
 
-    def get(self, url):
-        result = requests.get(
-            url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112.0.0.0 Safari/537.36',
-            },
-            cookies={
-                'SMSESSION': self.session_cookie
-            }, allow_redirects=False
-        )
+    async def get(self, url):
+        """Get a JSON document, retrying connection errors, throttling and server errors."""
+        with self.metrics.timer('http_request_seconds', **self.metrics_labels):
+            result = await self.http_client.get(
+                url, headers=self.headers, allow_redirects=False, retry=self.retry_policy)
+        self.metrics.increment('http_requests', **self.metrics_labels)
+        if result.retries:
+            self.metrics.increment('http_retries', result.retries, **self.metrics_labels)
 
         if result.status_code != 200:
+            result.close()
+            self.metrics.increment('http_errors', **self.metrics_labels)
             raise Exception('Request failed. Try updating your session cookie.')
 
-        return result.json()
+        return await result.json()
 
     def _get_statement_data_from_response(self, statement_data):
         """Build a simple dict of statement data from the response of statement detail endpoint."""
@@ -89,21 +224,23 @@ class ADPStatementDownloader:
 
         return data
 
-    def get_statement_detail(self, statement_detail_url):
+    async def get_statement_detail(self, statement_detail_url):
         """Retrieve statement data using its detail url
 
         /v1_0/O/A/payStatement/0753543723172038101304001385327
         """
-        result = self.get(self.STATEMENT_DETAIL_BASE_URL + statement_detail_url)
+        result = await self.get(self.STATEMENT_DETAIL_BASE_URL + statement_detail_url)
         statement_data = self._get_statement_data_from_response(result['payStatement'])
+        statement_data['payDate'] = date.fromisoformat(statement_data['payDate'])
         statement_data['url'] = statement_detail_url
         return statement_data
 
-    def get_available_statements(self, start_date : Optional[date] = None):
+    async def get_available_statements(self, start_date : Optional[date] = None) -> List[Dict]:
         """Retrieve a list of available statements from ADP."""
-        result = self.get(self.STATEMENT_LIST_URL)
+        result = await self.get(self.STATEMENT_LIST_URL)
         statement_response = result['payStatements']
 
+        statements = []
         for statement_data in statement_response:
             statement = statement_data.copy()
             statement['payDate'] = date.fromisoformat(statement_data['payDate'])
@@ -113,9 +250,11 @@ class ADPStatementDownloader:
                 if statement['payDate'] < start_date:
                     continue
 
-            yield statement
+            statements.append(statement)
+        return statements
 
     def load_cache_file(self, cache_file_path):
+        """Load a cache file written by earlier versions, which kept every statement in one JSON file."""
         try:
             with open(cache_file_path, 'r') as f:
                 statements = {}
@@ -127,41 +266,53 @@ class ADPStatementDownloader:
         except FileNotFoundError:
             return {}
 
-    def _json_serializer(self, obj):
-        """JSON serializer for objects not serializable by default json code"""
-
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        return obj
+    async def download_statements(self, start_date : Optional[date] = None, flush_cache : bool = False):
+        """Download all available statements from ADP after the start date.
 
-    def store_cache_file(self, cache_file_path, data):
-        with open(cache_file_path, 'w') as f:
-            json.dump(data, f, default=self._json_serializer)
-
-    def download_statements(self, start_date : Optional[date] = None, flush_cache : bool = False):
-        """Download all available statements from ADP after the start date."""
+        Statement details are downloaded as fast as the HTTP client's per host limit allows,
+        capped at `concurrency` when set. Each one is added to the cache as it arrives so
+        a failed or interrupted run keeps everything downloaded so far. A statement that fails
+        does not stop the others; `ADPDownloadException` is raised once they are done.
+        """
         if flush_cache:
-            statement_data = {}
-        else:
-            statement_data = self.load_cache_file('adp_statement_cache.json')
+            self.cache.clear()
+
+        # Only statements the sync window can return are loaded from the cache.
+        statement_data = self.cache.load(start_date)
 
-        available_statements = self.get_available_statements(start_date)
-        for statement_metadata in available_statements:
+        pending_statements = []
+        for statement_metadata in await self.get_available_statements(start_date):
             detail_url = statement_metadata['payDetailUri']['href']
             if detail_url in statement_data:
                 payDate = statement_data[detail_url]['payDate']
                 print(f'Skipping {payDate}.. already downloaded.')
                 continue
+            pending_statements.append(statement_metadata)
 
-            print(f"Downloading statement {statement_metadata['payDate']}...")
-            try:
-                statement_data[detail_url] = self.get_statement_detail(detail_url)
-            except Exception as error:
-                print(f"Failed to download statement {statement_metadata['payDate']}: {error}")
-                break
+        semaphore = asyncio.Semaphore(self.concurrency or max(len(pending_statements), 1))
+        failed_pay_dates = []
 
-        print("Saving statement cache...")
-        self.store_cache_file('adp_statement_cache.json', statement_data)
+        async def download_statement(statement_metadata):
+            detail_url = statement_metadata['payDetailUri']['href']
+            async with semaphore:
+                print(f"Downloading statement {statement_metadata['payDate']}...")
+                try:
+                    statement = await self.get_statement_detail(detail_url)
+                except Exception as error:
+                    print(f"Failed to download statement {statement_metadata['payDate']}: {error}")
+                    failed_pay_dates.append(statement_metadata['payDate'])
+                    return
+
+            statement_data[detail_url] = statement
+            self.cache.add(detail_url, statement)
+
+        await asyncio.gather(*(download_statement(statement_metadata) for statement_metadata in pending_statements))
+        if failed_pay_dates:
+            failed_pay_dates.sort()
+            raise ADPDownloadException(
+                f'Failed to download {len(failed_pay_dates)} statements: {", ".join(map(str, failed_pay_dates))}',
+                statement_data,
+                failed_pay_dates)
         return statement_data
 
     def store_statement_data_as_csv(self, statement_data, desired_fields = None):
@@ -1,15 +1,38 @@
+import asyncio
 import os
-from typing import Optional, Dict, Any, List, Tuple
-from datetime import date
-from csv import DictWriter, DictReader
+import threading
+import time
+from functools import partial
+from typing import Optional, Dict, Any, Iterable, List, Tuple
+from datetime import date, timedelta
+from csv import writer as csv_writer_factory
+from io import StringIO
 
-from ledgerlinker.update_tracker import LastUpdateTracker
+from ledgerlinker.compression import CompressedAppender
+from ledgerlinker.dedupe import DedupeIndex
+from ledgerlinker.metrics import MetricsRecorder, TimedIterable
+from ledgerlinker.output_index import CSVRecordSplitter, OutputIndex, parse_records
+from ledgerlinker.sinks import (
+    CSVSink, PartitionedSink, Sink, get_sink_class,
+    DEFAULT_OUTPUT_FORMAT, DEFAULT_PARTITION_PERIOD, DEFAULT_WRITE_BUFFER_SIZE
+)
+from ledgerlinker.update_tracker import UpdateTracker
+
+OUTPUT_LAYOUTS = ('single', 'partitioned')
+DEFAULT_OUTPUT_LAYOUT = 'single'
+
+# Days re-fetched before the last synced date when an output is deduplicated.
+DEFAULT_DEDUPE_OVERLAP_DAYS = 3
 
 
 class ProviderException(Exception):
     pass
 
 
+class OutputFieldnamesMismatch(ProviderException):
+    pass
+
+
 class ProviderConfig:
     """Configuration for a provider."""
     def __init__(
@@ -30,20 +53,82 @@ class Provider:
 
     def __init__(self, config : ProviderConfig):
         self.config = config
+        self.rows_written = 0
+        self.metrics = MetricsRecorder()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return getattr(self.config, 'name', self.__class__.__name__)
+
+    def set_metrics(self, metrics : MetricsRecorder):
+        """Record this provider's metrics into a recorder shared with the client."""
+        self.metrics = metrics
 
     def get_fieldnames(self, output_name):
         return self.config['fields']
 
-    def check_file_exists_and_get_existing_fieldnames(self, path : str) -> Tuple[bool, Optional[str]]:
+    @property
+    def dedupe_enabled(self) -> bool:
+        return getattr(self.config, 'dedupe', False)
+
+    def get_overlap_days(self) -> int:
+        """Number of already synced days to fetch again to catch late posting transactions."""
+        default = DEFAULT_DEDUPE_OVERLAP_DAYS if self.dedupe_enabled else 0
+        return getattr(self.config, 'overlap_days', default)
+
+    def get_fetch_start_date(self, last_update_date : Optional[date]) -> Optional[date]:
+        """The first date to fetch given the last synced date, including the overlap window."""
+        if last_update_date is None:
+            return None
+        return last_update_date + timedelta(days=1 - self.get_overlap_days())
+
+    @property
+    def output_format(self) -> str:
+        return getattr(self.config, 'output_format', DEFAULT_OUTPUT_FORMAT)
+
+    @property
+    def output_layout(self) -> str:
+        """`single` to append to one file per output, or `partitioned` for a file per period."""
+        return getattr(self.config, 'output_layout', DEFAULT_OUTPUT_LAYOUT)
+
+    @property
+    def output_compression(self) -> Optional[str]:
+        """The compression of output files, `gzip` or `zstd`, or None to write them uncompressed."""
+        return getattr(self.config, 'output_compression', None)
+
+    def open_dedupe_index(self, sink : Sink) -> DedupeIndex:
+        """Open the dedupe index kept next to an output, building it from the output if new.
+
+        An index left behind by a deleted output is cleared, so its rows are written again.
+        """
+        directory, file_name = os.path.split(sink.path)
+        index = DedupeIndex(
+            os.path.join(directory, f'.{file_name}.dedupe.sqlite'),
+            sink.fieldnames,
+            key_fields=getattr(self.config, 'dedupe_key', None))
+
+        if not sink.exists():
+            if not index.is_empty():
+                print(f'Warning: {sink.path} no longer exists. Clearing its dedupe index.')
+                index.clear()
+        elif index.is_empty():
+            print(f'Building dedupe index for {sink.path}...')
+            index.build_from_rows(sink.read_rows())
+
+        return index
+
+    def check_file_exists_and_get_existing_fieldnames(
+        self,
+        path : str,
+        compression : Optional[str] = None
+    ) -> Tuple[bool, Optional[str]]:
         """Check if the file exists and has the correct fieldnames."""
-        if not os.path.exists(path):
+        index = OutputIndex.open(path, compression)
+        if index is None:
             return False, None
 
-        with open(path, 'r') as fp:
-            csv_reader = DictReader(fp)
-            fieldnames = csv_reader.fieldnames
-
-        return True, fieldnames
+        return True, index.fieldnames
 
     def register_output(
         self,
@@ -51,61 +136,232 @@ class Provider:
         output_file_name : str,
         override_fieldnames : Optional[List[str]] = None
     ):
-        if not hasattr(self, '_outputs'):
-            self._outputs : Dict[str, Dict] = {}
+        with self._lock:
+            if not hasattr(self, '_outputs'):
+                self._outputs : Dict[str, Dict] = {}
 
-        if output_name in self._outputs:
-            raise ProviderException(f'Output {output_name} already registered.')
+            if output_name in self._outputs:
+                raise ProviderException(f'Output {output_name} already registered.')
 
-        os.makedirs(self.config.output_dir, exist_ok=True)
+            # Reserve the name so concurrent registrations of the same output fail.
+            self._outputs[output_name] = {}
 
-        output_path = os.path.join(self.config.output_dir, output_file_name)
-        file_exists, fieldnames = self.check_file_exists_and_get_existing_fieldnames(output_path)
+        try:
+            self._outputs[output_name] = self._open_output(output_file_name, output_name, override_fieldnames)
+        except Exception:
+            with self._lock:
+                del self._outputs[output_name]
+            raise
 
+    def _open_output(
+        self,
+        output_file_name : str,
+        output_name : str,
+        override_fieldnames : Optional[List[str]] = None
+    ) -> Dict:
+        os.makedirs(self.config.output_dir, exist_ok=True)
+
+        sink_class = get_sink_class(self.output_format)
         expected_fieldnames = override_fieldnames if override_fieldnames else self.get_fieldnames(output_name)
-        if not fieldnames:
-            fieldnames = expected_fieldnames
+        write_buffer_size = getattr(self.config, 'write_buffer_size', DEFAULT_WRITE_BUFFER_SIZE)
+
+        if self.output_layout == 'partitioned':
+            sink = PartitionedSink(
+                PartitionedSink.get_path(self.config.output_dir, output_file_name),
+                list(expected_fieldnames),
+                write_buffer_size=write_buffer_size,
+                compression=self.output_compression,
+                partition_sink_class=sink_class,
+                period=getattr(self.config, 'partition_period', DEFAULT_PARTITION_PERIOD))
+        elif self.output_layout == 'single':
+            sink = sink_class(
+                sink_class.get_path(self.config.output_dir, output_file_name, self.output_compression),
+                list(expected_fieldnames),
+                write_buffer_size=write_buffer_size,
+                compression=self.output_compression)
+        else:
+            raise ProviderException(
+                f'Unknown output layout {self.output_layout}. Expected one of: {", ".join(OUTPUT_LAYOUTS)}.')
+
+        dedupe_index = None
+        if self.dedupe_enabled:
+            dedupe_index = self.open_dedupe_index(sink)
+
+        return {
+            'sink': sink,
+            'dedupe': dedupe_index,
+        }
 
-        if fieldnames != expected_fieldnames:
-            print('Warning: fieldnames in existing file do not match expected fieldnames. Using existing file fields.')
+    def append_csv_chunks(self, output_file_name : str, fieldnames : List[str], chunks : Iterable[bytes]):
+        """Append already encoded CSV rows to an output file without parsing them.
 
-        fp = open(output_path, 'a+')
-        csv_writer = DictWriter(
-            fp,
-            fieldnames=fieldnames,
-            lineterminator='\n',
-            extrasaction='ignore')
+        The chunks must not include a header line. One is written if the file is new.
+        Compressed outputs get the chunks as a new compressed member.
+        """
+        os.makedirs(self.config.output_dir, exist_ok=True)
+
+        compression = self.output_compression
+        output_path = CSVSink.get_path(self.config.output_dir, output_file_name, compression)
+        index = OutputIndex.open(output_path, compression)
+        file_exists = index is not None
+        if file_exists and index.fieldnames != fieldnames:
+            raise OutputFieldnamesMismatch(
+                f'Fieldnames in {output_path} do not match {fieldnames}. Cannot append CSV directly.')
 
         if not file_exists:
-            csv_writer.writeheader()
+            index = OutputIndex(output_path, compression)
+            index.fieldnames = fieldnames
 
-        self._outputs[output_name] = {
-            'path': output_path,
-            'fp': fp,
-            'csv_writer': csv_writer
-        }
+        if compression is None:
+            output_file = open(output_path, 'ab')
+        else:
+            output_file = CompressedAppender(output_path, compression, binary=True)
+
+        # Records are only split to count them; only the last one is parsed.
+        splitter = CSVRecordSplitter()
+        row_count = 0
+        last_record = None
+        with output_file as fp:
+            if not file_exists:
+                header = StringIO()
+                csv_writer_factory(header, lineterminator='\n').writerow(fieldnames)
+                fp.write(header.getvalue().encode('utf-8'))
+
+            for chunk in chunks:
+                fp.write(chunk)
+                records = [record for record in splitter.feed(chunk) if record.strip()]
+                if records:
+                    row_count += len(records)
+                    last_record = records[-1]
+
+            records = splitter.finish()
+            if records:
+                # Rows appended later must not continue the last one.
+                fp.write(b'\n')
+                row_count += 1
+                last_record = records[0]
+
+            if compression is None:
+                # The index must never cover bytes that are not on disk yet.
+                fp.flush()
+                os.fsync(fp.fileno())
+
+        last_row = None
+        if last_record is not None:
+            last_row = dict(zip(fieldnames, parse_records([last_record])[0]))
+        index.record_append(row_count, last_row)
 
-    def store(self, output_name : str, rows : List[Dict]):
-        for row in rows:
-            self.store_row(output_name, row)
+    def store(self, output_name : str, rows : Iterable[Dict]):
+        """Write rows from any iterable to an output in bulk."""
+        output = self._get_output(output_name)
+
+        # Time spent producing rows, e.g. downloading and parsing them, is not write time.
+        source = TimedIterable(rows)
+        rows = source
+        if output['dedupe'] is not None:
+            rows = output['dedupe'].filter_new(rows)
+
+        start_time = time.perf_counter()
+        row_count = output['sink'].write_rows(rows)
+        write_seconds = time.perf_counter() - start_time - source.seconds
+
+        self.metrics.observe('write_seconds', write_seconds, provider=self.name, output=output_name)
+        self.metrics.increment('rows_written', row_count, provider=self.name, output=output_name)
+        self._count_rows(row_count)
 
     def store_row(self, output_name, data: dict):
+        self.store(output_name, [data])
+
+    def _count_rows(self, row_count : int):
+        with self._lock:
+            self.rows_written += row_count
+
+    def _get_output(self, output_name) -> Dict:
         if not hasattr(self, '_outputs'):
             raise ProviderException('No outputs registered.')
 
         if output_name not in self._outputs:
             raise ProviderException(f'Output {output_name} not registered.')
 
-        self._outputs[output_name]['csv_writer'].writerow(data)
+        return self._outputs[output_name]
 
     def close(self):
-        if not hasattr(self, '_outputs'):
-            return
+        with self._lock:
+            if not hasattr(self, '_outputs'):
+                return
 
-        for output in self._outputs.values():
-            output['fp'].close()
+            for output in self._outputs.values():
+                if 'sink' in output:
+                    output['sink'].close()
+                if output.get('dedupe') is not None:
+                    output['dedupe'].close()
 
+            # Forget closed outputs so the provider can be synced again.
+            del self._outputs
 
-    def sync(self, last_links : LastUpdateTracker):
+
+    def sync(self, last_links : UpdateTracker):
         """Sync the provider."""
         raise ProviderException(f'Provider {self} does not implement sync.')
+
+    async def sync_async(self, update_tracker : UpdateTracker):
+        """Sync the provider from a coroutine. Blocking providers are run on a worker thread."""
+        await asyncio.get_running_loop().run_in_executor(None, self.sync, update_tracker)
+
+
+class AsyncProvider(Provider):
+    """Base class for a provider whose requests are made with the shared `AsyncHTTPClient`.
+
+    Subclasses implement `sync_async`. The client awaits it on its event loop, with
+    `http_client` set to the client shared by all providers. Calling `sync` runs it on
+    a new event loop with a client of its own.
+
+    Requests are retried as configured by the `max_retries` and `retry_backoff` options,
+    see `get_retry_policy`.
+    """
+
+    def __init__(self, config : ProviderConfig):
+        super().__init__(config)
+        self.http_client : Optional['AsyncHTTPClient'] = None
+        self._run_inline = False
+
+    def set_http_client(self, http_client : Optional['AsyncHTTPClient']):
+        self.http_client = http_client
+
+    def get_retry_policy(self) -> 'RetryPolicy':
+        # Imported here as the HTTP libraries are only needed once a sync starts.
+        from ledgerlinker.transport import RetryPolicy, DEFAULT_MAX_RETRIES, DEFAULT_RETRY_BACKOFF
+
+        return RetryPolicy(
+            max_retries=getattr(self.config, 'max_retries', DEFAULT_MAX_RETRIES),
+            backoff=getattr(self.config, 'retry_backoff', DEFAULT_RETRY_BACKOFF))
+
+    async def sync_async(self, update_tracker : UpdateTracker):
+        raise ProviderException(f'Provider {self} does not implement sync_async.')
+
+    def sync(self, update_tracker : UpdateTracker, inline : bool = False):
+        """Run `sync_async` on a new event loop.
+
+        inline: Run the blocking stages, see `run_blocking`, on the calling thread rather
+            than on worker threads, so a profiler of the thread sees them. Requests are
+            then made with requests, whose bodies can be read from the loop's thread.
+        """
+        asyncio.run(self._sync_with_own_client(update_tracker, inline))
+
+    async def _sync_with_own_client(self, update_tracker : UpdateTracker, inline : bool = False):
+        from ledgerlinker.async_http import AsyncHTTPClient
+
+        async with AsyncHTTPClient(backend='requests' if inline else None) as http_client:
+            self.set_http_client(http_client)
+            self._run_inline = inline
+            try:
+                await self.sync_async(update_tracker)
+            finally:
+                self._run_inline = False
+                self.set_http_client(None)
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run blocking code, e.g. parsing and writing rows, on a worker thread."""
+        if self._run_inline:
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args, **kwargs))
@@ -3,22 +3,175 @@
 The Ledgerlinker service allows access to accounts at Banks and other financial institutions using
 a paid account aggregation service.
 """
-from typing import Dict, Optional, Tuple, List
-import requests
-import sys
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, List
+import asyncio
+import os
+import time
+from collections import deque
 from csv import DictWriter
 from pathlib import Path
 from datetime import datetime, date, timedelta
-from .base import Provider, ProviderConfig
-from ledgerlinker.update_tracker import LastUpdateTracker
+from .base import AsyncProvider, ProviderConfig, OutputFieldnamesMismatch
+from ledgerlinker.http_cache import ResponseCache
+from ledgerlinker.json_stream import iter_json_object
+from ledgerlinker.metrics import MeteredChunks, TimedIterable
+from ledgerlinker.output_index import CSVRecordSplitter, parse_records
+from ledgerlinker.response_archive import ARCHIVE_DIR_NAME, DEFAULT_ARCHIVE_COMPRESSION, ArchivedChunks, ResponseArchive
+from ledgerlinker.rows import Row, RowSchema
+from ledgerlinker.update_tracker import UpdateTracker
 
 DEFAULT_SERVICE_BASE_URL = 'https://app.ledgerlinker.com'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 class LedgerLinkerException(Exception):
     pass
 
 
-class LedgerLinkerServiceProvider(Provider):
+class ExportStream:
+    """An export payload parsed incrementally as it is downloaded.
+
+    `fieldnames` is available as soon as the stream is created. Iterating the stream
+    yields transactions one at a time as rows positioned by `fieldnames`, after which
+    `latest_transaction` holds the latest transaction date reported by the service.
+
+    converters: Functions applied to the value of a field of each transaction.
+    response: The response the chunks are read from, closed by `close`.
+    archive: The archive copy of the chunks. It is discarded by `close` unless committed first.
+    """
+
+    def __init__(
+        self,
+        chunks : Iterable[bytes],
+        converters : Optional[Dict[str, Callable]] = None,
+        response=None,
+        archive : Optional[ArchivedChunks] = None
+    ):
+        self.archive = archive
+        self.download = MeteredChunks(archive if archive is not None else chunks)
+        self._response = response
+        self._items = TimedIterable(iter_json_object(self.download, stream_keys=('transactions',)))
+        self._pending : deque = deque()
+        self.fieldnames : Optional[List[str]] = None
+        self.latest_transaction : Optional[date] = None
+        self.transaction_count = 0
+
+        # Read up to the fieldnames. Transactions sent before them must be held in memory.
+        for key, value in self._items:
+            if key == 'transactions':
+                self._pending.append(value)
+            else:
+                self._handle_item(key, value)
+                if key == 'fieldnames':
+                    break
+
+        self.row_schema = RowSchema(self.fieldnames or [], converters=converters)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.discard()
+        if self._response is not None:
+            self._response.close()
+
+    def _handle_item(self, key, value):
+        if key == 'fieldnames':
+            self.fieldnames = value
+        elif key == 'latest_transaction' and value:
+            self.latest_transaction = date.fromisoformat(value)
+
+    @property
+    def parse_seconds(self) -> float:
+        """Time spent parsing the payload so far, excluding the time spent downloading it."""
+        return self._items.seconds - self.download.seconds
+
+    def __iter__(self) -> Iterator[Row]:
+        from_mapping = self.row_schema.from_mapping
+        while self._pending:
+            self.transaction_count += 1
+            yield from_mapping(self._pending.popleft())
+
+        for key, value in self._items:
+            if key == 'transactions':
+                self.transaction_count += 1
+                yield from_mapping(value)
+            else:
+                self._handle_item(key, value)
+
+
+class CSVExportStream:
+    """A CSV export download passed through without rewriting its rows.
+
+    `fieldnames` is parsed from the header record when the stream is created. Iterating
+    the stream yields the remaining body as byte chunks of complete records ending in
+    `\n`. Newlines inside quoted values are left as they are. Each chunk is parsed to
+    count its rows, remember the last one and find the latest date in the `date` column,
+    read from `latest_transaction` afterwards.
+    """
+
+    def __init__(self, chunks : Iterable[bytes], response=None):
+        self.download = MeteredChunks(chunks)
+        self._chunks = iter(self.download)
+        self._response = response
+        self._splitter = CSVRecordSplitter()
+        self._latest_date : Optional[str] = None
+        self.row_count = 0
+        self.last_row : Optional[List[str]] = None
+
+        self._records : List[bytes] = []
+        for chunk in self._chunks:
+            self._records.extend(self._splitter.feed(chunk))
+            if self._records:
+                break
+        else:
+            self._records.extend(self._splitter.finish())
+
+        header = parse_records(self._records[:1])
+        self.fieldnames = header[0] if header else []
+        self._records = self._records[1:]
+        self._date_index = self.fieldnames.index('date') if 'date' in self.fieldnames else None
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+
+    def __iter__(self) -> Iterator[bytes]:
+        records, self._records = self._records, []
+        for chunk in self._chunks:
+            records.extend(self._splitter.feed(chunk))
+            if records:
+                yield self._complete_records(records)
+                records = []
+        records.extend(self._splitter.finish())
+        if records:
+            yield self._complete_records(records)
+
+    def _complete_records(self, records : List[bytes]) -> bytes:
+        records = [record for record in records if record.strip()]
+        if not records:
+            return b''
+
+        rows = parse_records(records)
+        self.row_count += len(rows)
+        self.last_row = rows[-1]
+        if self._date_index is not None:
+            # ISO dates sort as strings; the server does not promise any row order.
+            dates = [row[self._date_index] for row in rows if len(row) > self._date_index and row[self._date_index]]
+            if dates and (self._latest_date is None or max(dates) > self._latest_date):
+                self._latest_date = max(dates)
+        return b'\n'.join(records) + b'\n'
+
+    @property
+    def latest_transaction(self) -> Optional[date]:
+        if self._latest_date is None:
+            return None
+        return date.fromisoformat(self._latest_date)
+
+
+class LedgerLinkerServiceProvider(AsyncProvider):
+    """Sync exports from the LedgerLinker service.
+
+    Exports are requested concurrently on the client's event loop. Each response body
+    is parsed and written on a worker thread as it downloads.
+    """
 
     def __init__(self, config : ProviderConfig):
         super().__init__(config)
@@ -38,24 +191,56 @@ class LedgerLinkerServiceProvider(Provider):
         except AttributeError:
             self._category_separator = ':'
 
+        self.export_concurrency = getattr(config, 'export_concurrency', None)
+        self.csv_passthrough = getattr(config, 'csv_passthrough', False)
+        self.response_cache = ResponseCache(
+            os.path.join(config.output_dir, '.cache', 'http'),
+            ttl=getattr(config, 'export_list_cache_ttl', 0))
+        self.retry_policy = self.get_retry_policy()
+
+        self.response_archive : Optional[ResponseArchive] = None
+        if getattr(config, 'archive_responses', False):
+            self.response_archive = ResponseArchive(
+                os.path.join(config.output_dir, ARCHIVE_DIR_NAME),
+                compression=getattr(config, 'archive_compression', DEFAULT_ARCHIVE_COMPRESSION))
 
     def get_headers(self) -> dict:
         return {'Authorization': f'Token {self.token}'}
 
-    def get_available_exports(self):
-        """Get a list of available exports from the LedgerLinker service."""
+    async def get_available_exports(self):
+        """Get a list of available exports from the LedgerLinker service.
+
+        The list is served from the response cache while it is fresh and revalidated
+        with a conditional request once it is stale. Raises `LedgerLinkerException` if
+        the service does not return it.
+        """
         url = f'{self.service_base_url}/api/exports/'
-        response = requests.get(url, headers=self.get_headers())
+        cache_key = self.response_cache.get_key(self.token, url)
+        cached = self.response_cache.lookup(cache_key)
+        labels = {'provider': self.name, 'output': 'export_list'}
+        if cached is not None and self.response_cache.is_fresh(cached):
+            self.metrics.increment('http_cache_hits', **labels)
+            return cached['data']
+
+        headers = self.get_headers()
+        headers.update(self.response_cache.conditional_headers(cached))
+        response = await self.send_request(url, headers, labels)
+        if response.status_code != 200:
+            response.close()
+
+        if response.status_code == 304 and cached is not None:
+            self.metrics.increment('http_cache_hits', **labels)
+            return self.response_cache.refresh(cache_key, cached)['data']
 
         if response.status_code == 401:
-            print('Error retrieving exports from LedgerLinker service. Your token appears to be invalid.')
-            sys.exit(1)
+            raise LedgerLinkerException(
+                'Error retrieving exports from LedgerLinker service. Your token appears to be invalid.')
 
         if response.status_code != 200:
-            print('Error retrieving exports from LedgerLinker service.')
-            sys.exit(1)
+            raise LedgerLinkerException(
+                f'Error retrieving exports from LedgerLinker service: HTTP {response.status_code}.')
 
-        return response.json()
+        return self.response_cache.store(cache_key, await response.json(), response)['data']
 
     def get_export_file_path(self, nickname : str, append_mode : bool):
         fetch_time = datetime.today().strftime("%m-%d-%Y_%H-%M")
@@ -64,39 +249,127 @@ class LedgerLinkerServiceProvider(Provider):
         else:
             return f'{self.link_dir}/{nickname}-{fetch_time}.csv'
 
-    def get_export(self, nickname : str, json_url : str, start_date = None) -> Tuple[List[Dict], str, date]:
+    def get_export_name(self, slug : str) -> str:
+        return f"{self.config.name}-{slug}"
+
+    async def send_request(self, url : str, headers : dict, labels : Dict[str, str], params : Optional[dict] = None):
+        """Send a request, retrying transient failures, and record how long the service took to respond."""
+        with self.metrics.timer('http_request_seconds', **labels):
+            response = await self.http_client.get(url, headers=headers, params=params, retry=self.retry_policy)
+
+        self.metrics.increment('http_requests', **labels)
+        if response.retries:
+            self.metrics.increment('http_retries', response.retries, **labels)
+        if response.status_code not in (200, 304):
+            self.metrics.increment('http_errors', **labels)
+        return response
+
+    async def request_export(self, nickname : str, url : str, params : dict):
+        """Start an export download."""
+        labels = {'provider': self.name, 'output': self.get_export_name(nickname)}
+        return await self.send_request(url, self.get_headers(), labels, params)
+
+    def record_download_metrics(self, export_name : str, stream):
+        labels = {'provider': self.name, 'output': export_name}
+        self.metrics.increment('response_bytes', stream.download.bytes, **labels)
+        self.metrics.observe('http_read_seconds', stream.download.seconds, **labels)
+        if isinstance(stream, ExportStream):
+            self.metrics.observe('parse_seconds', stream.parse_seconds, **labels)
+
+    async def stream_export(self, nickname : str, json_url : str, start_date = None) -> ExportStream:
+        """Open an export download and parse its transactions incrementally.
+
+        The stream must be iterated on a worker thread, see `run_blocking`. With the
+        response archive enabled the body is copied to it as it downloads.
+        """
+        params = {}
+        if start_date is not None:
+            params['start_date'] = start_date
+
+        response = await self.request_export(nickname, json_url, params)
+        if response.status_code != 200:
+            response.close()
+            raise LedgerLinkerException('Error retrieving export from LedgerLinker service.')
+
+        # Creating the stream reads the body up to the fieldnames.
+        return await self.run_blocking(self.open_export_stream, nickname, response, start_date)
+
+    def open_export_stream(self, nickname : str, response, start_date = None) -> ExportStream:
+        chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        archive = None
+        if self.response_archive is not None:
+            archive = self.response_archive.archive_chunks(self.config.name, nickname, chunks, start_date)
+
+        try:
+            return ExportStream(chunks, converters={'categories': self.format_categories}, response=response, archive=archive)
+        except BaseException:
+            if archive is not None:
+                archive.discard()
+            raise
+
+    async def stream_csv_export(self, nickname : str, csv_url : str, start_date = None) -> CSVExportStream:
+        """Open a CSV export download whose rows can be written to disk unparsed."""
         params = {}
         if start_date is not None:
             params['start_date'] = start_date
 
-        response = requests.get(json_url, headers=self.get_headers(), params=params)
+        response = await self.request_export(nickname, csv_url, params)
         if response.status_code != 200:
+            response.close()
             raise LedgerLinkerException('Error retrieving export from LedgerLinker service.')
 
-        payload = response.json()
-        if len(payload['transactions']) > 0:
-            cleaned_transactions = [
-                self.format_transaction_data(transaction)
-                for transaction in payload['transactions']
-            ]
+        return await self.run_blocking(CSVExportStream, response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), response)
 
-            latest_transaction_date = date.fromisoformat(payload['latest_transaction'])
+    async def sync_export_csv(self, export_details : dict, export_name : str, start_date = None) -> Optional[CSVExportStream]:
+        """Append the server rendered CSV for an export straight to its output file.
+
+        Returns None without writing anything if the existing output has different fieldnames.
+        """
+        stream = await self.stream_csv_export(
+            export_details['slug'],
+            export_details['csv_download_url'],
+            start_date=start_date,
+        )
+        return await self.run_blocking(self.write_csv_stream, export_details, export_name, stream)
+
+    def write_csv_stream(self, export_details : dict, export_name : str, stream : CSVExportStream) -> Optional[CSVExportStream]:
+        try:
+            start_time = time.perf_counter()
+            self.append_csv_chunks(f"{export_details['slug']}.csv", stream.fieldnames, stream)
+        except OutputFieldnamesMismatch as error:
+            print(f'Warning: {error} Falling back to JSON download.')
+            return None
+        finally:
+            stream.close()
+
+        labels = {'provider': self.name, 'output': export_name}
+        self.metrics.observe('write_seconds', time.perf_counter() - start_time - stream.download.seconds, **labels)
+        self.metrics.increment('rows_written', stream.row_count, **labels)
+        self.record_download_metrics(export_name, stream)
+        self._count_rows(stream.row_count)
+        return stream
+
+    async def get_export(self, nickname : str, json_url : str, start_date = None) -> Tuple[List[Row], str, date]:
+        stream = await self.stream_export(nickname, json_url, start_date=start_date)
+        try:
+            cleaned_transactions = await self.run_blocking(list, stream)
+        finally:
+            stream.close()
+
+        if cleaned_transactions:
+            latest_transaction_date = stream.latest_transaction
         else:
-            cleaned_transactions = []
             latest_transaction_date = start_date
 
         return (
             cleaned_transactions,
-            payload['fieldnames'],
+            stream.fieldnames,
             latest_transaction_date
         )
 
-    def format_transaction_data(self, transaction):
-        """Format the transaction data to be written to the CSV file."""
-        data = transaction.copy()
-        if 'categories' in data:
-            data['categories'] = self._category_separator.join(data['categories'])
-        return data
+    def format_categories(self, categories : List[str]) -> str:
+        """Render the categories of a transaction as a single CSV field."""
+        return self._category_separator.join(categories)
 
     def filter_exports(self, exports, desired_exports):
         """Filter exports by the desired exports in the config file."""
@@ -113,37 +386,121 @@ class LedgerLinkerServiceProvider(Provider):
     def get_fieldnames(self, output_name):
         raise NotImplemented('get_fieldnames not implemented for LedgerLinkerServiceProvider')
 
-    def sync_export(self, export_details : dict, update_tracker : LastUpdateTracker):
+    async def sync_export(self, export_details : dict, update_tracker : UpdateTracker):
         """Sync transactions for a single export from the LedgerLinker service."""
         print(f'Fetching export: {export_details["name"]}')
 
-        export_name = f"{self.config.name}-{export_details['slug']}"
+        export_name = self.get_export_name(export_details['slug'])
         start_date = None
 
         last_update_date = update_tracker.get(export_name)
         if last_update_date:
-            start_date = last_update_date + timedelta(days=1)
-            if start_date > date.today():
+            if last_update_date + timedelta(days=1) > date.today() and not self.get_overlap_days():
                 print(f'Export {export_name} is already up to date.')
                 return
+            start_date = self.get_fetch_start_date(last_update_date)
 
         print(f'Fetching transactions since {start_date}.')
-        new_transactions, fieldnames, latest_transaction_date = self.get_export(
+        # Passthrough rows are never parsed, so they cannot be checked against the dedupe index,
+        # split into partitions, written to anything but a single CSV output or rerendered.
+        if (
+            self.csv_passthrough
+            and self.response_archive is None
+            and not self.dedupe_enabled
+            and self.output_format == 'csv'
+            and self.output_layout == 'single'
+            and export_details.get('csv_download_url')
+        ):
+            csv_stream = await self.sync_export_csv(export_details, export_name, start_date=start_date)
+            if csv_stream:
+                self.update_export_tracker(
+                    update_tracker, export_name, csv_stream.latest_transaction, start_date, last_update_date)
+                return
+
+        stream = await self.stream_export(
             export_details['slug'],
             export_details['json_download_url'],
             start_date=start_date,
         )
+        await self.run_blocking(self.write_export_stream, export_details, export_name, stream)
 
-        self.register_output(export_name, f"{export_details['slug']}.csv", fieldnames)
-        self.store(export_name, new_transactions)
-
-        update_tracker.update(export_name, latest_transaction_date)
+        latest_transaction_date = stream.latest_transaction if stream.transaction_count > 0 else None
+        self.update_export_tracker(
+            update_tracker, export_name, latest_transaction_date, start_date, last_update_date)
 
-
-    def sync(self, last_links : LastUpdateTracker):
+    def write_export_stream(self, export_details : dict, export_name : str, stream : ExportStream):
+        """Write rows to the output as they are parsed from the response body."""
+        try:
+            self.register_output(export_name, f"{export_details['slug']}.csv", stream.fieldnames)
+            self.store(export_name, stream)
+            if stream.archive is not None:
+                stream.archive.commit()
+        finally:
+            stream.close()
+        self.record_download_metrics(export_name, stream)
+
+    def rerender_export(self, slug : str, archive : ResponseArchive) -> int:
+        """Rebuild the outputs of an export by replaying its archived responses, without any requests.
+
+        Each response is written as its sync wrote it, so dedupe and partitioning apply
+        the same way. Returns the number of rows written.
+        """
+        export_name = self.get_export_name(slug)
+        rows_before = self.rows_written
+        for entry in archive.get_entries(self.config.name, slug):
+            stream = ExportStream(archive.iter_object(entry), converters={'categories': self.format_categories})
+            try:
+                self.write_export_stream({'slug': slug}, export_name, stream)
+            finally:
+                # Outputs are registered again for the next response, as by the next sync.
+                self.close()
+        return self.rows_written - rows_before
+
+    def update_export_tracker(
+        self,
+        update_tracker : UpdateTracker,
+        export_name : str,
+        latest_transaction_date : Optional[date],
+        start_date : Optional[date],
+        last_update_date : Optional[date]
+    ):
+        """Record the date an export has been synced to, never moving it backwards."""
+        new_date = latest_transaction_date or start_date
+        if last_update_date and (new_date is None or new_date < last_update_date):
+            new_date = last_update_date
+
+        if new_date is not None:
+            update_tracker.update(export_name, new_date)
+
+        self.metrics.set_gauge('last_sync_timestamp_seconds', time.time(), provider=self.name, output=export_name)
+
+
+    async def sync_async(self, last_links : UpdateTracker):
         """Sync the latest transactions from the LedgerLinker service."""
-        exports = self.get_available_exports()
-        exports = self.filter_exports(exports, self.config.exports)
-
-        for export_details in exports:
-            self.sync_export(export_details, last_links)
+        exports = await self.get_available_exports()
+        exports = self.filter_exports(exports, getattr(self.config, 'exports', None))
+
+        # Each export is fetched, written and tracked by a single task so per-export
+        # ordering is preserved while the network waits of different exports overlap.
+        # The HTTP client's per host limit decides how many downloads run at once;
+        # `export_concurrency` optionally caps the exports in progress on top of it.
+        semaphore = asyncio.Semaphore(self.export_concurrency or max(len(exports), 1))
+
+        async def sync_export(export_details):
+            async with semaphore:
+                await self.sync_export(export_details, last_links)
+
+        results = await asyncio.gather(
+            *(sync_export(export_details) for export_details in exports),
+            return_exceptions=True)
+
+        failed_exports = []
+        for export_details, error in zip(exports, results):
+            if isinstance(error, Exception):
+                print(f'Failed to sync export {export_details["name"]}: {error}')
+                self.metrics.increment(
+                    'export_sync_failures', provider=self.name, output=self.get_export_name(export_details['slug']))
+                failed_exports.append(export_details['slug'])
+
+        if failed_exports:
+            raise LedgerLinkerException(f'Failed to sync exports: {", ".join(failed_exports)}')
@@ -2,9 +2,10 @@
 from typing import List, Optional, Dict, Tuple
 from csv import DictWriter
 import requests
-from datetime import date
+from datetime import date, timedelta
 from .base import Provider, ProviderException
-from ledgerlinker.update_tracker import LastUpdateTracker
+from ledgerlinker.rows import Row, RowSchema
+from ledgerlinker.update_tracker import UpdateTracker
 import sys
 
 
@@ -40,31 +41,37 @@ class ProsperProvider(Provider):
             return False
         return True
 
-    def fetch_purchases(self, start_date : Optional[date] = None) -> Tuple[List[Dict], date]:
+    def fetch_purchases(self, start_date : Optional[date] = None) -> Tuple[List[Row], date]:
         """Fetch purchases from Prosper."""
 
         notes = self.prosper_client.notes()
+        schema = RowSchema(self.get_fieldnames('purchases'))
 
         purchases = []
         latest_date = start_date
+        # Re-read the overlap window before the last synced date; the dedupe index drops repeats.
+        cutoff_date = start_date
+        if start_date and self.get_overlap_days():
+            cutoff_date = start_date - timedelta(days=self.get_overlap_days())
         for note in sorted(notes, key=lambda x: x['origination_date']):
             rate = round(note['borrower_rate'] * 100, 2)
-            row = {
-                "date": note['origination_date'],
-                "loan_note_id": note['loan_note_id'],
-                "loan_amount": note['amount_borrowed'],
-                "term": note['term'],
-                "rate": rate,
-                "note_amount": note['note_ownership_amount'],
-                "prosper_rating": note['prosper_rating']
-            }
+            # Values in the order of the purchases fieldnames.
+            row = schema.from_values((
+                note['origination_date'],
+                note['loan_note_id'],
+                note['note_ownership_amount'],
+                note['amount_borrowed'],
+                note['term'],
+                rate,
+                note['prosper_rating'],
+            ))
 
             row_date = date.fromisoformat(note['origination_date'])
             if latest_date is None or row_date > latest_date:
                 latest_date = row_date
 
-            if start_date:
-                if row_date <= start_date:
+            if cutoff_date:
+                if row_date <= cutoff_date:
                     continue
 
             purchases.append(row)
@@ -84,7 +91,7 @@ class ProsperProvider(Provider):
                 'prosper_rating'
             ]
 
-    def sync(self, update_tracker : LastUpdateTracker):
+    def sync(self, update_tracker : UpdateTracker):
         """Sync the prosper provider."""
 
         self.register_output('purchases', 'prosper-purchases.csv')
@@ -0,0 +1,160 @@
+import asyncio
+import csv
+import os
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock
+from tempfile import TemporaryDirectory
+from datetime import date
+import json
+from ledgerlinker.update_tracker import LastUpdateTracker
+from ..adp import ADPDownloadException, ADPProvider, ADPStatementDownloader
+from ..base import ProviderConfig
+
+
+def statement_detail(pay_date, net_pay):
+    return {
+        'payStatement': {
+            'payDate': pay_date,
+            'netPayAmount': {'amountValue': net_pay},
+            'grossPayAmount': {'amountValue': net_pay * 2},
+            'deductions': [
+                {'CodeName': ' Federal Tax ', 'deductionAmount': {'amountValue': 10}},
+                {'CodeName': 'Missing amount'},
+            ],
+        }
+    }
+
+
+EX1_STATEMENT_LIST = {
+    'payStatements': [
+        {'payDate': '2023-01-15', 'payDetailUri': {'href': '/statement/1'}},
+        {'payDate': '2023-01-31', 'payDetailUri': {'href': '/statement/2'}},
+        {'payDate': '2023-02-15', 'payDetailUri': {'href': '/statement/3'}},
+    ]
+}
+
+
+class ADPStatementDownloaderTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        self.cache_path = os.path.join(self.temp_dir.name, 'cache.sqlite')
+        self.downloader = ADPStatementDownloader('cookie', concurrency=2, max_retries=1, cache_path=self.cache_path)
+        self.responses = {
+            ADPStatementDownloader.STATEMENT_LIST_URL: EX1_STATEMENT_LIST,
+            ADPStatementDownloader.STATEMENT_DETAIL_BASE_URL + '/statement/1': statement_detail('2023-01-15', 100),
+            ADPStatementDownloader.STATEMENT_DETAIL_BASE_URL + '/statement/2': statement_detail('2023-01-31', 200),
+            ADPStatementDownloader.STATEMENT_DETAIL_BASE_URL + '/statement/3': statement_detail('2023-02-15', 300),
+        }
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def get(self, url):
+        if url not in self.responses:
+            raise Exception('Request failed. Try updating your session cookie.')
+        return self.responses[url]
+
+    def read_pay_dates(self):
+        with open(os.path.join(self.temp_dir.name, 'adp.csv')) as output_file:
+            return [row['payDate'] for row in csv.DictReader(output_file)]
+
+    def test_failed_statement_does_not_stop_others(self):
+        """A failed statement fails the sync without moving the tracker past it, so a later run stores it."""
+        provider = ADPProvider(ProviderConfig(name='adp', output_dir=self.temp_dir.name, session_cookie='cookie'))
+        tracker = LastUpdateTracker(os.path.join(self.temp_dir.name, 'last_links.json'))
+        failed_url = ADPStatementDownloader.STATEMENT_DETAIL_BASE_URL + '/statement/2'
+        failed_response = self.responses.pop(failed_url)
+
+        provider._statement_downloader.get = AsyncMock(side_effect=self.get)
+        with redirect_stdout(StringIO()), self.assertRaises(ADPDownloadException) as error:
+            asyncio.run(provider.sync_async(tracker))
+        provider.close()
+
+        self.assertEqual(error.exception.failed_pay_dates, [date(2023, 1, 31)])
+        self.assertEqual(tracker.get('adp-adp-statements'), date(2023, 1, 15))
+        self.assertEqual(self.read_pay_dates(), ['2023-01-15'])
+
+        # Progress was cached, so only the failed statement is requested again.
+        self.responses[failed_url] = failed_response
+        provider._statement_downloader.get = AsyncMock(side_effect=self.get)
+        with redirect_stdout(StringIO()):
+            asyncio.run(provider.sync_async(tracker))
+        provider.close()
+
+        self.assertEqual(
+            [call.args[0] for call in provider._statement_downloader.get.call_args_list],
+            [ADPStatementDownloader.STATEMENT_LIST_URL, failed_url])
+        self.assertEqual(tracker.get('adp-adp-statements'), date(2023, 2, 15))
+        self.assertEqual(self.read_pay_dates(), ['2023-01-15', '2023-01-31', '2023-02-15'])
+
+    def test_downloaded_statements_are_parsed(self):
+        self.downloader.get = AsyncMock(side_effect=self.get)
+
+        statements = asyncio.run(self.downloader.download_statements())
+
+        self.assertEqual(sorted(statements), ['/statement/1', '/statement/2', '/statement/3'])
+        self.assertEqual(statements['/statement/1'], {
+            'payDate': date(2023, 1, 15),
+            'netPayAmount': 100,
+            'grossPayAmount': 200,
+            'Federal Tax': 10,
+            'url': '/statement/1',
+        })
+
+    def test_incremental_download_loads_recent_cache_entries(self):
+        """Only cached statements on or after the start date are loaded."""
+        self.downloader.get = AsyncMock(side_effect=self.get)
+        asyncio.run(self.downloader.download_statements())
+
+        self.downloader.get = AsyncMock(side_effect=self.get)
+        statements = asyncio.run(self.downloader.download_statements(start_date=date(2023, 2, 1)))
+
+        self.assertEqual(list(statements), ['/statement/3'])
+        self.assertEqual(
+            [call.args[0] for call in self.downloader.get.call_args_list],
+            [ADPStatementDownloader.STATEMENT_LIST_URL])
+
+    def test_imports_legacy_cache_file(self):
+        legacy_cache_path = os.path.join(self.temp_dir.name, 'legacy.json')
+        with open(legacy_cache_path, 'w') as cache_file:
+            json.dump({'/statement/9': {'payDate': '2022-12-31', 'netPayAmount': 1}}, cache_file)
+
+        downloader = ADPStatementDownloader(
+            'cookie',
+            cache_path=os.path.join(self.temp_dir.name, 'new.sqlite'),
+            legacy_cache_path=legacy_cache_path)
+
+        self.assertEqual(
+            downloader.cache.load(),
+            {'/statement/9': {'payDate': date(2022, 12, 31), 'netPayAmount': 1}})
+
+    def test_legacy_cache_file_is_not_read_from_cwd(self):
+        with open('adp_statement_cache.json', 'w') as cache_file:
+            json.dump({'/statement/9': {'payDate': '2022-12-31', 'netPayAmount': 1}}, cache_file)
+        output_dir = os.path.join(self.temp_dir.name, 'account')
+
+        provider = ADPProvider(ProviderConfig(name='adp', output_dir=output_dir, session_cookie='cookie'))
+        try:
+            self.assertEqual(provider._statement_downloader.cache.load(), {})
+        finally:
+            provider.close()
+
+    def test_requests_carry_cookie(self):
+        self.assertEqual(self.downloader.headers['Cookie'], 'SMSESSION=cookie')
+
+    def test_get_retries_with_policy(self):
+        """Requests are retried by the HTTP client and the retries counted."""
+        response = Mock(status_code=200, retries=2)
+        response.json = AsyncMock(return_value={'payStatements': []})
+        self.downloader.http_client = Mock(get=AsyncMock(return_value=response))
+
+        self.assertEqual(asyncio.run(self.downloader.get('https://my.adp.com/')), {'payStatements': []})
+
+        self.assertIs(self.downloader.http_client.get.call_args.kwargs['retry'], self.downloader.retry_policy)
+        self.assertEqual(self.downloader.retry_policy.max_retries, 1)
+        self.assertEqual(self.downloader.metrics.get_counter('http_retries'), 2)
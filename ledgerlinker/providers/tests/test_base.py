@@ -1,16 +1,18 @@
+import asyncio
+import threading
 from unittest import TestCase
 from unittest.mock import Mock, patch
 from tempfile import TemporaryDirectory
 from datetime import date
-from ..base import Provider, ProviderException
+import os
+from ..base import AsyncProvider, Provider, ProviderConfig, ProviderException
 
 
 class ProviderBaseTestCase(TestCase):
 
     def setUp(self):
         self.temp_dir = TemporaryDirectory()
-        config = Mock()
-        config.output_dir = self.temp_dir.name
+        config = ProviderConfig(name='test', output_dir=self.temp_dir.name)
 
         self.provider = Provider(config)
 
@@ -53,3 +55,132 @@ class ProviderBaseTestCase(TestCase):
             self.provider.store_row('booop', {})
 
         self.assertEqual(str(error.exception), 'Output booop not registered.')
+
+    def test_store_dedupe(self):
+        """Rows already in the output, including ones written before the index existed, are skipped."""
+        expected_file_path = self.temp_dir.name + '/test.csv'
+        with open(expected_file_path, 'w') as output_file:
+            output_file.write('id,amount\n1,5\n')
+
+        self.provider.config.dedupe = True
+        self.provider.config.dedupe_key = ['id']
+        self.provider.register_output('test', 'test.csv', ['id', 'amount'])
+        self.provider.store('test', [{'id': 1, 'amount': 5}, {'id': 2, 'amount': 6}, {'id': 2, 'amount': 6}])
+        self.provider.close()
+
+        self.provider.register_output('test', 'test.csv', ['id', 'amount'])
+        self.provider.store('test', iter([{'id': 2, 'amount': 6}, {'id': 3, 'amount': 7}]))
+        self.provider.close()
+
+        with open(expected_file_path, 'r') as output_file:
+            lines = output_file.readlines()
+
+        self.assertEqual(lines, ['id,amount\n', '1,5\n', '2,6\n', '3,7\n'])
+        self.assertEqual(self.provider.rows_written, 2)
+        self.assertTrue(os.path.exists(self.temp_dir.name + '/.test.csv.dedupe.sqlite'))
+
+    def test_store_dedupe_after_output_deleted(self):
+        """Deleting an output clears its dedupe index so re-downloaded rows are written again."""
+        output_path = self.temp_dir.name + '/test.csv'
+        self.provider.config.dedupe = True
+        rows = [{'id': 1, 'amount': 5}, {'id': 2, 'amount': 6}]
+        self.provider.register_output('test', 'test.csv', ['id', 'amount'])
+        self.provider.store('test', rows)
+        self.provider.close()
+
+        os.remove(output_path)
+        with patch('builtins.print'):
+            self.provider.register_output('test', 'test.csv', ['id', 'amount'])
+        self.provider.store('test', rows)
+        self.provider.close()
+
+        with open(output_path, 'r') as output_file:
+            self.assertEqual(output_file.read(), 'id,amount\n1,5\n2,6\n')
+
+    def test_append_csv_chunks_counts_records(self):
+        """Newlines inside quoted values don't count as rows, wherever the chunks split them."""
+        from ledgerlinker.output_index import OutputIndex
+
+        output_path = os.path.join(self.temp_dir.name, 'test.csv')
+        self.provider.append_csv_chunks('test.csv', ['id', 'memo'], [b'1,"a\n', b'b"\n2,', b'"c\r\nd"\n'])
+        self.provider.append_csv_chunks('test.csv', ['id', 'memo'], [b'3,e'])
+
+        with open(output_path, 'rb') as output_file:
+            self.assertEqual(output_file.read(), b'id,memo\n1,"a\nb"\n2,"c\r\nd"\n3,e\n')
+        index = OutputIndex.open(output_path)
+        self.assertEqual(index.row_count, 3)
+        self.assertEqual(index.last_row, {'id': '3', 'memo': 'e'})
+
+        self.provider.append_csv_chunks('test.csv', ['id', 'memo'], [b'4,"f\ng"\n'])
+        index = OutputIndex.open(output_path)
+        self.assertEqual(index.row_count, 4)
+        self.assertEqual(index.last_row, {'id': '4', 'memo': 'f\ng'})
+
+    def test_get_fetch_start_date(self):
+        """The fetch window starts after the last update unless an overlap is configured."""
+        self.assertIsNone(self.provider.get_fetch_start_date(None))
+        self.assertEqual(self.provider.get_fetch_start_date(date(2020, 1, 5)), date(2020, 1, 6))
+
+        self.provider.config.dedupe = True
+        self.assertEqual(self.provider.get_fetch_start_date(date(2020, 1, 5)), date(2020, 1, 3))
+
+        self.provider.config.overlap_days = 1
+        self.assertEqual(self.provider.get_fetch_start_date(date(2020, 1, 5)), date(2020, 1, 5))
+
+    def test_register_output_sqlite(self):
+        """The output_format option selects the sink used for outputs."""
+        self.provider.config.output_format = 'sqlite'
+        self.provider.register_output('test', 'test.csv', ['date', 'amount'])
+        self.provider.store('test', [{'date': '2020-01-01', 'amount': 5}])
+        self.provider.close()
+
+        self.assertFalse(os.path.exists(self.temp_dir.name + '/test.csv'))
+        self.assertTrue(os.path.exists(self.temp_dir.name + '/test.sqlite'))
+        self.assertEqual(self.provider.rows_written, 1)
+
+    def test_register_output_partitioned(self):
+        """The partitioned layout writes a directory of monthly files, deduplicated across partitions."""
+        self.provider.config.output_layout = 'partitioned'
+        self.provider.config.dedupe = True
+        self.provider.register_output('test', 'test.csv', ['date', 'amount'])
+        self.provider.store('test', [{'date': '2020-01-31', 'amount': 5}, {'date': '2020-02-01', 'amount': 6}])
+        self.provider.close()
+
+        self.provider.register_output('test', 'test.csv', ['date', 'amount'])
+        self.provider.store('test', [{'date': '2020-01-31', 'amount': 5}, {'date': '2020-02-02', 'amount': 7}])
+        self.provider.close()
+
+        with open(self.temp_dir.name + '/test/2020/02.csv') as partition_file:
+            self.assertEqual(partition_file.read(), 'date,amount\n2020-02-01,6\n2020-02-02,7\n')
+        self.assertEqual(self.provider.rows_written, 3)
+
+    def test_register_output_unknown_layout(self):
+        self.provider.config.output_layout = 'sharded'
+        with self.assertRaises(ProviderException):
+            self.provider.register_output('test', 'test.csv', ['date', 'amount'])
+
+
+class AsyncProviderTestCase(TestCase):
+
+    def test_blocking_provider_runs_on_worker_thread(self):
+        provider = Provider(ProviderConfig(name='test', output_dir='.'))
+        threads = []
+        provider.sync = lambda update_tracker: threads.append(threading.get_ident())
+
+        asyncio.run(provider.sync_async(Mock()))
+
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+    def test_sync_runs_with_own_http_client(self):
+        provider = AsyncProvider(ProviderConfig(name='test', output_dir='.'))
+        http_clients = []
+
+        async def sync_async(update_tracker):
+            http_clients.append(provider.http_client)
+        provider.sync_async = sync_async
+
+        provider.sync(Mock())
+
+        self.assertIsNotNone(http_clients[0])
+        self.assertIsNone(provider.http_client)
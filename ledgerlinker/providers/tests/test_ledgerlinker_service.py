@@ -1,79 +1,142 @@
+import asyncio
+import gzip
+import json
+import os
 from unittest import TestCase, skip
-from unittest.mock import Mock, patch
+from tempfile import TemporaryDirectory
+from unittest.mock import AsyncMock, Mock, patch
 from datetime import date
 from ledgerlinker.providers.base import ProviderException, ProviderConfig
-from ledgerlinker.providers.ledgerlinker_service import LedgerLinkerServiceProvider
+from ledgerlinker.providers.ledgerlinker_service import LedgerLinkerServiceProvider, LedgerLinkerException, ExportStream, CSVExportStream
 
 
 class LedgerLinkerProviderTestCase(TestCase):
 
     def setUp(self):
+        self.temp_dir = TemporaryDirectory()
         config = ProviderConfig(
             name='bank-test',
             token='123-token',
-            output_dir='/tmp',
+            output_dir=self.temp_dir.name,
         )
         self.prosper_client_mock = Mock()
         self.ledgerlinker_provider = LedgerLinkerServiceProvider(config)
 
+    def mock_get(self, provider=None):
+        """Replace the provider's HTTP client with one answering every request with the same response."""
+        provider = provider or self.ledgerlinker_provider
+        response = Mock(status_code=200, headers={}, retries=0)
+        response.json = AsyncMock()
+        provider.set_http_client(Mock(get=AsyncMock(return_value=response)))
+        return provider.http_client.get
 
-    @patch('ledgerlinker.providers.ledgerlinker_service.requests.get')
-    def test_get_available_exports(self, mock_get):
+
+    def test_get_available_exports(self):
         """Test getting available exports from LedgerLinker."""
-        mock_get.return_value.status_code = 200
+        mock_get = self.mock_get()
         mock_get.return_value.json.return_value = EX1_AVAILABLE_EXPORT_RESPONSE
         self.assertEqual(
-            self.ledgerlinker_provider.get_available_exports(),
+            asyncio.run(self.ledgerlinker_provider.get_available_exports()),
             EX1_AVAILABLE_EXPORT_RESPONSE
         )
 
         mock_get.assert_called_once_with(
             'https://app.ledgerlinker.com/api/exports/',
-            headers={'Authorization': 'Token 123-token'}
+            headers={'Authorization': 'Token 123-token'},
+            params=None,
+            retry=self.ledgerlinker_provider.retry_policy
         )
 
-    @patch('ledgerlinker.providers.ledgerlinker_service.requests.get')
-    def test_get_export(self, mock_get):
-        """Test getting a single export file and writing to disk."""
+    def test_get_available_exports_error_raises(self):
+        """An error response fails the provider's sync instead of exiting the process."""
+        mock_get = self.mock_get()
+        mock_get.return_value.status_code = 401
+
+        with self.assertRaises(LedgerLinkerException) as error:
+            asyncio.run(self.ledgerlinker_provider.get_available_exports())
+        self.assertIn('token appears to be invalid', str(error.exception))
+        mock_get.return_value.close.assert_called_once_with()
+
+    def test_get_available_exports_revalidates_with_etag(self):
+        """A stale cached export list is revalidated and reused when the server answers 304."""
+        mock_get = self.mock_get()
+        mock_get.return_value.headers = {'ETag': '"v1"'}
+        mock_get.return_value.json.return_value = EX1_AVAILABLE_EXPORT_RESPONSE
+        asyncio.run(self.ledgerlinker_provider.get_available_exports())
+
+        # A new provider only has the on disk cache to go on.
+        provider = LedgerLinkerServiceProvider(self.ledgerlinker_provider.config)
+        mock_get = self.mock_get(provider)
+        mock_get.return_value.status_code = 304
+
+        self.assertEqual(asyncio.run(provider.get_available_exports()), EX1_AVAILABLE_EXPORT_RESPONSE)
+        mock_get.assert_called_once_with(
+            'https://app.ledgerlinker.com/api/exports/',
+            headers={'Authorization': 'Token 123-token', 'If-None-Match': '"v1"'},
+            params=None,
+            retry=provider.retry_policy
+        )
+        mock_get.return_value.json.assert_not_called()
+
+    def test_get_available_exports_fresh_cache_skips_request(self):
+        self.ledgerlinker_provider.response_cache.ttl = 60
+        mock_get = self.mock_get()
+        mock_get.return_value.json.return_value = EX1_AVAILABLE_EXPORT_RESPONSE
+
+        asyncio.run(self.ledgerlinker_provider.get_available_exports())
+        self.assertEqual(asyncio.run(self.ledgerlinker_provider.get_available_exports()), EX1_AVAILABLE_EXPORT_RESPONSE)
+        mock_get.assert_called_once()
 
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = {
-            'fieldnames': ['date', 'amount', 'description'],
+    def test_get_export(self):
+        """Test getting a single export file and writing to disk."""
+        mock_get = self.mock_get()
+        mock_get.return_value.iter_content.return_value = chunk_json({
+            'fieldnames': ['date', 'amount', 'description', 'categories'],
             'transactions': [
-                {'date': '2020-01-01', 'amount': 1.00, 'description': 'POOP'},
+                {'date': '2020-01-01', 'amount': 1.00, 'description': 'POOP', 'categories': ['Food', 'Snacks']},
             ],
             'latest_transaction': '2020-01-01',
-        }
+        })
 
-        result = self.ledgerlinker_provider.get_export(
+        result = asyncio.run(self.ledgerlinker_provider.get_export(
             'testnick',
             'https://superledgerlink.test/api/v1/transaction_exports/1/download.json',
             date(2020,1,1)
-        )
+        ))
+
+        transactions, fieldnames, latest_transaction = result
+        self.assertEqual(
+            [transaction.as_dict() for transaction in transactions],
+            [{'date': '2020-01-01', 'amount': 1.00, 'description': 'POOP', 'categories': 'Food:Snacks'}])
+        self.assertEqual(transactions[0], ('2020-01-01', 1.00, 'POOP', 'Food:Snacks'))
+        self.assertEqual(fieldnames, ['date', 'amount', 'description', 'categories'])
+        self.assertEqual(latest_transaction, date(2020, 1, 1))
 
         mock_get.assert_called_with(
             'https://superledgerlink.test/api/v1/transaction_exports/1/download.json',
             headers={'Authorization': 'Token 123-token'},
             params={
                 'start_date': date(2020, 1, 1)
-            })
+            },
+            retry=self.ledgerlinker_provider.retry_policy)
 
     def test_sync_export(self):
         """Test syncing a single export file."""
-
-        new_transactions = ['TRANS']
-        latest_transaction_date = date(2020, 1, 1)
         fieldnames = ['date', 'amount', 'description']
+        stream = ExportStream(chunk_json({
+            'transactions': [{'date': '2020-01-07', 'amount': 1, 'description': 'TRANS'}],
+            'fieldnames': fieldnames,
+            'latest_transaction': '2020-01-07',
+        }))
 
         update_tracker = Mock()
         update_tracker.get.return_value = date(2020, 1, 5)
 
         self.ledgerlinker_provider.register_output = Mock()
-        self.ledgerlinker_provider.store = Mock()
+        stored = []
+        self.ledgerlinker_provider.store = lambda output_name, rows: stored.extend(row.as_dict() for row in rows)
+        self.ledgerlinker_provider.stream_export = AsyncMock(return_value=stream)
 
-        self.ledgerlinker_provider.get_export = Mock(return_value=(
-            new_transactions, fieldnames, latest_transaction_date
-        ))
         export_details = {
             'name': 'Test Export',
             'slug': 'test-export',
@@ -81,15 +144,214 @@ class LedgerLinkerProviderTestCase(TestCase):
             'csv_download_url': 'https://superledgerlink.test/api/v1/transaction_exports/1/download.csv',
         }
 
-        self.ledgerlinker_provider.sync_export(export_details, update_tracker)
+        asyncio.run(self.ledgerlinker_provider.sync_export(export_details, update_tracker))
         self.ledgerlinker_provider.register_output.assert_called_with('bank-test-test-export', 'test-export.csv', fieldnames)
-        self.ledgerlinker_provider.store.assert_called_with('bank-test-test-export', ['TRANS'])
+        self.assertEqual(stored, [{'date': '2020-01-07', 'amount': 1, 'description': 'TRANS'}])
+        update_tracker.update.assert_called_once_with('bank-test-test-export', date(2020, 1, 7))
 
-        self.ledgerlinker_provider.get_export.assert_called_once_with(
+        self.ledgerlinker_provider.stream_export.assert_called_once_with(
             'test-export',
             export_details['json_download_url'],
             start_date=date(2020, 1, 6))
 
+    def test_sync_continues_after_export_failure(self):
+        """All exports are synced concurrently and a failing export does not stop the others."""
+        self.ledgerlinker_provider.get_available_exports = AsyncMock(return_value=EX1_AVAILABLE_EXPORT_RESPONSE)
+
+        synced = []
+        async def sync_export(export_details, update_tracker):
+            if export_details['slug'] == 'bank-one-super-credit':
+                raise LedgerLinkerException('boom')
+            synced.append(export_details['slug'])
+
+        self.ledgerlinker_provider.sync_export = sync_export
+
+        with self.assertRaises(LedgerLinkerException) as error:
+            self.ledgerlinker_provider.sync(Mock())
+
+        self.assertEqual(str(error.exception), 'Failed to sync exports: bank-one-super-credit')
+        self.assertEqual(synced, ['wealthy-ira-5555'])
+
+    def test_export_concurrency_caps_exports_in_progress(self):
+        """Exports are only held back by the host limit unless `export_concurrency` caps them."""
+        exports = [dict(EX1_AVAILABLE_EXPORT_RESPONSE[0], slug=f'export-{index}') for index in range(10)]
+        self.ledgerlinker_provider.get_available_exports = AsyncMock(return_value=exports)
+
+        in_progress = []
+        most_in_progress = []
+        async def sync_export(export_details, update_tracker):
+            in_progress.append(export_details['slug'])
+            most_in_progress.append(len(in_progress))
+            await asyncio.sleep(0.01)
+            in_progress.remove(export_details['slug'])
+
+        self.ledgerlinker_provider.sync_export = sync_export
+        self.ledgerlinker_provider.sync(Mock())
+        self.assertEqual(max(most_in_progress), 10)
+
+        most_in_progress.clear()
+        self.ledgerlinker_provider.export_concurrency = 3
+        self.ledgerlinker_provider.sync(Mock())
+        self.assertEqual(len(most_in_progress), 10)
+        self.assertEqual(max(most_in_progress), 3)
+
+    def test_sync_export_csv_passthrough(self):
+        """The server CSV is appended to the output without its header and the tracker advanced."""
+        with TemporaryDirectory() as output_dir:
+            self.ledgerlinker_provider.config.output_dir = output_dir
+            self.ledgerlinker_provider.csv_passthrough = True
+            with open(os.path.join(output_dir, 'test-export.csv'), 'w') as output_file:
+                output_file.write('date,amount,description\n2020-01-05,3,OLD\n')
+
+            body = b'date,amount,description\r\n2020-01-06,1,"A, B"\r\n2020-01-07,2,C\r\n'
+            mock_get = self.mock_get()
+            mock_get.return_value.iter_content.return_value = [body[i:i + 5] for i in range(0, len(body), 5)]
+
+            update_tracker = Mock()
+            update_tracker.get.return_value = date(2020, 1, 5)
+            asyncio.run(self.ledgerlinker_provider.sync_export(EX1_EXPORT_DETAILS, update_tracker))
+
+            with open(os.path.join(output_dir, 'test-export.csv')) as output_file:
+                self.assertEqual(
+                    output_file.read(),
+                    'date,amount,description\n2020-01-05,3,OLD\n2020-01-06,1,"A, B"\n2020-01-07,2,C\n')
+
+        mock_get.assert_called_once_with(
+            EX1_EXPORT_DETAILS['csv_download_url'],
+            headers={'Authorization': 'Token 123-token'},
+            params={'start_date': date(2020, 1, 6)},
+            retry=self.ledgerlinker_provider.retry_policy)
+        update_tracker.update.assert_called_once_with('bank-test-test-export', date(2020, 1, 7))
+        self.assertEqual(self.ledgerlinker_provider.rows_written, 2)
+
+        metrics = self.ledgerlinker_provider.metrics
+        labels = {'provider': 'bank-test', 'output': 'bank-test-test-export'}
+        self.assertEqual(metrics.get_counter('http_requests', **labels), 1)
+        self.assertEqual(metrics.get_counter('response_bytes', **labels), len(body))
+        self.assertEqual(metrics.get_counter('rows_written', **labels), 2)
+        self.assertIsNotNone(metrics.get_gauge('last_sync_timestamp_seconds', **labels))
+
+    def test_sync_export_csv_passthrough_gzip_output(self):
+        """Passed through CSV rows are appended to a compressed output as a new gzip member."""
+        with TemporaryDirectory() as output_dir:
+            self.ledgerlinker_provider.config.output_dir = output_dir
+            self.ledgerlinker_provider.config.output_compression = 'gzip'
+            self.ledgerlinker_provider.csv_passthrough = True
+            output_path = os.path.join(output_dir, 'test-export.csv.gz')
+            with gzip.open(output_path, 'wt') as output_file:
+                output_file.write('date,amount,description\n2020-01-05,3,OLD\n')
+
+            mock_get = self.mock_get()
+            mock_get.return_value.iter_content.return_value = [b'date,amount,description\r\n2020-01-06,1,NEW\r\n']
+
+            asyncio.run(self.ledgerlinker_provider.sync_export(EX1_EXPORT_DETAILS, Mock(get=Mock(return_value=date(2020, 1, 5)))))
+
+            with gzip.open(output_path, 'rt') as output_file:
+                self.assertEqual(output_file.read(), 'date,amount,description\n2020-01-05,3,OLD\n2020-01-06,1,NEW\n')
+
+    def test_sync_export_csv_passthrough_fieldname_mismatch(self):
+        """A CSV whose header differs from the existing output falls back to the JSON download."""
+        with TemporaryDirectory() as output_dir:
+            self.ledgerlinker_provider.config.output_dir = output_dir
+            self.ledgerlinker_provider.csv_passthrough = True
+            with open(os.path.join(output_dir, 'test-export.csv'), 'w') as output_file:
+                output_file.write('date,amount\n')
+
+            self.ledgerlinker_provider.stream_csv_export = AsyncMock(return_value=CSVExportStream(
+                [b'date,amount,description\n2020-01-06,1,A\n']))
+            self.ledgerlinker_provider.stream_export = AsyncMock(return_value=ExportStream(chunk_json({
+                'fieldnames': ['date', 'amount'],
+                'transactions': [{'date': '2020-01-06', 'amount': 1}],
+                'latest_transaction': '2020-01-06',
+            })))
+
+            asyncio.run(self.ledgerlinker_provider.sync_export(EX1_EXPORT_DETAILS, Mock(get=Mock(return_value=None))))
+            self.ledgerlinker_provider.close()
+
+            with open(os.path.join(output_dir, 'test-export.csv')) as output_file:
+                self.assertEqual(output_file.read(), 'date,amount\n2020-01-06,1\n')
+
+
+    def test_sync_export_archives_response_for_rerender(self):
+        """Archived responses are replayed with the current settings, without any requests."""
+        with TemporaryDirectory() as output_dir:
+            config = ProviderConfig(name='bank-test', token='123-token', output_dir=output_dir, archive_responses=True)
+            provider = LedgerLinkerServiceProvider(config)
+            mock_get = self.mock_get(provider)
+            payloads = [
+                {'fieldnames': ['date', 'categories'], 'transactions': [{'date': '2020-01-06', 'categories': ['Food', 'Out']}], 'latest_transaction': '2020-01-06'},
+                {'fieldnames': ['date', 'categories'], 'transactions': [{'date': '2020-01-07', 'categories': ['Rent']}], 'latest_transaction': '2020-01-07'},
+            ]
+            for payload in payloads:
+                mock_get.return_value.iter_content.return_value = chunk_json(payload)
+                asyncio.run(provider.sync_export(EX1_EXPORT_DETAILS, Mock(get=Mock(return_value=None))))
+                provider.close()
+
+            entries = provider.response_archive.get_entries('bank-test', 'test-export')
+            self.assertEqual([entry['bytes'] for entry in entries], [len(json.dumps(payload)) for payload in payloads])
+            self.assertEqual(os.listdir(os.path.join(output_dir, '.archive', 'objects', entries[0]['sha256'][:2])), [f"{entries[0]['sha256']}.json.gz"])
+
+            with TemporaryDirectory() as rerender_dir:
+                config = ProviderConfig(name='bank-test', token='123-token', output_dir=rerender_dir, category_separator='/')
+                rerender_provider = LedgerLinkerServiceProvider(config)
+                rerender_provider.set_http_client(Mock(get=AsyncMock(side_effect=AssertionError('No requests expected'))))
+
+                self.assertEqual(rerender_provider.rerender_export('test-export', provider.response_archive), 2)
+                with open(os.path.join(rerender_dir, 'test-export.csv')) as output_file:
+                    self.assertEqual(output_file.read(), 'date,categories\n2020-01-06,Food/Out\n2020-01-07,Rent\n')
+
+    def test_failed_export_is_not_archived(self):
+        with TemporaryDirectory() as output_dir:
+            config = ProviderConfig(name='bank-test', token='123-token', output_dir=output_dir, archive_responses=True)
+            provider = LedgerLinkerServiceProvider(config)
+            provider.store = Mock(side_effect=OSError('Disk full'))
+            self.mock_get(provider).return_value.iter_content.return_value = chunk_json({'fieldnames': ['date'], 'transactions': []})
+
+            with self.assertRaises(OSError):
+                asyncio.run(provider.sync_export(EX1_EXPORT_DETAILS, Mock(get=Mock(return_value=None))))
+            provider.close()
+
+            self.assertEqual(provider.response_archive.get_entries('bank-test', 'test-export'), [])
+            self.assertEqual(os.listdir(os.path.join(output_dir, '.archive', 'objects')), [])
+
+
+class CSVExportStreamTestCase(TestCase):
+
+    def test_quoted_newlines_and_unsorted_dates(self):
+        """Records span chunks and newlines inside quotes; only record endings are normalized."""
+        body = b'date,"memo"\r\n2020-01-07,"two\r\nlines"\r\n2020-01-09,"say ""hi""\nthere"\r\n2020-01-08,last'
+        for chunk_size in (1, 2, 5, len(body)):
+            stream = CSVExportStream([body[i:i + chunk_size] for i in range(0, len(body), chunk_size)])
+
+            self.assertEqual(stream.fieldnames, ['date', 'memo'])
+            self.assertEqual(
+                b''.join(stream),
+                b'2020-01-07,"two\r\nlines"\n2020-01-09,"say ""hi""\nthere"\n2020-01-08,last\n')
+            self.assertEqual(stream.row_count, 3)
+            self.assertEqual(stream.last_row, ['2020-01-08', 'last'])
+            self.assertEqual(stream.latest_transaction, date(2020, 1, 9))
+
+    def test_header_only(self):
+        stream = CSVExportStream([b'date,amount'])
+
+        self.assertEqual(stream.fieldnames, ['date', 'amount'])
+        self.assertEqual(b''.join(stream), b'')
+        self.assertEqual(stream.row_count, 0)
+        self.assertIsNone(stream.latest_transaction)
+
+
+def chunk_json(payload, chunk_size=7):
+    """Split a JSON payload into small byte chunks as a streamed response would."""
+    body = json.dumps(payload).encode('utf-8')
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+EX1_EXPORT_DETAILS = {
+    'name': 'Test Export',
+    'slug': 'test-export',
+    'json_download_url': 'https://superledgerlink.test/api/v1/transaction_exports/1/download.json',
+    'csv_download_url': 'https://superledgerlink.test/api/v1/transaction_exports/1/download.csv',
+}
 
 EX1_AVAILABLE_EXPORT_RESPONSE = [
     {
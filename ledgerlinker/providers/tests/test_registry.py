@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from .. import ProviderRegistry, get_providers, ProviderConfig, ProviderException
+from ..base import Provider
+
+
+class ProviderRegistryTestCase(TestCase):
+
+    def test_client_import_is_lazy(self):
+        """Importing the client does not import provider modules or their dependencies."""
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, ledgerlinker.client; '
+            'print(sorted(name for name in ("requests", "commentjson", "ledgerlinker.providers.prosper", '
+            '"ledgerlinker.providers.adp", "ledgerlinker.providers.ledgerlinker_service") if name in sys.modules))'
+        ])
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_builtin_provider_imported_on_access(self):
+        registry = ProviderRegistry({'base': 'ledgerlinker.providers.base:Provider'})
+        self.assertIs(registry['base'], Provider)
+
+    def test_entry_point_provider(self):
+        entry_point = Mock()
+        entry_point.name = 'plugin'
+        entry_point.load.return_value = Provider
+
+        with patch('ledgerlinker.providers.iter_entry_points', return_value=[entry_point]) as iter_entry_points:
+            registry = ProviderRegistry({'base': 'ledgerlinker.providers.base:Provider'})
+            self.assertIs(registry['base'], Provider)
+            iter_entry_points.assert_not_called()
+
+            self.assertIs(registry['plugin'], Provider)
+            self.assertEqual(sorted(registry), ['base', 'plugin'])
+
+    def test_get_providers_unknown_provider(self):
+        config = ProviderConfig(name='test', output_dir='/tmp', provider='nope')
+        with patch('ledgerlinker.providers.iter_entry_points', return_value=[]):
+            with self.assertRaises(ProviderException):
+                get_providers({'test': config})
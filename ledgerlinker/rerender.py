@@ -0,0 +1,208 @@
+"""Rebuild outputs from the response archive without contacting any upstream service.
+
+After changing how exports are rendered, e.g. `category_separator` or the output
+format, `ledgerlinker rerender` replays every archived response of each export through
+its provider, as `sync` wrote them. Exports are rendered in parallel on a pool of worker
+processes, each into a staging directory under `.rerender` in the output dir. An export's
+new outputs, with their index and dedupe files, only replace the old ones once every
+archived response of the export was rendered, so a failure leaves the old outputs in place. The update tracker is
+not changed.
+
+An export whose archive starts part way, i.e. its first archived response was fetched
+from a start date because archiving was enabled after earlier syncs, is refused unless
+`force` is set: its outputs hold rows the archive cannot rebuild.
+
+Providers opt in by setting a `response_archive` and implementing `rerender_export`,
+see `LedgerLinkerServiceProvider`.
+"""
+from typing import Dict, List, Optional, Tuple, Type
+from contextlib import redirect_stdout
+import io
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+from ledgerlinker.providers.base import Provider, ProviderConfig
+
+STAGING_DIR_NAME = '.rerender'
+
+
+class ExportRerenderResult:
+    """The outcome of rerendering a single export."""
+
+    def __init__(
+        self,
+        provider_name : str,
+        slug : str,
+        wall_time : float,
+        rows_written : int,
+        error : Optional[str] = None,
+        output : str = ''
+    ):
+        self.provider_name = provider_name
+        self.slug = slug
+        self.wall_time = wall_time
+        self.rows_written = rows_written
+        self.error = error
+        self.output = output
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def get_staging_dir(output_dir : str, provider_name : str, slug : str) -> str:
+    return os.path.join(output_dir, STAGING_DIR_NAME, f'{provider_name}-{slug}')
+
+
+def rerender_export(
+    provider_class : Type[Provider],
+    config_options : Dict,
+    slug : str,
+    archive
+) -> ExportRerenderResult:
+    """Render an export from the archive into its staging directory, capturing any failure."""
+    output = io.StringIO()
+    rows_written = 0
+    error = None
+    start_time = time.monotonic()
+
+    staging_dir = get_staging_dir(config_options['output_dir'], config_options['name'], slug)
+    with redirect_stdout(output):
+        try:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            # Responses are only read from the archive, never archived again.
+            config = ProviderConfig(**dict(config_options, output_dir=staging_dir, archive_responses=False))
+            provider = provider_class(config)
+            rows_written = provider.rerender_export(slug, archive)
+        except Exception as rerender_error:
+            error = str(rerender_error) or type(rerender_error).__name__
+            traceback.print_exc(file=output)
+
+    return ExportRerenderResult(
+        config_options['name'], slug, time.monotonic() - start_time, rows_written, error, output.getvalue())
+
+
+def _rerender_task(task : Tuple) -> ExportRerenderResult:
+    return rerender_export(*task)
+
+
+def replace_outputs(staging_dir : str, output_dir : str) -> List[str]:
+    """Move the outputs rendered into a staging directory over those in the output dir.
+
+    The index, dedupe and other `.<name>.*` files of each replaced output go with it;
+    old ones without a replacement are removed. Returns the names of the outputs.
+    """
+    if not os.path.isdir(staging_dir):
+        # No responses were archived, so nothing was rendered.
+        return []
+
+    staged_names = os.listdir(staging_dir)
+    output_names = sorted(name for name in staged_names if not name.startswith('.'))
+    for name in output_names:
+        sidecar_prefix = f'.{name}.'
+        for staged_name in staged_names:
+            if staged_name != name and not staged_name.startswith(sidecar_prefix):
+                continue
+            target_path = os.path.join(output_dir, staged_name)
+            if os.path.isdir(target_path) and not os.path.islink(target_path):
+                shutil.rmtree(target_path)
+            os.replace(os.path.join(staging_dir, staged_name), target_path)
+
+        for existing_name in os.listdir(output_dir):
+            if existing_name.startswith(sidecar_prefix) and existing_name not in staged_names:
+                os.remove(os.path.join(output_dir, existing_name))
+
+    return output_names
+
+
+class Rerenderer:
+    """Rerender the archived exports of a client's providers on a pool of worker processes."""
+
+    def __init__(self, providers : Dict[str, Provider], processes : Optional[int] = None, force : bool = False):
+        self.providers = providers
+        self.processes = processes or os.cpu_count() or 1
+        self.force = force
+        self._context = multiprocessing.get_context()
+
+    def get_tasks(self) -> Tuple[List[Tuple], List[ExportRerenderResult]]:
+        """The exports to rerender, and the failed results of those refused."""
+        tasks = []
+        refused = []
+        for provider_name, provider in self.providers.items():
+            archive = getattr(provider, 'response_archive', None)
+            if archive is None:
+                print(f'Skipping {provider_name}: it does not archive responses.')
+                continue
+
+            slugs = archive.get_slugs(provider.config.name)
+            if not slugs:
+                print(f'Skipping {provider_name}: no archived responses found.')
+            for slug in slugs:
+                error = self.check_archive_start(archive, provider.config.name, slug)
+                if error is not None:
+                    refused.append(ExportRerenderResult(provider_name, slug, 0, 0, error))
+                    continue
+                tasks.append((type(provider), vars(provider.config), slug, archive))
+        return tasks, refused
+
+    def check_archive_start(self, archive, archive_name : str, slug : str) -> Optional[str]:
+        """Refuse an export whose archive does not go back to its first sync, unless forced."""
+        entries = archive.get_entries(archive_name, slug)
+        if self.force or not entries or entries[0]['start_date'] is None:
+            return None
+        return (
+            f'Its archive starts at {entries[0]["start_date"]}, so rows synced before then would be lost.'
+            ' Pass --force to rerender it anyway.')
+
+    def run(self, verbose : bool = False) -> List[ExportRerenderResult]:
+        tasks, results = self.get_tasks()
+        for result in results:
+            self.print_result(result, verbose)
+        if tasks:
+            processes = max(1, min(self.processes, len(tasks)))
+            with self._context.Pool(processes) as pool:
+                for result in pool.imap_unordered(_rerender_task, tasks, chunksize=1):
+                    self.finish(result)
+                    self.print_result(result, verbose)
+                    results.append(result)
+
+        self.print_summary(results)
+        return results
+
+    def finish(self, result : ExportRerenderResult):
+        """Swap in the outputs of a rendered export, or drop them if it failed."""
+        output_dir = self.providers[result.provider_name].config.output_dir
+        staging_dir = get_staging_dir(output_dir, result.provider_name, result.slug)
+        try:
+            if result.succeeded:
+                replace_outputs(staging_dir, output_dir)
+        except OSError as error:
+            result.error = f'Failed to replace outputs: {error}'
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            try:
+                os.rmdir(os.path.join(output_dir, STAGING_DIR_NAME))
+            except OSError:
+                # Other exports are still being rendered.
+                pass
+
+    def print_result(self, result : ExportRerenderResult, verbose : bool = False):
+        status = 'ok' if result.succeeded else 'FAILED'
+        print(
+            f'{result.provider_name} {result.slug}: {status} in {result.wall_time:.2f}s,'
+            f' {result.rows_written} rows')
+        if result.error is not None:
+            print(f'  {result.error}')
+        if verbose or not result.succeeded:
+            for line in result.output.splitlines():
+                print(f'    {line}')
+
+    def print_summary(self, results : List[ExportRerenderResult]):
+        failed = [result for result in results if not result.succeeded]
+        print(
+            f'Rerendered {len(results) - len(failed)} of {len(results)} exports,'
+            f' {sum(result.rows_written for result in results)} rows.')
+        for result in failed:
+            print(f'  FAILED {result.provider_name} {result.slug}')
@@ -0,0 +1,168 @@
+"""A content addressed archive of raw export responses, used to rebuild outputs offline.
+
+Each response body is stored once, compressed, under `objects/` and named by the
+SHA-256 of its content. `exports/<provider>/<slug>.jsonl` lists the responses an
+export was synced from, in the order they were written to its outputs, so replaying
+them through the provider rebuilds the outputs with its current settings:
+
+    {"sha256": "9f86d0...", "compression": "gzip", "bytes": 52811, "start_date": "2024-03-01", "archived_at": 1712345678.9}
+
+A response is only listed once the rows parsed from it have been written, so an
+interrupted sync never leaves an entry that its outputs do not reflect.
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+from datetime import date
+import hashlib
+import json
+import os
+import tempfile
+import time
+from ledgerlinker.compression import CompressedAppender, get_extension, open_binary_reader
+
+ARCHIVE_DIR_NAME = '.archive'
+DEFAULT_ARCHIVE_COMPRESSION = 'gzip'
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseArchive:
+    """The archive of the export responses synced to one output dir."""
+
+    def __init__(self, archive_dir : str, compression : str = DEFAULT_ARCHIVE_COMPRESSION):
+        get_extension(compression)
+        self.archive_dir = archive_dir
+        self.compression = compression
+        self.objects_dir = os.path.join(archive_dir, 'objects')
+        self.exports_dir = os.path.join(archive_dir, 'exports')
+
+    def get_object_path(self, digest : str, compression : Optional[str] = None) -> str:
+        compression = compression or self.compression
+        return os.path.join(self.objects_dir, digest[:2], f'{digest}.json{get_extension(compression)}')
+
+    def _get_list_path(self, provider_name : str, slug : str) -> str:
+        return os.path.join(self.exports_dir, provider_name, f'{slug}.jsonl')
+
+    def archive_chunks(
+        self,
+        provider_name : str,
+        slug : str,
+        chunks : Iterable[bytes],
+        start_date : Optional[date] = None
+    ) -> 'ArchivedChunks':
+        """Copy a response body to the archive as it is read. See `ArchivedChunks.commit`."""
+        return ArchivedChunks(self, provider_name, slug, chunks, start_date)
+
+    def get_slugs(self, provider_name : str) -> List[str]:
+        """The exports of a provider with archived responses."""
+        try:
+            file_names = os.listdir(os.path.join(self.exports_dir, provider_name))
+        except FileNotFoundError:
+            return []
+        return sorted(file_name[:-len('.jsonl')] for file_name in file_names if file_name.endswith('.jsonl'))
+
+    def get_entries(self, provider_name : str, slug : str) -> List[Dict]:
+        """The archived responses of an export, oldest first."""
+        list_path = self._get_list_path(provider_name, slug)
+        entries = []
+        try:
+            with open(list_path, 'r') as list_file:
+                for line in list_file:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # Only the last line can be cut short, by a crash while it was written.
+                        print(f'Warning: ignoring corrupt archive entry in {list_path}.')
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def iter_object(self, entry : Dict, chunk_size : int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """Iterate the decompressed body of an archived response."""
+        with open_binary_reader(self.get_object_path(entry['sha256'], entry['compression']), entry['compression']) as body:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _store_object(self, temp_path : str, digest : str):
+        object_path = self.get_object_path(digest)
+        if os.path.exists(object_path):
+            # The same body was archived before.
+            os.remove(temp_path)
+            return
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(temp_path, object_path)
+
+    def _add_entry(self, provider_name : str, slug : str, entry : Dict):
+        list_path = self._get_list_path(provider_name, slug)
+        os.makedirs(os.path.dirname(list_path), exist_ok=True)
+        with open(list_path, 'a') as list_file:
+            list_file.write(json.dumps(entry) + '\n')
+            list_file.flush()
+            os.fsync(list_file.fileno())
+
+
+class ArchivedChunks:
+    """The chunks of a response body, compressed to a temporary file as they are read.
+
+    `commit` stores the body in the archive and lists it under its export once its rows
+    have been written. `discard` drops it; it is a no-op after `commit`.
+    """
+
+    def __init__(
+        self,
+        archive : ResponseArchive,
+        provider_name : str,
+        slug : str,
+        chunks : Iterable[bytes],
+        start_date : Optional[date] = None
+    ):
+        self.archive = archive
+        self.provider_name = provider_name
+        self.slug = slug
+        self.start_date = start_date
+        self._chunks = iter(chunks)
+        self._hash = hashlib.sha256()
+        self._bytes = 0
+
+        os.makedirs(archive.objects_dir, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(dir=archive.objects_dir, suffix='.tmp')
+        os.close(fd)
+        self._writer : Optional[CompressedAppender] = CompressedAppender(self._temp_path, archive.compression, binary=True)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._chunks:
+            self._writer.write(chunk)
+            self._hash.update(chunk)
+            self._bytes += len(chunk)
+            yield chunk
+
+    def commit(self) -> Dict:
+        """Archive the rest of the body and list the response under its export."""
+        # The parser stops at the end of the JSON object; keep any trailing bytes too.
+        for _ in self:
+            pass
+        self._writer.close()
+        self._writer = None
+
+        digest = self._hash.hexdigest()
+        self.archive._store_object(self._temp_path, digest)
+        entry = {
+            'sha256': digest,
+            'compression': self.archive.compression,
+            'bytes': self._bytes,
+            'start_date': str(self.start_date) if self.start_date is not None else None,
+            'archived_at': time.time(),
+        }
+        self.archive._add_entry(self.provider_name, self.slug, entry)
+        return entry
+
+    def discard(self):
+        if self._writer is None:
+            return
+
+        self._writer.close()
+        self._writer = None
+        os.remove(self._temp_path)
@@ -0,0 +1,101 @@
+"""Compact rows passed from parsing to the sinks.
+
+A `RowSchema` turns parsed records into `Row` tuples positioned by an output's
+fieldnames. Tuples take a fraction of the memory of a dict per row and sinks whose
+columns are in the same order write them without looking up each field by name.
+Strings that repeat across rows, such as account and category names, are interned so
+rows held in memory share one copy of them.
+
+Rows still support `row.get(fieldname)`, so code written against dict rows, and
+sinks given plain dicts, keep working.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
+import sys
+
+# Fields whose values are drawn from a small set of strings.
+DEFAULT_INTERN_FIELDS = ('account', 'categories', 'category', 'payee', 'currency')
+
+
+class Row(tuple):
+    """A tuple of field values. Each `RowSchema` has its own subclass carrying the schema."""
+
+    __slots__ = ()
+
+    schema : 'RowSchema' = None
+
+    def get(self, fieldname : str, default : Any = None) -> Any:
+        index = self.schema.positions.get(fieldname)
+        if index is None:
+            return default
+        return self[index]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.schema.fieldnames, self))
+
+
+class RowSchema:
+    """Build rows for one set of fieldnames.
+
+    converters: Functions applied to the value of a field, e.g. to join a list of categories.
+    intern_fields: Fields whose string values are interned.
+    """
+
+    def __init__(
+        self,
+        fieldnames : Sequence[str],
+        converters : Optional[Mapping[str, Callable[[Any], Any]]] = None,
+        intern_fields : Iterable[str] = DEFAULT_INTERN_FIELDS
+    ):
+        self.fieldnames = list(fieldnames)
+        self.positions = {fieldname: index for index, fieldname in enumerate(self.fieldnames)}
+        self.row_type = type('Row', (Row,), {'__slots__': (), 'schema': self})
+
+        converters = converters or {}
+        self._converters = [
+            (self.positions[fieldname], converter)
+            for fieldname, converter in converters.items()
+            if fieldname in self.positions
+        ]
+        self._intern_positions = [
+            self.positions[fieldname]
+            for fieldname in intern_fields
+            if fieldname in self.positions
+        ]
+
+    def from_mapping(self, mapping : Mapping[str, Any]) -> Row:
+        """Build a row from a dict, e.g. a decoded JSON object. Missing fields are None."""
+        get = mapping.get
+        return self._finish([get(fieldname) for fieldname in self.fieldnames])
+
+    def from_values(self, values : Iterable[Any]) -> Row:
+        """Build a row from values already in fieldname order."""
+        return self._finish(list(values))
+
+    def _finish(self, values : List[Any]) -> Row:
+        for index, converter in self._converters:
+            if values[index] is not None:
+                values[index] = converter(values[index])
+        for index in self._intern_positions:
+            value = values[index]
+            if type(value) is str:
+                values[index] = sys.intern(value)
+        return self.row_type(values)
+
+
+def iter_row_values(rows : Iterable[Mapping], fieldnames : List[str]) -> Iterator[tuple]:
+    """Yield the values of each row in `fieldnames` order. Missing fields are None.
+
+    Rows built for the same fieldnames are passed through untouched; other rows,
+    including plain dicts, have their values looked up by name.
+    """
+    matching_type = None
+    for row in rows:
+        row_type = type(row)
+        if row_type is matching_type:
+            yield row
+        elif isinstance(row, Row) and row.schema.fieldnames == fieldnames:
+            matching_type = row_type
+            yield row
+        else:
+            get = row.get
+            yield tuple([get(fieldname) for fieldname in fieldnames])
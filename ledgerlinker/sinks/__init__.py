@@ -0,0 +1,23 @@
+from typing import Dict, Type
+from .base import Sink, SinkException, DEFAULT_WRITE_BUFFER_SIZE
+from .csv_sink import CSVSink
+from .sqlite_sink import SQLiteSink
+from .parquet_sink import ParquetSink
+from .partitioned_sink import PartitionedSink, PARTITION_PERIODS, DEFAULT_PARTITION_PERIOD
+
+SINKS = {
+    'csv': CSVSink,
+    'sqlite': SQLiteSink,
+    'parquet': ParquetSink,
+}
+
+DEFAULT_OUTPUT_FORMAT = 'csv'
+
+
+def get_sink_class(output_format : str) -> Type[Sink]:
+    """Return the sink class for an `output_format` config value."""
+    try:
+        return SINKS[output_format]
+    except KeyError:
+        raise SinkException(
+            f'Unknown output format {output_format}. Expected one of: {", ".join(SINKS)}.')
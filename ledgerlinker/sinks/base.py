@@ -0,0 +1,67 @@
+import os
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+# Size in bytes of the buffer used by file based sinks.
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Number of rows handed to the underlying writer at a time.
+WRITE_BATCH_SIZE = 1000
+
+
+class SinkException(Exception):
+    pass
+
+
+class Sink:
+    """Base class for an output that provider rows are appended to.
+
+    A sink is opened for one output of one sync run. When the output already exists
+    its fieldnames take precedence over the expected fieldnames so appends stay
+    consistent with what was written before.
+    """
+
+    # File name extension replacing the one of the requested output file name.
+    extension = ''
+
+    # Whether the sink can write compressed files, see `ledgerlinker.compression`.
+    compressible = False
+
+    def __init__(
+        self,
+        path : str,
+        fieldnames : List[str],
+        write_buffer_size : int = DEFAULT_WRITE_BUFFER_SIZE,
+        compression : Optional[str] = None
+    ):
+        self.check_compression(compression)
+        self.path = path
+        self.fieldnames = fieldnames
+        self.write_buffer_size = write_buffer_size
+        self.compression = compression
+
+    @classmethod
+    def check_compression(cls, compression : Optional[str]):
+        if compression is not None and not cls.compressible:
+            raise SinkException(f'{cls.__name__} outputs cannot be compressed.')
+
+    @classmethod
+    def get_path(cls, output_dir : str, output_file_name : str, compression : Optional[str] = None) -> str:
+        """Build the path of the sink from the output file name requested by a provider."""
+        base_name, _ = os.path.splitext(output_file_name)
+        return os.path.join(output_dir, base_name + cls.extension)
+
+    def exists(self) -> bool:
+        """Whether the output held rows before this sink was opened."""
+        raise NotImplementedError
+
+    def read_rows(self) -> Iterator[Dict]:
+        """Iterate over the rows previously written to the output."""
+        raise NotImplementedError
+
+    def write_rows(self, rows : Iterable[Dict]) -> int:
+        """Append rows to the output, returning the number written."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flush buffered rows and make them durable."""
@@ -0,0 +1,124 @@
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+from csv import DictReader, writer as csv_writer_factory
+from ledgerlinker.compression import CompressedAppender, get_extension, open_reader
+from ledgerlinker.output_index import OutputIndex, render_row
+from ledgerlinker.rows import iter_row_values
+from .base import Sink, DEFAULT_WRITE_BUFFER_SIZE, WRITE_BATCH_SIZE
+
+
+class CSVSink(Sink):
+    """Append rows to a CSV file.
+
+    Compressed files get a new gzip member or zstd frame for every sync run that
+    writes rows. It is only opened on the first write so runs without new rows leave
+    the file untouched, and existing rows stay readable while the sink is open.
+
+    Every file has a sidecar `OutputIndex`, so opening an existing output does not
+    parse it and an append interrupted by a crash is repaired before writing.
+    """
+
+    extension = '.csv'
+    compressible = True
+
+    def __init__(
+        self,
+        path : str,
+        fieldnames : List[str],
+        write_buffer_size : int = DEFAULT_WRITE_BUFFER_SIZE,
+        compression : Optional[str] = None
+    ):
+        self.index = OutputIndex.open(path, compression)
+        existing_fieldnames = self.index.fieldnames if self.index is not None else None
+        self._existed = existing_fieldnames is not None
+        if existing_fieldnames:
+            if existing_fieldnames != fieldnames:
+                print('Warning: fieldnames in existing file do not match expected fieldnames. Using existing file fields.')
+            fieldnames = existing_fieldnames
+
+        super().__init__(path, fieldnames, write_buffer_size, compression)
+
+        if self.index is None:
+            self.index = OutputIndex(path, compression)
+        self.index.fieldnames = fieldnames
+        self._rows_written = 0
+        self._last_row = None
+
+        self._fp = None
+        self._csv_writer = None
+        if compression is None:
+            self._open_writer()
+
+        if not self._existed:
+            self._get_csv_writer().writerow(fieldnames)
+            if compression is None:
+                self._fp.flush()
+
+    def _open_writer(self):
+        if self.compression is None:
+            self._fp = open(self.path, 'a+', buffering=self.write_buffer_size)
+        else:
+            self._fp = CompressedAppender(self.path, self.compression, buffer_size=self.write_buffer_size)
+
+        # Rows are written as tuples in fieldname order; fields missing from a row are left empty.
+        self._csv_writer = csv_writer_factory(self._fp, lineterminator='\n')
+
+    def _get_csv_writer(self):
+        if self._csv_writer is None:
+            self._open_writer()
+        return self._csv_writer
+
+    @classmethod
+    def get_path(cls, output_dir : str, output_file_name : str, compression : Optional[str] = None) -> str:
+        # CSV outputs keep the exact file name providers ask for.
+        return os.path.join(output_dir, output_file_name + get_extension(compression))
+
+    @staticmethod
+    def read_fieldnames(path : str, compression : Optional[str] = None) -> Optional[List[str]]:
+        """Read the header of an existing CSV file, or None if there is no file.
+
+        Only the start of a compressed file is decompressed.
+        """
+        if not os.path.exists(path):
+            return None
+
+        with open_reader(path, compression) as fp:
+            return DictReader(fp).fieldnames
+
+    def exists(self) -> bool:
+        return self._existed
+
+    def read_rows(self) -> Iterator[Dict]:
+        if self.compression is None:
+            self._fp.flush()
+        with open_reader(self.path, self.compression) as fp:
+            yield from DictReader(fp)
+
+    def write_rows(self, rows : Iterable[Dict]) -> int:
+        rows = iter_row_values(rows, self.fieldnames)
+        writerows = None
+        row_count = 0
+        while True:
+            batch = list(islice(rows, WRITE_BATCH_SIZE))
+            if not batch:
+                self._rows_written += row_count
+                return row_count
+            if writerows is None:
+                writerows = self._get_csv_writer().writerows
+            writerows(batch)
+            row_count += len(batch)
+            self._last_row = batch[-1]
+
+    def close(self):
+        if self._fp is None:
+            return
+
+        if self.compression is None:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+        self._fp.close()
+        self._fp = None
+
+        last_row = render_row(self._last_row, self.fieldnames) if self._last_row is not None else None
+        self.index.record_append(self._rows_written, last_row)
@@ -0,0 +1,110 @@
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+from ledgerlinker.rows import iter_row_values
+from .base import Sink, SinkException, DEFAULT_WRITE_BUFFER_SIZE
+
+# Rows buffered before they are written out as one Parquet row group.
+ROW_GROUP_SIZE = 10000
+
+
+class ParquetSink(Sink):
+    """Append rows to a Parquet dataset directory.
+
+    Parquet files cannot be appended to, so every sync run adds a new part file to the
+    dataset. Columns are stored as strings rendered like the CSV outputs so that parts
+    written by different runs always share a schema.
+    """
+
+    extension = '.parquet'
+
+    def __init__(
+        self,
+        path : str,
+        fieldnames : List[str],
+        write_buffer_size : int = DEFAULT_WRITE_BUFFER_SIZE,
+        compression : Optional[str] = None
+    ):
+        self.check_compression(compression)
+
+        if not self.load_dependency():
+            raise SinkException(
+                'Cannot write Parquet outputs because pyarrow is not installed. Please install the pyarrow package.'
+                'pip install pyarrow'
+            )
+
+        os.makedirs(path, exist_ok=True)
+        self._existing_parts = self.get_part_paths(path)
+        if self._existing_parts:
+            existing_fieldnames = self._parquet.read_schema(self._existing_parts[0]).names
+            if existing_fieldnames != fieldnames:
+                print('Warning: fieldnames in existing file do not match expected fieldnames. Using existing file fields.')
+            fieldnames = existing_fieldnames
+
+        super().__init__(path, fieldnames, write_buffer_size, compression)
+
+        self._schema = self._pyarrow.schema([(fieldname, self._pyarrow.string()) for fieldname in fieldnames])
+        self._writer = None
+        self._part_path = os.path.join(
+            path,
+            f"part-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}.parquet")
+
+    def load_dependency(self):
+        """Load pyarrow, which is only required when Parquet outputs are configured."""
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            self._pyarrow = pyarrow
+            self._parquet = pyarrow.parquet
+        except ModuleNotFoundError:
+            return False
+        return True
+
+    @staticmethod
+    def get_part_paths(path : str) -> List[str]:
+        return sorted(
+            os.path.join(path, file_name)
+            for file_name in os.listdir(path)
+            if file_name.endswith('.parquet')
+        )
+
+    def exists(self) -> bool:
+        return bool(self._existing_parts)
+
+    def read_rows(self) -> Iterator[Dict]:
+        for part_path in self.get_part_paths(self.path):
+            if part_path == self._part_path:
+                continue
+            for batch in self._parquet.ParquetFile(part_path).iter_batches():
+                yield from batch.to_pylist()
+
+    def _write_batch(self, rows : List[tuple]):
+        columns = [
+            [None if value is None else str(value) for value in column]
+            for column in zip(*rows)
+        ]
+
+        if self._writer is None:
+            self._writer = self._parquet.ParquetWriter(self._part_path, self._schema)
+        self._writer.write_table(self._pyarrow.Table.from_arrays(columns, schema=self._schema))
+
+    def write_rows(self, rows : Iterable[Dict]) -> int:
+        row_count = 0
+        batch = []
+        for row in iter_row_values(rows, self.fieldnames):
+            batch.append(row)
+            if len(batch) >= ROW_GROUP_SIZE:
+                self._write_batch(batch)
+                row_count += len(batch)
+                batch = []
+
+        if batch:
+            self._write_batch(batch)
+            row_count += len(batch)
+
+        return row_count
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
@@ -0,0 +1,209 @@
+import json
+import os
+import re
+import tempfile
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Type
+from ledgerlinker.rows import RowSchema, iter_row_values
+from .base import Sink, SinkException, DEFAULT_WRITE_BUFFER_SIZE
+from .csv_sink import CSVSink
+
+MANIFEST_FILE_NAME = 'manifest.json'
+
+# Partition names by period, built from an ISO formatted date.
+PARTITION_PERIODS = {
+    'year': lambda day: day[:4],
+    'month': lambda day: f'{day[:4]}/{day[5:7]}',
+    'day': lambda day: f'{day[:4]}/{day[5:7]}/{day[8:10]}',
+}
+
+DEFAULT_PARTITION_PERIOD = 'month'
+
+# Rows without a usable `date` are kept together in their own partition.
+UNDATED_PARTITION = 'undated'
+
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+class PartitionedSink(Sink):
+    """Split an output into one file per period of the rows' `date` column.
+
+    The output is a directory, e.g. `<slug>/2026/10.csv`, holding a partition per
+    month (or year, or day) in the format of `partition_sink_class`. Appends only open
+    the partitions the new rows fall in. `manifest.json` lists every partition with its
+    row count and date range so readers can pick the partitions they need:
+
+        {
+            "fieldnames": ["date", "amount", ...],
+            "period": "month",
+            "partitions": [
+                {"path": "2026/10.csv", "rows": 120, "min_date": "2026-10-01", "max_date": "2026-10-31"}
+            ]
+        }
+
+    A partition is added to the manifest before its file is created, so an interrupted
+    sync never leaves a partition unlisted. Row counts and date ranges are brought up to
+    date when the sink is closed.
+    """
+
+    # Compression is applied to each partition, if the partition sink class supports it.
+    compressible = True
+
+    def __init__(
+        self,
+        path : str,
+        fieldnames : List[str],
+        write_buffer_size : int = DEFAULT_WRITE_BUFFER_SIZE,
+        compression : Optional[str] = None,
+        partition_sink_class : Type[Sink] = CSVSink,
+        period : str = DEFAULT_PARTITION_PERIOD
+    ):
+        partition_sink_class.check_compression(compression)
+        if period not in PARTITION_PERIODS:
+            raise SinkException(
+                f'Unknown partition period {period}. Expected one of: {", ".join(PARTITION_PERIODS)}.')
+
+        os.makedirs(path, exist_ok=True)
+        self.manifest_path = os.path.join(path, MANIFEST_FILE_NAME)
+        manifest = self.read_manifest(self.manifest_path)
+        if manifest is not None:
+            if manifest['fieldnames'] != fieldnames:
+                print('Warning: fieldnames in existing file do not match expected fieldnames. Using existing file fields.')
+            if manifest['period'] != period:
+                print(f'Warning: {path} is partitioned by {manifest["period"]}, not {period}. Using the existing period.')
+            fieldnames = manifest['fieldnames']
+            period = manifest['period']
+
+        super().__init__(path, fieldnames, write_buffer_size, compression)
+
+        self.partition_sink_class = partition_sink_class
+        self.period = period
+        self._partition_name = PARTITION_PERIODS[period]
+        self._entries : Dict[str, Dict] = {
+            entry['path']: entry
+            for entry in (manifest['partitions'] if manifest else [])
+        }
+        self._partitions : Dict[str, Sink] = {}
+        self._schema = RowSchema(fieldnames, intern_fields=())
+        self._date_index = self._schema.positions.get('date')
+
+    @classmethod
+    def get_path(cls, output_dir : str, output_file_name : str, compression : Optional[str] = None) -> str:
+        base_name, _ = os.path.splitext(output_file_name)
+        return os.path.join(output_dir, base_name)
+
+    @staticmethod
+    def read_manifest(manifest_path : str) -> Optional[Dict]:
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+
+    @property
+    def partitions(self) -> List[Dict]:
+        """The manifest entries of all partitions, ordered by path."""
+        return [self._entries[path] for path in sorted(self._entries)]
+
+    def get_partition_name(self, value) -> str:
+        day = '' if value is None else str(value)
+        if not ISO_DATE.match(day):
+            return UNDATED_PARTITION
+        return self._partition_name(day)
+
+    def get_partition_path(self, partition_name : str) -> str:
+        """The path of a partition's file, relative to the output directory."""
+        partition_path = self.partition_sink_class.get_path(self.path, f'{partition_name}.csv', self.compression)
+        return os.path.relpath(partition_path, self.path).replace(os.sep, '/')
+
+    def _open_partition(self, relative_path : str) -> Sink:
+        partition_path = os.path.join(self.path, relative_path)
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        return self.partition_sink_class(
+            partition_path,
+            list(self.fieldnames),
+            write_buffer_size=self.write_buffer_size,
+            compression=self.compression)
+
+    def _get_partition(self, relative_path : str) -> Sink:
+        if relative_path not in self._partitions:
+            self._partitions[relative_path] = self._open_partition(relative_path)
+        return self._partitions[relative_path]
+
+    def exists(self) -> bool:
+        return bool(self._entries)
+
+    def read_rows(self) -> Iterator[Dict]:
+        for entry in self.partitions:
+            partition = self._partitions.get(entry['path'])
+            if partition is not None:
+                yield from partition.read_rows()
+                continue
+
+            partition = self._open_partition(entry['path'])
+            try:
+                yield from partition.read_rows()
+            finally:
+                partition.close()
+
+    def _get_row_partition(self, row) -> str:
+        if self._date_index is None:
+            return UNDATED_PARTITION
+        return self.get_partition_name(row[self._date_index])
+
+    def write_rows(self, rows : Iterable[Dict]) -> int:
+        row_type = self._schema.row_type
+        rows = (
+            row if type(row) is row_type else row_type(row)
+            for row in iter_row_values(rows, self.fieldnames)
+        )
+
+        row_count = 0
+        # Rows usually arrive ordered by date, so consecutive rows share a partition.
+        for partition_name, partition_rows in groupby(rows, key=self._get_row_partition):
+            relative_path = self.get_partition_path(partition_name)
+            entry = self._entries.get(relative_path)
+            if entry is None:
+                entry = self._entries[relative_path] = {
+                    'path': relative_path, 'rows': 0, 'min_date': None, 'max_date': None}
+                self.write_manifest()
+            written = self._get_partition(relative_path).write_rows(self._track_dates(entry, partition_rows))
+            entry['rows'] += written
+            row_count += written
+
+        return row_count
+
+    def _track_dates(self, entry : Dict, rows : Iterable) -> Iterator:
+        date_index = self._date_index
+        for row in rows:
+            if date_index is not None and row[date_index] is not None:
+                day = str(row[date_index])
+                if entry['min_date'] is None or day < entry['min_date']:
+                    entry['min_date'] = day
+                if entry['max_date'] is None or day > entry['max_date']:
+                    entry['max_date'] = day
+            yield row
+
+    def write_manifest(self):
+        """Replace the manifest atomically so readers never see a partial file."""
+        manifest = {
+            'fieldnames': self.fieldnames,
+            'period': self.period,
+            'partitions': self.partitions,
+        }
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix='.manifest.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+                manifest_file.flush()
+                os.fsync(manifest_file.fileno())
+            os.replace(temp_path, self.manifest_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def close(self):
+        for partition in self._partitions.values():
+            partition.close()
+        self._partitions = {}
+        self.write_manifest()
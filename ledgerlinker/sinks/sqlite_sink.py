@@ -0,0 +1,71 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional
+from ledgerlinker.rows import iter_row_values
+from .base import Sink, DEFAULT_WRITE_BUFFER_SIZE
+
+TABLE_NAME = 'rows'
+
+# Columns indexed when present so reports can select date ranges or single transactions.
+INDEXED_COLUMNS = ('date', 'id')
+
+
+def quote_identifier(name : str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteSink(Sink):
+    """Append rows to a table in an SQLite database."""
+
+    extension = '.sqlite'
+
+    def __init__(
+        self,
+        path : str,
+        fieldnames : List[str],
+        write_buffer_size : int = DEFAULT_WRITE_BUFFER_SIZE,
+        compression : Optional[str] = None
+    ):
+        self.check_compression(compression)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        existing_fieldnames = [
+            column[1]
+            for column in self._connection.execute(f'PRAGMA table_info({TABLE_NAME})')
+        ]
+
+        self._existed = bool(existing_fieldnames)
+        if self._existed:
+            if existing_fieldnames != fieldnames:
+                print('Warning: fieldnames in existing file do not match expected fieldnames. Using existing file fields.')
+            fieldnames = existing_fieldnames
+        else:
+            columns = ', '.join(quote_identifier(fieldname) for fieldname in fieldnames)
+            self._connection.execute(f'CREATE TABLE {TABLE_NAME} ({columns})')
+            for column in INDEXED_COLUMNS:
+                if column in fieldnames:
+                    self._connection.execute(
+                        f'CREATE INDEX {quote_identifier(TABLE_NAME + "_" + column)}'
+                        f' ON {TABLE_NAME} ({quote_identifier(column)})')
+            self._connection.commit()
+
+        super().__init__(path, fieldnames, write_buffer_size, compression)
+
+        placeholders = ', '.join('?' for _ in fieldnames)
+        self._insert_sql = f'INSERT INTO {TABLE_NAME} VALUES ({placeholders})'
+
+    def exists(self) -> bool:
+        return self._existed
+
+    def read_rows(self) -> Iterator[Dict]:
+        cursor = self._connection.execute(f'SELECT * FROM {TABLE_NAME}')
+        for values in cursor:
+            yield dict(zip(self.fieldnames, values))
+
+    def write_rows(self, rows : Iterable[Dict]) -> int:
+        cursor = self._connection.executemany(self._insert_sql, iter_row_values(rows, self.fieldnames))
+        return max(cursor.rowcount, 0)
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
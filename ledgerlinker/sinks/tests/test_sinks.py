@@ -0,0 +1,233 @@
+import gzip
+import json
+import os
+import sqlite3
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from ..base import SinkException
+from ..csv_sink import CSVSink
+from ..sqlite_sink import SQLiteSink
+from ..parquet_sink import ParquetSink
+from ..partitioned_sink import PartitionedSink
+from .. import get_sink_class
+
+try:
+    import pyarrow
+    HAS_PYARROW = True
+except ModuleNotFoundError:
+    HAS_PYARROW = False
+
+try:
+    import zstandard
+    HAS_ZSTANDARD = True
+except ModuleNotFoundError:
+    HAS_ZSTANDARD = False
+
+
+class SinkTestMixin:
+    sink_class = None
+    compression = None
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = self.sink_class.get_path(self.temp_dir.name, 'test.csv', self.compression)
+
+    def open_sink(self, fieldnames, **kwargs):
+        return self.sink_class(self.path, fieldnames, compression=self.compression, **kwargs)
+
+    def test_append_across_runs(self):
+        """Rows written by separate runs are all read back and existing fieldnames win."""
+        sink = self.open_sink(['date', 'id', 'amount'])
+        self.assertFalse(sink.exists())
+        self.assertEqual(sink.write_rows(iter([{'date': '2020-01-01', 'id': 'a', 'amount': '1'}])), 1)
+        sink.close()
+
+        sink = self.open_sink(['date', 'id'])
+        self.assertTrue(sink.exists())
+        self.assertEqual(sink.fieldnames, ['date', 'id', 'amount'])
+        self.assertEqual(sink.write_rows([{'date': '2020-01-02', 'id': 'b', 'amount': '2'}]), 1)
+        sink.close()
+
+        sink = self.open_sink(['date', 'id', 'amount'])
+        self.assertEqual(
+            [row['id'] for row in sink.read_rows()],
+            ['a', 'b'])
+        sink.close()
+
+
+class CSVSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = CSVSink
+
+    def test_path_keeps_file_name(self):
+        self.assertEqual(self.path, os.path.join(self.temp_dir.name, 'test.csv'))
+
+    def test_bulk_write_from_generator_fsyncs_once(self):
+        """Rows from a generator are written in batches and synced to disk when closed."""
+        sink = self.sink_class(self.path, ['id'], write_buffer_size=4096)
+        rows = ({'id': row_id} for row_id in range(2500))
+        self.assertEqual(sink.write_rows(rows), 2500)
+
+        output_fd = sink._fp.fileno()
+        with patch('ledgerlinker.sinks.csv_sink.os.fsync') as fsync:
+            sink.close()
+        # The output is synced once, then its sidecar index.
+        self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(fsync.call_args_list[0].args, (output_fd,))
+
+        with open(self.path) as output_file:
+            lines = output_file.read().splitlines()
+        self.assertEqual(len(lines), 2501)
+        self.assertEqual(lines[-1], '2499')
+
+
+class GzipCSVSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = CSVSink
+    compression = 'gzip'
+
+    def test_each_run_appends_a_member(self):
+        """Every run that writes rows appends a gzip member; runs without rows leave the file alone."""
+        self.assertEqual(self.path, os.path.join(self.temp_dir.name, 'test.csv.gz'))
+
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2020-01-01', 'id': 'a'}])
+        sink.close()
+        size = os.path.getsize(self.path)
+
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([])
+        sink.close()
+        self.assertEqual(os.path.getsize(self.path), size)
+
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2020-01-02', 'id': 'b'}])
+        sink.close()
+
+        with gzip.open(self.path, 'rt') as fp:
+            self.assertEqual(fp.read(), 'date,id\n2020-01-01,a\n2020-01-02,b\n')
+
+
+@skipUnless(HAS_ZSTANDARD, 'zstandard is not installed')
+class ZstdCSVSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = CSVSink
+    compression = 'zstd'
+
+    def test_read_fieldnames(self):
+        sink = self.open_sink(['date', 'id'])
+        sink.close()
+        self.assertEqual(CSVSink.read_fieldnames(self.path, 'zstd'), ['date', 'id'])
+
+
+class SQLiteSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = SQLiteSink
+
+    def test_compression_not_supported(self):
+        with self.assertRaises(SinkException):
+            SQLiteSink(self.path, ['date'], compression='gzip')
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_date_and_id_indexes(self):
+        self.sink_class(self.path, ['date', 'id', 'amount']).close()
+
+        with sqlite3.connect(self.path) as connection:
+            indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+        self.assertEqual(self.path, os.path.join(self.temp_dir.name, 'test.sqlite'))
+        self.assertEqual(indexes, {'rows_date', 'rows_id'})
+
+
+@skipUnless(HAS_PYARROW, 'pyarrow is not installed.')
+class ParquetSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = ParquetSink
+
+    def test_each_run_adds_a_part(self):
+        for run in range(2):
+            sink = self.sink_class(self.path, ['date'])
+            sink.write_rows([{'date': '2020-01-01'}])
+            sink.close()
+
+        self.assertEqual(len(ParquetSink.get_part_paths(self.path)), 2)
+
+
+class PartitionedSinkTestCase(SinkTestMixin, TestCase):
+    sink_class = PartitionedSink
+
+    def read_manifest(self):
+        with open(os.path.join(self.path, 'manifest.json')) as manifest_file:
+            return json.load(manifest_file)
+
+    def test_rows_are_split_by_month(self):
+        """Rows go to a file per month and the manifest records row counts and date ranges."""
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([
+            {'date': '2026-09-30', 'id': 'a'},
+            {'date': '2026-10-01', 'id': 'b'},
+            {'date': '2026-10-15', 'id': 'c'},
+            {'date': None, 'id': 'd'},
+        ])
+        sink.close()
+
+        with open(os.path.join(self.path, '2026', '10.csv')) as partition_file:
+            self.assertEqual(partition_file.read(), 'date,id\n2026-10-01,b\n2026-10-15,c\n')
+
+        self.assertEqual(self.read_manifest(), {
+            'fieldnames': ['date', 'id'],
+            'period': 'month',
+            'partitions': [
+                {'path': '2026/09.csv', 'rows': 1, 'min_date': '2026-09-30', 'max_date': '2026-09-30'},
+                {'path': '2026/10.csv', 'rows': 2, 'min_date': '2026-10-01', 'max_date': '2026-10-15'},
+                {'path': 'undated.csv', 'rows': 1, 'min_date': None, 'max_date': None},
+            ],
+        })
+
+    def test_append_only_touches_current_partition(self):
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2026-09-30', 'id': 'a'}, {'date': '2026-10-01', 'id': 'b'}])
+        sink.close()
+        september_path = os.path.join(self.path, '2026', '09.csv')
+        os.utime(september_path, ns=(0, 0))
+
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2026-10-02', 'id': 'c'}])
+        sink.close()
+
+        self.assertEqual(os.stat(september_path).st_mtime_ns, 0)
+        self.assertEqual(
+            [(entry['path'], entry['rows'], entry['max_date']) for entry in self.read_manifest()['partitions']],
+            [('2026/09.csv', 1, '2026-09-30'), ('2026/10.csv', 2, '2026-10-02')])
+
+    def test_partitions_of_interrupted_sync_are_listed(self):
+        """Partitions created by a sync that never closed its sink are still read."""
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2026-09-30', 'id': 'a'}])
+        sink.close()
+
+        sink = self.open_sink(['date', 'id'])
+        sink.write_rows([{'date': '2026-10-01', 'id': 'b'}, {'date': None, 'id': 'c'}])
+        # The rows reach their files, but the sink is never closed.
+        for partition in sink._partitions.values():
+            partition.close()
+
+        self.assertEqual(
+            [partition['path'] for partition in self.read_manifest()['partitions']],
+            ['2026/09.csv', '2026/10.csv', 'undated.csv'])
+        sink = self.open_sink(['date', 'id'])
+        self.assertEqual([row['id'] for row in sink.read_rows()], ['a', 'b', 'c'])
+        sink.close()
+
+    def test_year_period_with_gzip_partitions(self):
+        sink = PartitionedSink(self.path, ['date', 'id'], compression='gzip', period='year')
+        sink.write_rows([{'date': '2025-12-31', 'id': 'a'}, {'date': '2026-01-01', 'id': 'b'}])
+        sink.close()
+
+        self.assertEqual([entry['path'] for entry in self.read_manifest()['partitions']], ['2025.csv.gz', '2026.csv.gz'])
+        with gzip.open(os.path.join(self.path, '2026.csv.gz'), 'rt') as partition_file:
+            self.assertEqual(partition_file.read(), 'date,id\n2026-01-01,b\n')
+
+
+class GetSinkClassTestCase(TestCase):
+
+    def test_unknown_format(self):
+        self.assertIs(get_sink_class('sqlite'), SQLiteSink)
+        with self.assertRaises(SinkException):
+            get_sink_class('xlsx')
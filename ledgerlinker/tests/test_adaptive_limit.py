@@ -0,0 +1,140 @@
+from unittest import TestCase
+import asyncio
+from ledgerlinker.adaptive_limit import AdaptiveLimit, AdaptiveLimiter
+
+
+def run_saturated(limit : AdaptiveLimit, responses : int, seconds : float = 0.1, status_code : int = 200):
+    """Complete `responses` requests, each while every slot of the limit is in use."""
+    async def run():
+        tickets = []
+        for _ in range(responses):
+            while limit.in_flight < limit.limit:
+                tickets.append(await limit.acquire())
+            limit.release(tickets.pop(0), seconds, status_code)
+        for ticket in tickets:
+            limit.release(ticket, None)
+
+    asyncio.run(run())
+
+
+class AdaptiveLimitTestCase(TestCase):
+
+    def test_grows_by_about_one_per_saturated_round(self):
+        limit = AdaptiveLimit(initial_limit=4, max_limit=6)
+
+        run_saturated(limit, 5)
+        self.assertEqual(limit.limit, 5)
+        run_saturated(limit, 6)
+        self.assertEqual(limit.limit, 6)
+        run_saturated(limit, 20)
+        self.assertEqual(limit.limit, 6)
+
+    def test_does_not_grow_when_unsaturated(self):
+        limit = AdaptiveLimit(initial_limit=4)
+
+        for _ in range(10):
+            ticket = asyncio.run(limit.acquire())
+            limit.release(ticket, 0.1, 200)
+        self.assertEqual(limit.limit, 4)
+
+    def test_throttling_cuts_once_per_round(self):
+        limit = AdaptiveLimit(initial_limit=8)
+
+        # Every request in flight when the limit was cut is throttled too.
+        run_saturated(limit, 8, status_code=429)
+        self.assertEqual(limit.limit, 4)
+
+        # Requests sent under the new limit may cut it again.
+        run_saturated(limit, 1, status_code=503)
+        self.assertEqual(limit.limit, 2)
+
+    def test_errors_cut_down_to_min_limit(self):
+        limit = AdaptiveLimit(initial_limit=2, min_limit=1)
+
+        for _ in range(3):
+            ticket = asyncio.run(limit.acquire())
+            limit.release(ticket, 1.0, error=ConnectionError())
+        self.assertEqual(limit.limit, 1)
+
+    def test_latency_spike_cuts_limit(self):
+        limit = AdaptiveLimit(initial_limit=8, max_limit=8, latency_tolerance=2.0)
+        run_saturated(limit, 10, seconds=0.1)
+        self.assertEqual(limit.limit, 8)
+
+        run_saturated(limit, 1, seconds=2.0)
+        self.assertEqual(limit.limit, 4)
+
+    def test_observed_request_keeps_its_slot(self):
+        """The limit adapts once the headers arrive, while the slot is held until the body was read."""
+        limit = AdaptiveLimit(initial_limit=1, max_limit=2)
+
+        async def run():
+            ticket = await limit.acquire()
+            limit.observe(ticket, 0.1, 200)
+            self.assertEqual((limit.limit, limit.in_flight), (2, 1))
+            second = await limit.acquire()
+            third = asyncio.ensure_future(limit.acquire())
+            await asyncio.sleep(0)
+            self.assertFalse(third.done())
+
+            limit.free()
+            await asyncio.wait_for(third, 1)
+            limit.release(second, None)
+            limit.release(await third, None)
+
+        asyncio.run(run())
+        self.assertEqual(limit.in_flight, 0)
+
+    def test_abandoned_requests_leave_limit(self):
+        limit = AdaptiveLimit(initial_limit=1)
+
+        ticket = asyncio.run(limit.acquire())
+        limit.release(ticket, None)
+        self.assertEqual(limit.limit, 1)
+        self.assertEqual(limit.in_flight, 0)
+        self.assertIsNone(limit.long_term_latency)
+
+    def test_waits_for_free_slot(self):
+        limit = AdaptiveLimit(initial_limit=2)
+        order = []
+
+        async def request(name, seconds):
+            ticket = await limit.acquire()
+            order.append(f'{name} start')
+            await asyncio.sleep(seconds)
+            order.append(f'{name} end')
+            limit.release(ticket, seconds, 200)
+
+        async def run():
+            await asyncio.gather(request('a', 0.02), request('b', 0.05), request('c', 0))
+
+        asyncio.run(run())
+        self.assertEqual(order, ['a start', 'b start', 'a end', 'c start', 'c end', 'b end'])
+
+    def test_reports_changes(self):
+        changes = []
+        limit = AdaptiveLimit(initial_limit=2, on_change=changes.append)
+
+        run_saturated(limit, 2)
+        self.assertEqual(changes, [])
+        run_saturated(limit, 1)
+        self.assertEqual(changes, [3])
+
+        run_saturated(limit, 1, status_code=429)
+        run_saturated(limit, 1)
+        self.assertEqual(changes, [3, 1, 2])
+
+
+class AdaptiveLimiterTestCase(TestCase):
+
+    def test_limit_per_host(self):
+        changes = []
+        limiter = AdaptiveLimiter(initial_limit=3, on_change=lambda host, limit: changes.append((host, limit)))
+
+        limit = limiter.get_limit('APP.ledgerlinker.com')
+        self.assertIs(limit, limiter.get_limit('app.ledgerlinker.com'))
+        self.assertIsNot(limit, limiter.get_limit('my.adp.com'))
+
+        run_saturated(limit, 1, status_code=429)
+        self.assertEqual(limiter.get_limits(), {'app.ledgerlinker.com': 1, 'my.adp.com': 3})
+        self.assertEqual(changes, [('app.ledgerlinker.com', 3), ('my.adp.com', 3), ('app.ledgerlinker.com', 1)])
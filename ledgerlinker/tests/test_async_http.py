@@ -0,0 +1,190 @@
+import asyncio
+import json
+import socket
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from ledgerlinker.adaptive_limit import AdaptiveLimiter
+from ledgerlinker.async_http import AsyncHTTPClient, load_aiohttp
+from ledgerlinker import transport
+from ledgerlinker.transport import HostLimiter, RetryPolicy
+
+BODY = json.dumps({'transactions': list(range(5000))}).encode('utf-8')
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Requests per path. Paths starting with /flaky fail twice before succeeding.
+    requests = Counter()
+
+    def do_GET(self):
+        self.requests[self.path] += 1
+        if self.path.startswith('/flaky') and self.requests[self.path] <= 2:
+            self.send_response(429 if self.requests[self.path] == 1 else 503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200 if self.path.startswith(('/body', '/flaky')) else 404)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.send_header('X-Path', self.path)
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncHTTPClientTestMixin:
+    aiohttp = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def run_with_client(self, coroutine_function, **client_options):
+        async def run():
+            async with AsyncHTTPClient(pool_size=4, **client_options) as http_client:
+                return await coroutine_function(http_client)
+
+        with patch('ledgerlinker.async_http.load_aiohttp', return_value=self.aiohttp):
+            return asyncio.run(run())
+
+    def test_concurrent_json_requests(self):
+        async def fetch_page(http_client, page):
+            response = await http_client.get(f'{self.base_url}/body', params={'page': page})
+            return response.status_code, response.headers['X-Path'], await response.json()
+
+        async def fetch(http_client):
+            return await asyncio.gather(*(fetch_page(http_client, page) for page in range(8)))
+
+        results = self.run_with_client(fetch)
+
+        self.assertEqual([path for _, path, _ in results], [f'/body?page={page}' for page in range(8)])
+        self.assertTrue(all(status == 200 and len(data['transactions']) == 5000 for status, _, data in results))
+
+    def test_iter_content_on_worker_thread(self):
+        """A body is streamed into blocking code running off the event loop."""
+        async def fetch(http_client):
+            response = await http_client.get(f'{self.base_url}/body')
+            chunks = response.iter_content(chunk_size=1024)
+            body = await asyncio.get_running_loop().run_in_executor(None, b''.join, chunks)
+            response.close()
+            return body
+
+        self.assertEqual(self.run_with_client(fetch), BODY)
+
+    def test_aiter_content_and_error_status(self):
+        async def fetch(http_client):
+            response = await http_client.get(f'{self.base_url}/missing')
+            return response.status_code, b''.join([chunk async for chunk in response.aiter_content()])
+
+        self.assertEqual(self.run_with_client(fetch), (404, BODY))
+
+
+    def test_retries_transient_responses(self):
+        """429 and 503 responses are retried and every attempt is reported to the hooks."""
+        events = []
+        path = f'/flaky/{self.__class__.__name__}'
+
+        async def fetch(http_client):
+            response = await http_client.get(self.base_url + path)
+            return response.status_code, response.retries, await response.read()
+
+        self.assertEqual(self.run_with_client(fetch, hooks=[events.append]), (200, 2, BODY))
+        self.assertEqual([(event.attempt, event.status_code) for event in events], [(0, 429), (1, 503), (2, 200)])
+        self.assertEqual(events[0].host, '127.0.0.1')
+
+    def test_throttling_cuts_host_limit(self):
+        """The host's limit is halved by each throttled attempt and grows again while saturated."""
+        changes = []
+        limiter = AdaptiveLimiter(initial_limit=4, on_change=lambda host, limit: changes.append((host, limit)))
+        path = f'/flaky/limit/{self.__class__.__name__}'
+
+        async def fetch(http_client):
+            response = await http_client.get(self.base_url + path)
+            response.close()
+            return response.status_code
+
+        self.assertEqual(self.run_with_client(fetch, limiter=limiter), 200)
+        self.assertEqual([limit for _, limit in changes], [4, 2, 1, 2])
+        self.assertEqual(limiter.get_limits(), {'127.0.0.1': 2})
+
+    def test_response_holds_host_slot_until_read(self):
+        """The host limit covers reading the body, so a download waits for the one before it."""
+        limiter = AdaptiveLimiter(initial_limit=1, max_limit=1)
+
+        async def fetch(http_client):
+            first = await http_client.get(f'{self.base_url}/body/first')
+            second = asyncio.ensure_future(http_client.get(f'{self.base_url}/body/second'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+
+            first_body = await first.read()
+            second_body = await (await asyncio.wait_for(second, 5)).read()
+            return first_body, second_body, limiter.get_limit('127.0.0.1').in_flight
+
+        self.assertEqual(self.run_with_client(fetch, limiter=limiter), (BODY, BODY, 0))
+
+    def test_retries_run_out(self):
+        path = f'/flaky/out/{self.__class__.__name__}'
+
+        async def fetch(http_client):
+            response = await http_client.get(self.base_url + path, retry=RetryPolicy(max_retries=1, backoff=0))
+            response.close()
+            return response.status_code, response.retries
+
+        self.assertEqual(self.run_with_client(fetch), (503, 1))
+
+    def test_connection_errors_are_retried_then_raised(self):
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            url = f'http://127.0.0.1:{unused.getsockname()[1]}/'
+        events = []
+
+        async def fetch(http_client):
+            await http_client.get(url)
+
+        with self.assertRaises(Exception):
+            self.run_with_client(fetch, hooks=[events.append], retry=RetryPolicy(max_retries=2, backoff=0))
+        self.assertEqual([(event.attempt, event.status_code) for event in events], [(0, None), (1, None), (2, None)])
+        self.assertIsNotNone(events[-1].error)
+
+
+class RequestsBackendTestCase(AsyncHTTPClientTestMixin, TestCase):
+    aiohttp = None
+
+
+@skipUnless(load_aiohttp(), 'aiohttp is not installed')
+class AiohttpBackendTestCase(AsyncHTTPClientTestMixin, TestCase):
+    aiohttp = load_aiohttp()
+
+    def test_waiting_for_host_slot_leaves_worker_threads_free(self):
+        """A request waiting for a slot of the host limiter doesn't hold the thread reading the slot's body."""
+        async def fetch(http_client):
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+            first = await http_client.get(f'{self.base_url}/body/first')
+            second = asyncio.ensure_future(http_client.get(f'{self.base_url}/body/second'))
+            await asyncio.sleep(0.05)
+            self.assertFalse(second.done())
+
+            first_body = await loop.run_in_executor(None, b''.join, first.iter_content())
+            second_body = await (await asyncio.wait_for(second, 5)).read()
+            return first_body, second_body
+
+        transport.set_host_limiter(HostLimiter(host_limits={'127.0.0.1': 1}))
+        try:
+            self.assertEqual(self.run_with_client(fetch), (BODY, BODY))
+        finally:
+            transport.set_host_limiter(None)
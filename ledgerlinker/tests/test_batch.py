@@ -0,0 +1,109 @@
+import json
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from ledgerlinker.batch import BatchException, BatchRunner, find_config_files, parse_host_limits, sync_config
+from ledgerlinker.tests.test_client import FakeProvider
+
+
+class BatchTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.config_dir = os.path.join(self.temp_dir.name, 'configs')
+        os.makedirs(self.config_dir)
+
+    def write_config(self, name, config):
+        path = os.path.join(self.config_dir, name)
+        with open(path, 'w') as config_file:
+            json.dump(config, config_file)
+        return path
+
+    def test_find_config_files(self):
+        second = self.write_config('b.json', {})
+        first = self.write_config('a.json', {})
+        self.write_config('notes.txt', {})
+        self.write_config('.hidden.json', {})
+        extra = os.path.join(self.temp_dir.name, 'extra.json')
+
+        self.assertEqual(find_config_files([self.config_dir, extra]), [first, second, extra])
+
+    def test_sync_config_keeps_outputs_apart(self):
+        """Each config syncs with its own tracker in its own output dir."""
+        paths = []
+        for name in ('a', 'b'):
+            output_dir = os.path.join(self.temp_dir.name, name)
+            paths.append(self.write_config(f'{name}.json', {
+                'output_dir': output_dir,
+                'providers': [{'name': 'fake', 'provider': 'fake'}],
+            }))
+
+        with patch('ledgerlinker.client.get_providers', side_effect=lambda configs: {'fake': FakeProvider(rows=2)}):
+            results = [sync_config(path) for path in paths]
+
+        self.assertEqual([(result.succeeded, result.rows_written) for result in results], [(True, 2), (True, 2)])
+        self.assertTrue(os.path.isdir(os.path.join(self.temp_dir.name, 'a')))
+        self.assertTrue(os.path.isdir(os.path.join(self.temp_dir.name, 'b')))
+
+    def test_relative_output_dir_is_relative_to_config(self):
+        path = self.write_config('a.json', {'output_dir': 'a', 'providers': [{'name': 'fake', 'provider': 'fake'}]})
+
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        try:
+            with patch('ledgerlinker.client.get_providers', side_effect=lambda configs: {'fake': FakeProvider(rows=2)}):
+                result = sync_config(path)
+        finally:
+            os.chdir(cwd)
+
+        self.assertTrue(result.succeeded)
+        self.assertTrue(os.path.isdir(os.path.join(self.config_dir, 'a')))
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir.name, 'a')))
+
+    def test_configs_sharing_an_output_dir_are_refused(self):
+        shared = self.write_config('a.json', {'output_dir': '../out', 'providers': []})
+        other = self.write_config('b.json', {'output_dir': 'b', 'providers': []})
+        broken = self.write_config('broken.json', {'providers': []})
+        BatchRunner([shared, other, broken])
+
+        for config in (
+            {'output_dir': os.path.join(self.temp_dir.name, 'out'), 'providers': []},
+            {'output_dir': 'c', 'providers': [{'name': 'fake', 'provider': 'fake', 'output_dir': '../out'}]},
+        ):
+            duplicate = self.write_config('duplicate.json', config)
+            with self.assertRaises(BatchException):
+                BatchRunner([shared, other, duplicate])
+
+    def test_sync_config_reports_failures(self):
+        invalid = sync_config(self.write_config('invalid.json', {'providers': []}))
+        self.assertFalse(invalid.succeeded)
+        self.assertEqual(invalid.error, 'No output_dir found in config file.')
+
+        path = self.write_config('failing.json', {
+            'output_dir': self.temp_dir.name,
+            'providers': [{'name': 'fake', 'provider': 'fake'}],
+        })
+        with patch('ledgerlinker.client.get_providers', return_value={'fake': FakeProvider(error=ValueError('boom'))}):
+            failing = sync_config(path)
+        self.assertIsNone(failing.error)
+        self.assertEqual([result.error for result in failing.provider_results], ['boom'])
+
+    def test_failing_config_does_not_stop_others(self):
+        """Configs run on worker processes; a broken config is reported alongside the rest."""
+        broken = self.write_config('broken.json', {'providers': []})
+        empty = self.write_config('empty.json', {'output_dir': self.temp_dir.name, 'providers': []})
+
+        runner = BatchRunner([broken, empty], processes=2, max_requests_per_host=4)
+        with patch('builtins.print'):
+            results = runner.run()
+
+        self.assertEqual(
+            sorted((os.path.basename(result.config_path), result.succeeded) for result in results),
+            [('broken.json', False), ('empty.json', True)])
+
+    def test_parse_host_limits(self):
+        self.assertEqual(parse_host_limits(['app.ledgerlinker.com=8', 'adp.com=2']), {'app.ledgerlinker.com': 8, 'adp.com': 2})
+        for value in ('app.ledgerlinker.com', 'app.ledgerlinker.com=0', 'app.ledgerlinker.com=x'):
+            with self.assertRaises(ValueError):
+                parse_host_limits([value])
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from tempfile import TemporaryDirectory
+from ledgerlinker.client import LedgerLinkerClient
+from ledgerlinker.providers.base import AsyncProvider, ProviderConfig
+
+
+class FakeProvider:
+
+    def __init__(self, rows=0, error=None):
+        self.rows = rows
+        self.error = error
+        self.rows_written = 0
+        self.close = Mock()
+        self.set_metrics = Mock()
+
+    def sync(self, update_tracker):
+        if self.error:
+            raise self.error
+        self.rows_written += self.rows
+
+
+class FakeAsyncProvider(AsyncProvider):
+
+    def __init__(self, rows=0):
+        super().__init__(ProviderConfig(name='async', output_dir='.'))
+        self.rows = rows
+        self.http_clients = []
+        self.threads = []
+
+    async def sync_async(self, update_tracker):
+        self.http_clients.append(self.http_client)
+        self.threads.append(threading.get_ident())
+        # Yield to the loop so concurrently synced providers interleave.
+        await asyncio.sleep(0)
+        self._count_rows(self.rows)
+
+
+class ThrottledAsyncProvider(FakeAsyncProvider):
+    """Every sync is throttled once by the service."""
+
+    def __init__(self):
+        super().__init__()
+        self.limits = []
+
+    async def sync_async(self, update_tracker):
+        await super().sync_async(update_tracker)
+        limit = self.http_client.limiter.get_limit('app.ledgerlinker.com')
+        self.limits.append(limit.limit)
+        limit.release(await limit.acquire(), 0.1, 429)
+
+
+class ParsingAsyncProvider(AsyncProvider):
+    """Parses a response body in a blocking stage, as the export providers do."""
+
+    def __init__(self):
+        super().__init__(ProviderConfig(name='parsing', output_dir='.'))
+        self.backends = []
+
+    async def sync_async(self, update_tracker):
+        from ledgerlinker.json_stream import iter_json_object
+
+        self.backends.append(self.http_client.backend)
+        body = [json.dumps({'transactions': [{'amount': index} for index in range(100)]}).encode('utf-8')]
+        transactions = await self.run_blocking(list, iter_json_object(body, stream_keys=('transactions',)))
+        self._count_rows(len(transactions))
+
+
+class LedgerLinkerClientTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.config_path = os.path.join(self.temp_dir.name, 'config.json')
+        with open(self.config_path, 'w') as config_file:
+            json.dump({
+                'output_dir': self.temp_dir.name,
+                'providers': [
+                    {'name': 'first', 'provider': 'fake'},
+                    {'name': 'second', 'provider': 'fake'},
+                ]
+            }, config_file)
+
+    def get_client(self, providers):
+        with patch('ledgerlinker.client.get_providers', return_value=providers):
+            return LedgerLinkerClient(self.config_path)
+
+    def test_sync_parallel_reports_rows(self):
+        """Sync providers on a worker pool and report rows written per provider."""
+        client = self.get_client({
+            'first': FakeProvider(rows=3),
+            'second': FakeProvider(rows=5),
+        })
+
+        results = client.sync(jobs=2)
+
+        self.assertEqual(
+            [(result.provider_name, result.rows_written, result.succeeded) for result in results],
+            [('first', 3, True), ('second', 5, True)])
+
+    def test_sync_failure_does_not_stop_other_providers(self):
+        """A failing provider is reported without preventing the others from syncing."""
+        failing = FakeProvider(error=Exception('boom'))
+        working = FakeProvider(rows=2)
+        client = self.get_client({'first': failing, 'second': working})
+
+        results = client.sync(jobs=2)
+
+        self.assertFalse(results[0].succeeded)
+        self.assertEqual(str(results[0].error), 'boom')
+        self.assertTrue(results[1].succeeded)
+        self.assertEqual(results[1].rows_written, 2)
+        failing.close.assert_called_once_with()
+        working.close.assert_called_once_with()
+
+    def test_sync_desired_providers(self):
+        """Only the requested providers are synced."""
+        client = self.get_client({
+            'first': FakeProvider(rows=3),
+            'second': FakeProvider(rows=5),
+        })
+
+        results = client.sync(desired_providers=['second'])
+
+        self.assertEqual([result.provider_name for result in results], ['second'])
+
+    def test_sync_writes_metrics_file(self):
+        """Per provider sync metrics are written to the metrics file after a sync."""
+        metrics_path = os.path.join(self.temp_dir.name, 'ledgerlinker.prom')
+        client = self.get_client({
+            'first': FakeProvider(rows=3),
+            'second': FakeProvider(error=Exception('boom')),
+        })
+        client.metrics_file = metrics_path
+
+        client.sync()
+
+        with open(metrics_path) as metrics_file:
+            content = metrics_file.read()
+        self.assertIn('ledgerlinker_provider_syncs_total{provider="first"} 1', content)
+        self.assertIn('ledgerlinker_provider_sync_failures_total{provider="second"} 1', content)
+        self.assertIsNotNone(client.metrics.get_gauge('provider_last_success_timestamp_seconds', provider='first'))
+        self.assertIsNone(client.metrics.get_gauge('provider_last_success_timestamp_seconds', provider='second'))
+
+    def test_sync_with_profile_dir(self):
+        """Each synced provider gets its own profile files."""
+        profile_dir = os.path.join(self.temp_dir.name, '.profile', 'run')
+        client = self.get_client({
+            'first': FakeProvider(rows=3),
+            'second': FakeProvider(rows=5),
+        })
+
+        results = client.sync(jobs=2, profile_dir=profile_dir)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertIn('first.pstats', os.listdir(profile_dir))
+        self.assertIn('second.collapsed', os.listdir(profile_dir))
+
+    def test_profile_includes_blocking_stages_of_async_providers(self):
+        """The parsing done by an async provider's blocking stages shows up in its profile."""
+        profile_dir = os.path.join(self.temp_dir.name, '.profile', 'run')
+        provider = ParsingAsyncProvider()
+        client = self.get_client({'parsing': provider})
+
+        results = client.sync(profile_dir=profile_dir)
+
+        self.assertEqual(results[0].rows_written, 100)
+        self.assertEqual(provider.backends, ['requests'])
+        with open(os.path.join(profile_dir, 'parsing.txt')) as stats_file:
+            self.assertIn('iter_json_object', stats_file.read())
+
+    def test_async_providers_share_loop_and_http_client(self):
+        """Async providers are awaited on the calling thread with one HTTP client; others run on workers."""
+        first, second = FakeAsyncProvider(rows=3), FakeAsyncProvider(rows=5)
+        client = self.get_client({'first': first, 'second': second, 'blocking': FakeProvider(rows=1)})
+
+        results = client.sync(jobs=3)
+
+        self.assertEqual([result.rows_written for result in results], [3, 5, 1])
+        self.assertIsNotNone(first.http_clients[0])
+        self.assertIs(first.http_clients[0], second.http_clients[0])
+        self.assertEqual(first.threads + second.threads, [threading.get_ident()] * 2)
+        self.assertIsNone(first.http_client)
+
+    def test_syncs_share_http_client_and_host_limits(self):
+        """Limits learned in one sync carry over to the next until the http options change."""
+        provider = ThrottledAsyncProvider()
+        client = self.get_client({'first': provider})
+
+        client.sync()
+        client.sync()
+        self.assertEqual(provider.limits, [4, 2])
+        self.assertIs(provider.http_clients[0], provider.http_clients[1])
+
+        client.config.config['http_max_concurrency'] = 8
+        client.sync()
+        self.assertEqual(provider.limits, [4, 2, 4])
+        client.close()
+
+    def test_record_request_event(self):
+        from ledgerlinker.transport import RequestEvent
+
+        client = self.get_client({})
+        client.record_request_event(RequestEvent('https://app.ledgerlinker.com/api/exports/', 0.25, 0, 503))
+        client.record_request_event(RequestEvent('https://app.ledgerlinker.com/api/exports/', 0.5, 1, error=OSError()))
+
+        self.assertEqual(client.metrics.get_counter('http_attempts', host='app.ledgerlinker.com', status='503'), 1)
+        self.assertEqual(client.metrics.get_counter('http_attempts', host='app.ledgerlinker.com', status='error'), 1)
+        self.assertEqual(client.metrics.get_timing('http_attempt_seconds', host='app.ledgerlinker.com'), (2, 0.75, 0.5))
+
+    def test_record_concurrency_limit(self):
+        client = self.get_client({})
+        client.record_concurrency_limit('app.ledgerlinker.com', 8)
+        client.record_concurrency_limit('app.ledgerlinker.com', 4)
+
+        self.assertEqual(client.metrics.get_gauge('http_concurrency_limit', host='app.ledgerlinker.com'), 4)
@@ -0,0 +1,113 @@
+import json
+import os
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from tempfile import TemporaryDirectory
+from ledgerlinker.client import LedgerLinkerClient
+from ledgerlinker.daemon import SyncDaemon
+from ledgerlinker.metrics import MetricsRecorder
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SyncDaemonTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.config_path = os.path.join(self.temp_dir.name, 'config.json')
+        self.write_config([
+            {'name': 'fast', 'provider': 'fake', 'sync_interval': 60},
+            {'name': 'slow', 'provider': 'fake'},
+        ])
+
+        self.created_providers = []
+        patcher = patch('ledgerlinker.client.get_providers', side_effect=self.get_providers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.clock = FakeClock()
+        self.daemon = SyncDaemon(self.config_path, clock=self.clock)
+        self.daemon.client.sync = Mock()
+
+    def write_config(self, providers, mtime=None):
+        with open(self.config_path, 'w') as config_file:
+            json.dump({
+                'output_dir': self.temp_dir.name,
+                'sync_interval': 600,
+                'providers': providers,
+            }, config_file)
+        if mtime is not None:
+            os.utime(self.config_path, (mtime, mtime))
+
+    def get_providers(self, provider_configs):
+        providers = {}
+        for name, config in provider_configs.items():
+            providers[name] = Mock(config=config)
+            self.created_providers.append(name)
+        return providers
+
+    def test_providers_run_on_their_own_interval(self):
+        self.assertEqual(self.daemon.run_once(), ['fast', 'slow'])
+        self.daemon.client.sync.assert_called_once_with(desired_providers=['fast', 'slow'], jobs=1)
+
+        self.clock.now += 30
+        self.assertEqual(self.daemon.run_once(), [])
+        self.assertEqual(self.daemon.seconds_until_next_run(), 30)
+
+        self.clock.now += 30
+        self.assertEqual(self.daemon.run_once(), ['fast'])
+
+        self.clock.now += 540
+        self.assertEqual(self.daemon.run_once(), ['fast', 'slow'])
+
+    def test_jitter_delays_next_run(self):
+        self.daemon.client.config.config['sync_jitter'] = 10
+        with patch('ledgerlinker.daemon.random.uniform', return_value=7) as uniform:
+            self.daemon.run_once()
+
+        uniform.assert_called_with(0, 10)
+        self.assertEqual(self.daemon.seconds_until_next_run(), 60)
+        self.clock.now += 66
+        self.assertEqual(self.daemon.get_due_providers(), [])
+        self.clock.now += 1
+        self.assertEqual(self.daemon.get_due_providers(), ['fast'])
+
+    def test_reload_keeps_unchanged_providers(self):
+        """Changing the config only recreates the providers whose config changed."""
+        fast_provider = self.daemon.client.providers['fast']
+        self.daemon.run_once()
+
+        self.write_config([
+            {'name': 'fast', 'provider': 'fake', 'sync_interval': 60},
+            {'name': 'new', 'provider': 'fake'},
+        ], mtime=os.path.getmtime(self.config_path) + 10)
+
+        self.assertTrue(self.daemon.reload_config_if_changed())
+        self.assertFalse(self.daemon.reload_config_if_changed())
+        self.assertIs(self.daemon.client.providers['fast'], fast_provider)
+        self.assertEqual(self.created_providers, ['fast', 'slow', 'new'])
+        self.assertEqual(self.daemon.get_due_providers(), ['new'])
+
+    def test_metrics_recorder_is_shared_with_client(self):
+        metrics = MetricsRecorder()
+        daemon = SyncDaemon(self.config_path, clock=self.clock, metrics_file='sync.prom', metrics=metrics)
+
+        self.assertIs(daemon.metrics, metrics)
+        self.assertIs(daemon.client.metrics, metrics)
+        self.assertEqual(daemon.client.metrics_file, 'sync.prom')
+        self.assertIs(self.daemon.metrics, self.daemon.client.metrics)
+
+    def test_broken_config_keeps_previous(self):
+        with open(self.config_path, 'w') as config_file:
+            config_file.write('{"providers": []}')
+        os.utime(self.config_path, (1, 1))
+
+        self.assertFalse(self.daemon.reload_config_if_changed())
+        self.assertEqual(sorted(self.daemon.client.providers), ['fast', 'slow'])
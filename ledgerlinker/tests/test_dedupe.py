@@ -0,0 +1,37 @@
+import os
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from ledgerlinker.dedupe import DedupeIndex
+
+
+class DedupeIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.index_path = os.path.join(self.temp_dir.name, 'index.sqlite')
+
+    def test_row_hash_matches_csv_rendering(self):
+        """A downloaded row and the same row read back from CSV share a key."""
+        index = DedupeIndex(self.index_path, ['date', 'amount', 'memo'])
+        self.assertTrue(index.add({'date': '2020-01-01', 'amount': 1.5, 'memo': None}))
+        self.assertIn({'date': '2020-01-01', 'amount': '1.5', 'memo': ''}, index)
+        self.assertNotIn({'date': '2020-01-01', 'amount': '1.5', 'memo': 'x'}, index)
+
+    def test_filter_new_persists(self):
+        index = DedupeIndex(self.index_path, ['id', 'amount'], key_fields=['id'])
+        rows = [{'id': 'a', 'amount': 1}, {'id': 'a', 'amount': 2}, {'id': 'b', 'amount': 3}]
+        self.assertEqual(list(index.filter_new(rows)), [rows[0], rows[2]])
+        index.close()
+
+        reopened = DedupeIndex(self.index_path, ['id', 'amount'], key_fields=['id'])
+        self.assertEqual(list(reopened.filter_new([{'id': 'b'}, {'id': 'c'}])), [{'id': 'c'}])
+
+    def test_build_from_csv(self):
+        csv_path = os.path.join(self.temp_dir.name, 'output.csv')
+        with open(csv_path, 'w') as csv_file:
+            csv_file.write('id,amount\na,1\nb,2\n')
+
+        index = DedupeIndex(self.index_path, ['id', 'amount'])
+        self.assertTrue(index.is_empty())
+        self.assertEqual(index.build_from_csv(csv_path), 2)
+        self.assertIn({'id': 'b', 'amount': 2}, index)
@@ -0,0 +1,52 @@
+import json
+from unittest import TestCase
+from ledgerlinker.json_stream import iter_json_object, JSONStreamError
+
+
+def chunked(text, chunk_size):
+    body = text.encode('utf-8')
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+
+class IterJSONObjectTestCase(TestCase):
+
+    PAYLOAD = {
+        'fieldnames': ['date', 'amount'],
+        'transactions': [
+            {'date': '2020-01-01', 'amount': 12345, 'payee': 'Café ☃'},
+            {'date': '2020-01-02', 'amount': -1.5e3, 'payee': None},
+        ],
+        'latest_transaction': '2020-01-02',
+    }
+
+    def test_streams_array_elements_for_every_chunk_size(self):
+        """Elements are yielded individually regardless of where chunk boundaries fall."""
+        text = json.dumps(self.PAYLOAD, indent=2)
+        expected = [
+            ('fieldnames', ['date', 'amount']),
+            ('transactions', self.PAYLOAD['transactions'][0]),
+            ('transactions', self.PAYLOAD['transactions'][1]),
+            ('latest_transaction', '2020-01-02'),
+        ]
+
+        for chunk_size in (1, 2, 3, 5, 64, 4096):
+            items = list(iter_json_object(chunked(text, chunk_size), stream_keys=('transactions',)))
+            self.assertEqual(items, expected, f'chunk size {chunk_size}')
+
+    def test_non_streamed_keys_are_materialized(self):
+        items = list(iter_json_object(chunked(json.dumps(self.PAYLOAD), 4)))
+        self.assertEqual(dict(items), self.PAYLOAD)
+
+    def test_empty_object_and_array(self):
+        self.assertEqual(list(iter_json_object(['{}'])), [])
+        self.assertEqual(
+            list(iter_json_object(['{"transactions": [ ]}'], stream_keys=('transactions',))),
+            [])
+
+    def test_truncated_stream(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_object(['{"transactions": [{"a": 1}'], stream_keys=('transactions',)))
+
+    def test_not_an_object(self):
+        with self.assertRaises(JSONStreamError):
+            list(iter_json_object(['[1, 2]']))
@@ -0,0 +1,58 @@
+import json
+import os
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from ledgerlinker.metrics import MetricsRecorder, MeteredChunks, TimedIterable
+
+
+class MetricsRecorderTestCase(TestCase):
+
+    def test_counters_and_timings_are_kept_per_label_set(self):
+        metrics = MetricsRecorder()
+        metrics.increment('rows_written', 3, provider='a', output='x')
+        metrics.increment('rows_written', 2, output='x', provider='a')
+        metrics.increment('rows_written', 1, provider='b', output='x')
+        metrics.observe('write_seconds', 0.5, provider='a')
+        metrics.observe('write_seconds', 1.5, provider='a')
+
+        self.assertEqual(metrics.get_counter('rows_written', provider='a', output='x'), 5)
+        self.assertEqual(metrics.get_counter('rows_written', provider='b', output='x'), 1)
+        self.assertEqual(metrics.get_timing('write_seconds', provider='a'), (2, 2.0, 1.5))
+        self.assertEqual(metrics.get_counter('rows_written', provider='c'), 0)
+
+    def test_to_prometheus(self):
+        metrics = MetricsRecorder()
+        metrics.increment('http_requests', provider='a', output='export "1"')
+        metrics.observe('http_request_seconds', 0.25, provider='a')
+        metrics.set_gauge('last_sync_timestamp_seconds', 100, provider='a')
+
+        lines = metrics.to_prometheus().splitlines()
+
+        self.assertIn('# TYPE ledgerlinker_http_requests_total counter', lines)
+        self.assertIn('ledgerlinker_http_requests_total{output="export \\"1\\"",provider="a"} 1', lines)
+        self.assertIn('# TYPE ledgerlinker_http_request_seconds summary', lines)
+        self.assertIn('ledgerlinker_http_request_seconds_sum{provider="a"} 0.25', lines)
+        self.assertIn('ledgerlinker_http_request_seconds_count{provider="a"} 1', lines)
+        self.assertIn('ledgerlinker_last_sync_timestamp_seconds{provider="a"} 100', lines)
+
+    def test_write_json(self):
+        metrics = MetricsRecorder()
+        metrics.increment('rows_written', 4, provider='a')
+
+        with TemporaryDirectory() as temp_dir:
+            metrics_path = os.path.join(temp_dir, 'metrics.json')
+            metrics.write(metrics_path)
+
+            with open(metrics_path) as metrics_file:
+                summary = json.load(metrics_file)
+
+        self.assertEqual(summary['counters'], [{'name': 'rows_written', 'labels': {'provider': 'a'}, 'value': 4}])
+
+    def test_metered_chunks(self):
+        chunks = MeteredChunks([b'abc', b'de'])
+        self.assertEqual(b''.join(chunks), b'abcde')
+        self.assertEqual(chunks.bytes, 5)
+        self.assertGreaterEqual(chunks.seconds, 0)
+
+        timed = TimedIterable(range(3))
+        self.assertEqual(list(timed), [0, 1, 2])
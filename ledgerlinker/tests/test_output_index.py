@@ -0,0 +1,128 @@
+import gzip
+import json
+import os
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from ledgerlinker.output_index import OutputIndex, OutputIndexException, get_index_path
+from ledgerlinker.sinks import CSVSink
+
+
+class OutputIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'test.csv')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_rows(self, rows, compression=None):
+        sink = CSVSink(self.path, ['date', 'id'], compression=compression)
+        sink.write_rows(rows)
+        sink.close()
+
+    def read_output(self):
+        with open(self.path) as output_file:
+            return output_file.read()
+
+    def test_close_writes_index(self):
+        self.write_rows([{'date': '2020-01-01', 'id': 'a'}, {'date': '2020-01-02', 'id': 'b'}])
+        self.write_rows([{'date': '2020-01-03', 'id': 'c'}])
+
+        with open(get_index_path(self.path)) as index_file:
+            data = json.load(index_file)
+        self.assertEqual(data['fieldnames'], ['date', 'id'])
+        self.assertEqual(data['row_count'], 3)
+        self.assertEqual(data['size'], os.path.getsize(self.path))
+        self.assertEqual(data['last_row'], {'date': '2020-01-03', 'id': 'c'})
+        self.assertTrue(OutputIndex.open(self.path).verify())
+
+    def test_open_reads_header_from_index(self):
+        """The header of an indexed file is not parsed again, however large the file is."""
+        self.write_rows([{'date': '2020-01-01', 'id': str(row)} for row in range(1000)])
+        with open(self.path, 'r+b') as output_file:
+            output_file.write(b'DATE,ID\n')
+
+        index = OutputIndex.open(self.path)
+        self.assertEqual(index.fieldnames, ['date', 'id'])
+        self.assertFalse(index.verify())
+
+    def test_torn_last_line_is_truncated(self):
+        self.write_rows([{'date': '2020-01-01', 'id': 'a'}])
+        with open(self.path, 'a') as output_file:
+            output_file.write('2020-01-02,b\n2020-01-0')
+
+        index = OutputIndex.open(self.path)
+
+        self.assertEqual(self.read_output(), 'date,id\n2020-01-01,a\n2020-01-02,b\n')
+        self.assertEqual(index.row_count, 2)
+        self.assertEqual(index.last_row, {'date': '2020-01-02', 'id': 'b'})
+        self.assertTrue(index.verify())
+
+    def test_changed_file_is_reindexed(self):
+        self.write_rows([{'date': '2020-01-01', 'id': 'a'}, {'date': '2020-01-02', 'id': 'b'}])
+        with open(self.path, 'w') as output_file:
+            output_file.write('date,id,amount\n2020-01-05,z,1\n')
+
+        index = OutputIndex.open(self.path)
+
+        self.assertEqual(index.fieldnames, ['date', 'id', 'amount'])
+        self.assertEqual(index.row_count, 1)
+
+    def test_unindexed_file_is_scanned_once(self):
+        with open(self.path, 'w') as output_file:
+            output_file.write('date,id\n2020-01-01,"a\nb"\n2020-01-02,c\n')
+
+        index = OutputIndex.open(self.path)
+
+        self.assertEqual(index.row_count, 2)
+        self.assertEqual(index.last_row, {'date': '2020-01-02', 'id': 'c'})
+        self.assertTrue(os.path.exists(get_index_path(self.path)))
+
+    def test_missing_final_newline_is_added(self):
+        """A complete last row without a newline, e.g. from an editor, is kept."""
+        with open(self.path, 'w') as output_file:
+            output_file.write('date,id\n2020-01-01,a\n2020-01-02,"b\nc"')
+
+        index = OutputIndex.open(self.path)
+
+        self.assertEqual(self.read_output(), 'date,id\n2020-01-01,a\n2020-01-02,"b\nc"\n')
+        self.assertEqual(index.row_count, 2)
+        self.assertEqual(index.last_row, {'date': '2020-01-02', 'id': 'b\nc'})
+        self.assertTrue(index.verify())
+
+        self.write_rows([{'date': '2020-01-03', 'id': 'd'}])
+        self.assertEqual(self.read_output(), 'date,id\n2020-01-01,a\n2020-01-02,"b\nc"\n2020-01-03,d\n')
+
+    def test_incomplete_last_row_of_unindexed_file_is_kept(self):
+        for torn_row in ('2020-01', '2020-01-02,"b\nc'):
+            content = f'date,id\n2020-01-01,a\n{torn_row}'
+            with open(self.path, 'w') as output_file:
+                output_file.write(content)
+
+            with self.assertRaises(OutputIndexException):
+                OutputIndex.open(self.path)
+            self.assertEqual(self.read_output(), content)
+
+    def test_torn_quoted_field_appended_by_interrupted_sync_is_truncated(self):
+        self.write_rows([{'date': '2020-01-01', 'id': 'a'}])
+        with open(self.path, 'a') as output_file:
+            output_file.write('2020-01-02,"b\nc"\n2020-01-03,"d\n')
+
+        index = OutputIndex.open(self.path)
+
+        self.assertEqual(self.read_output(), 'date,id\n2020-01-01,a\n2020-01-02,"b\nc"\n')
+        self.assertEqual(index.row_count, 2)
+        self.assertEqual(index.last_row, {'date': '2020-01-02', 'id': 'b\nc'})
+
+    def test_unfinished_gzip_member_is_dropped(self):
+        self.path += '.gz'
+        self.write_rows([{'date': '2020-01-01', 'id': 'a'}], compression='gzip')
+        with open(self.path, 'ab') as output_file:
+            output_file.write(gzip.compress(b'2020-01-02,b\n')[:-8])
+
+        self.write_rows([{'date': '2020-01-03', 'id': 'c'}], compression='gzip')
+
+        with gzip.open(self.path, 'rt') as output_file:
+            self.assertEqual(output_file.read(), 'date,id\n2020-01-01,a\n2020-01-03,c\n')
+        self.assertEqual(OutputIndex.open(self.path, 'gzip').row_count, 2)
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+import time
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from ledgerlinker.profiling import SyncProfiler, get_default_profile_dir
+
+
+def decode_rows(count):
+    rows = []
+    for index in range(count):
+        rows.append(json.loads(json.dumps({'index': index, 'description': 'x' * 50})))
+    time.sleep(0.05)
+    return rows
+
+
+class SyncProfilerTestCase(TestCase):
+
+    def test_profile_writes_reports(self):
+        with TemporaryDirectory() as temp_dir:
+            profile_dir = os.path.join(temp_dir, '.profile', 'run')
+            with SyncProfiler(profile_dir, sample_interval=0.001) as profiler:
+                with profiler.profile('bank'):
+                    rows = decode_rows(2000)
+
+            self.assertEqual(len(rows), 2000)
+            self.assertEqual(
+                sorted(os.listdir(profile_dir)),
+                ['bank.alloc.txt', 'bank.collapsed', 'bank.pstats', 'bank.txt'])
+
+            with open(os.path.join(profile_dir, 'bank.txt')) as stats_file:
+                self.assertIn('decode_rows', stats_file.read())
+
+            with open(os.path.join(profile_dir, 'bank.collapsed')) as collapsed_file:
+                lines = collapsed_file.read().splitlines()
+            self.assertTrue(lines)
+            stack, count = lines[0].rsplit(' ', 1)
+            self.assertIn('decode_rows (test_profiling.py:', stack)
+            self.assertGreater(int(count), 0)
+
+            with open(os.path.join(profile_dir, 'bank.alloc.txt')) as alloc_file:
+                self.assertIn('test_profiling.py', alloc_file.read())
+
+    def test_profiled_blocks_run_one_at_a_time(self):
+        """Concurrent blocks wait for each other rather than enabling two profilers at once."""
+        active = []
+        overlaps = []
+
+        def sync(profiler, name):
+            with profiler.profile(name):
+                overlaps.append(len(active))
+                active.append(name)
+                time.sleep(0.02)
+                active.remove(name)
+
+        with TemporaryDirectory() as temp_dir:
+            with SyncProfiler(temp_dir) as profiler:
+                threads = [threading.Thread(target=sync, args=(profiler, f'bank-{index}')) for index in range(3)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual(overlaps, [0, 0, 0])
+            self.assertIn('bank-2.pstats', os.listdir(temp_dir))
+
+    def test_get_default_profile_dir(self):
+        self.assertEqual(get_default_profile_dir('/out', 'run-1'), os.path.join('/out', '.profile', 'run-1'))
@@ -0,0 +1,117 @@
+import json
+import os
+from datetime import date
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from ledgerlinker.providers.base import ProviderConfig
+from ledgerlinker.providers.ledgerlinker_service import LedgerLinkerServiceProvider
+from ledgerlinker.rerender import STAGING_DIR_NAME, Rerenderer, replace_outputs
+
+
+def export_payload(*transactions):
+    return json.dumps({'fieldnames': ['date', 'categories'], 'transactions': list(transactions)}).encode('utf-8')
+
+
+class RerendererTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.output_dir = self.temp_dir.name
+        config = ProviderConfig(
+            name='bank', token='token', output_dir=self.output_dir, archive_responses=True, category_separator='/')
+        self.provider = LedgerLinkerServiceProvider(config)
+        self.archive = self.provider.response_archive
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def archive_response(self, slug, body, start_date=None):
+        archived = self.archive.archive_chunks('bank', slug, [body], start_date)
+        return archived.commit()
+
+    def write_output(self, file_name, content):
+        with open(os.path.join(self.output_dir, file_name), 'w') as output_file:
+            output_file.write(content)
+
+    def read_output(self, file_name):
+        with open(os.path.join(self.output_dir, file_name)) as output_file:
+            return output_file.read()
+
+    def test_rerender_replaces_outputs(self):
+        self.archive_response('checking', export_payload({'date': '2024-01-02', 'categories': ['Food', 'Out']}))
+        self.archive_response('checking', export_payload({'date': '2024-01-03', 'categories': ['Rent']}))
+        self.archive_response('savings', export_payload({'date': '2024-01-04', 'categories': ['Interest', 'Bank']}))
+        self.write_output('checking.csv', 'date,categories\n2024-01-02,Food:Out\n2024-01-03,Rent\n')
+        self.write_output('.checking.csv.dedupe.sqlite', 'stale')
+        self.write_output('other.csv', 'date\n')
+
+        with redirect_stdout(StringIO()):
+            results = Rerenderer({'bank': self.provider}, processes=2).run()
+
+        self.assertEqual(sorted((result.slug, result.rows_written, result.error) for result in results), [
+            ('checking', 2, None),
+            ('savings', 1, None),
+        ])
+        self.assertEqual(self.read_output('checking.csv'), 'date,categories\n2024-01-02,Food/Out\n2024-01-03,Rent\n')
+        self.assertEqual(self.read_output('savings.csv'), 'date,categories\n2024-01-04,Interest/Bank\n')
+        self.assertEqual(self.read_output('other.csv'), 'date\n')
+        self.assertIn('.checking.csv.index.json', os.listdir(self.output_dir))
+        self.assertNotIn('.checking.csv.dedupe.sqlite', os.listdir(self.output_dir))
+        self.assertNotIn(STAGING_DIR_NAME, os.listdir(self.output_dir))
+
+    def test_failed_export_keeps_old_outputs(self):
+        entry = self.archive_response('checking', export_payload({'date': '2024-01-02', 'categories': ['Food']}))
+        os.remove(self.archive.get_object_path(entry['sha256']))
+        self.write_output('checking.csv', 'date,categories\n2024-01-02,Food\n')
+
+        output = StringIO()
+        with redirect_stdout(output):
+            results = Rerenderer({'bank': self.provider}, processes=1).run()
+
+        self.assertFalse(results[0].succeeded)
+        self.assertIn('FAILED bank checking', output.getvalue())
+        self.assertEqual(self.read_output('checking.csv'), 'date,categories\n2024-01-02,Food\n')
+        self.assertNotIn(STAGING_DIR_NAME, os.listdir(self.output_dir))
+
+    def test_export_with_rows_before_archive_is_refused(self):
+        """Rows synced before archiving was enabled are not dropped unless forced."""
+        self.archive_response(
+            'checking', export_payload({'date': '2024-01-03', 'categories': ['Rent']}), start_date=date(2024, 1, 3))
+        self.write_output('checking.csv', 'date,categories\n2024-01-01,Food\n2024-01-03,Rent\n')
+
+        output = StringIO()
+        with redirect_stdout(output):
+            results = Rerenderer({'bank': self.provider}, processes=1).run()
+
+        self.assertFalse(results[0].succeeded)
+        self.assertIn('archive starts at 2024-01-03', results[0].error)
+        self.assertIn('FAILED bank checking', output.getvalue())
+        self.assertEqual(self.read_output('checking.csv'), 'date,categories\n2024-01-01,Food\n2024-01-03,Rent\n')
+
+        with redirect_stdout(StringIO()):
+            results = Rerenderer({'bank': self.provider}, processes=1, force=True).run()
+
+        self.assertTrue(results[0].succeeded)
+        self.assertEqual(self.read_output('checking.csv'), 'date,categories\n2024-01-03,Rent\n')
+
+    def test_providers_without_archive_are_skipped(self):
+        config = ProviderConfig(name='plain', token='token', output_dir=self.output_dir)
+        output = StringIO()
+        with redirect_stdout(output):
+            results = Rerenderer({'plain': LedgerLinkerServiceProvider(config)}).run()
+
+        self.assertEqual(results, [])
+        self.assertIn('Skipping plain: it does not archive responses.', output.getvalue())
+
+
+class ReplaceOutputsTestCase(TestCase):
+
+    def test_replaces_partitioned_output_directory(self):
+        with TemporaryDirectory() as output_dir, TemporaryDirectory() as staging_dir:
+            os.makedirs(os.path.join(output_dir, 'checking', '2023'))
+            os.makedirs(os.path.join(staging_dir, 'checking', '2024'))
+
+            self.assertEqual(replace_outputs(staging_dir, output_dir), ['checking'])
+            self.assertEqual(os.listdir(os.path.join(output_dir, 'checking')), ['2024'])
@@ -0,0 +1,53 @@
+import os
+from datetime import date
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from ledgerlinker.response_archive import ResponseArchive
+
+
+class ResponseArchiveTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.archive = ResponseArchive(os.path.join(self.temp_dir.name, '.archive'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def archive_body(self, slug, chunks, start_date=None):
+        archived = self.archive.archive_chunks('bank', slug, chunks, start_date)
+        # Only part of the body is read before the commit.
+        next(iter(archived))
+        return archived.commit()
+
+    def test_identical_bodies_are_stored_once(self):
+        first = self.archive_body('checking', [b'{"transactions": ', b'[]}'], date(2024, 3, 1))
+        second = self.archive_body('savings', [b'{"transactions": [', b']}'])
+        third = self.archive_body('checking', [b'{"transactions": [1]}'])
+
+        self.assertEqual(first['sha256'], second['sha256'])
+        self.assertNotEqual(first['sha256'], third['sha256'])
+        self.assertEqual(first['start_date'], '2024-03-01')
+        self.assertEqual(self.archive.get_slugs('bank'), ['checking', 'savings'])
+        self.assertEqual(self.archive.get_entries('bank', 'checking'), [first, third])
+        self.assertEqual(b''.join(self.archive.iter_object(first, chunk_size=4)), b'{"transactions": []}')
+
+        object_names = [name for _, _, names in os.walk(self.archive.objects_dir) for name in names]
+        self.assertEqual(sorted(object_names), sorted([f"{first['sha256']}.json.gz", f"{third['sha256']}.json.gz"]))
+
+    def test_discard(self):
+        archived = self.archive.archive_chunks('bank', 'checking', [b'{}'])
+        list(archived)
+        archived.discard()
+        archived.discard()
+
+        self.assertEqual(os.listdir(self.archive.objects_dir), [])
+        self.assertEqual(self.archive.get_entries('bank', 'checking'), [])
+        self.assertEqual(self.archive.get_slugs('bank'), [])
+
+    def test_corrupt_entry_is_skipped(self):
+        entry = self.archive_body('checking', [b'{}'])
+        with open(os.path.join(self.archive.exports_dir, 'bank', 'checking.jsonl'), 'a') as list_file:
+            list_file.write('{"sha256": "ab')
+
+        self.assertEqual(self.archive.get_entries('bank', 'checking'), [entry])
@@ -0,0 +1,42 @@
+from unittest import TestCase
+from ledgerlinker.rows import Row, RowSchema, iter_row_values
+
+
+class RowSchemaTestCase(TestCase):
+
+    def test_from_mapping(self):
+        schema = RowSchema(
+            ['date', 'amount', 'categories', 'memo'],
+            converters={'categories': ':'.join, 'missing': str})
+
+        row = schema.from_mapping({'date': '2020-01-01', 'amount': 5, 'categories': ['Food', 'Snacks'], 'extra': 1})
+
+        self.assertIsInstance(row, Row)
+        self.assertEqual(row, ('2020-01-01', 5, 'Food:Snacks', None))
+        self.assertEqual(row.get('categories'), 'Food:Snacks')
+        self.assertEqual(row.get('extra', 'default'), 'default')
+        self.assertEqual(row.as_dict(), {'date': '2020-01-01', 'amount': 5, 'categories': 'Food:Snacks', 'memo': None})
+
+    def test_repeated_strings_are_interned(self):
+        schema = RowSchema(['account', 'description'])
+        first = schema.from_values([''.join(['Assets:', 'Bank']), ''.join(['Coffee ', 'shop'])])
+        second = schema.from_values([''.join(['Assets:', 'Bank']), ''.join(['Coffee ', 'shop'])])
+
+        self.assertIs(first.get('account'), second.get('account'))
+        self.assertIsNot(first.get('description'), second.get('description'))
+
+    def test_iter_row_values(self):
+        schema = RowSchema(['date', 'amount'])
+        rows = [
+            schema.from_values(['2020-01-01', 1]),
+            {'amount': 2, 'date': '2020-01-02', 'extra': 'ignored'},
+            RowSchema(['amount', 'date']).from_values([3, '2020-01-03']),
+            {'date': '2020-01-04'},
+        ]
+
+        self.assertEqual(list(iter_row_values(rows, ['date', 'amount'])), [
+            ('2020-01-01', 1),
+            ('2020-01-02', 2),
+            ('2020-01-03', 3),
+            ('2020-01-04', None),
+        ])
@@ -0,0 +1,99 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from ledgerlinker.transport import (
+    ACCEPT_ENCODING, HostLimiter, LimitedHTTPAdapter, RetryPolicy,
+    create_session, parse_retry_after, set_host_limiter
+)
+
+
+class CreateSessionTestCase(TestCase):
+
+    def test_accepts_compressed_responses(self):
+        session = create_session()
+        self.assertEqual(session.headers['Accept-Encoding'], ACCEPT_ENCODING)
+        self.assertIn('gzip', ACCEPT_ENCODING.split(','))
+
+
+class HostLimiterTestCase(TestCase):
+
+    def test_host_and_default_limits(self):
+        limiter = HostLimiter(default_limit=2, host_limits={'app.ledgerlinker.com': 1})
+
+        semaphore = limiter.get_semaphore('APP.ledgerlinker.com')
+        self.assertIs(semaphore, limiter.get_semaphore('app.ledgerlinker.com'))
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertFalse(semaphore.acquire(blocking=False))
+
+        other = limiter.get_semaphore('example.com')
+        self.assertIsNot(other, semaphore)
+        self.assertIs(other, limiter.get_semaphore('example.com'))
+
+    def test_no_default_limit(self):
+        limiter = HostLimiter(host_limits={'app.ledgerlinker.com': 1})
+        self.assertIsNone(limiter.get_semaphore('example.com'))
+
+
+class LimitedHTTPAdapterTestCase(TestCase):
+
+    def setUp(self):
+        self.limiter = HostLimiter(host_limits={'example.com': 1})
+        set_host_limiter(self.limiter)
+        self.addCleanup(set_host_limiter, None)
+        self.semaphore = self.limiter.get_semaphore('example.com')
+
+    def send(self, stream):
+        raw = Mock()
+        response = Mock(raw=raw)
+        with patch('requests.adapters.HTTPAdapter.send', return_value=response):
+            LimitedHTTPAdapter().send(Mock(url='https://example.com/exports/'), stream=stream)
+        return raw
+
+    def test_slot_released_after_request(self):
+        self.send(stream=False)
+        self.assertTrue(self.semaphore.acquire(blocking=False))
+
+    def test_streamed_response_holds_slot_until_released(self):
+        raw = self.send(stream=True)
+        self.assertFalse(self.semaphore.acquire(blocking=False))
+
+        release_conn = raw.release_conn
+        release_conn()
+        release_conn()
+        self.assertTrue(self.semaphore.acquire(blocking=False))
+        self.assertFalse(self.semaphore.acquire(blocking=False))
+
+    def test_slot_released_on_error(self):
+        with patch('requests.adapters.HTTPAdapter.send', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                LimitedHTTPAdapter().send(Mock(url='https://example.com/'))
+        self.assertTrue(self.semaphore.acquire(blocking=False))
+
+
+class RetryPolicyTestCase(TestCase):
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:30 GMT', now=1445412480), 30)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412500), 0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_retries=2)
+        self.assertTrue(policy.should_retry(0))
+        self.assertTrue(policy.should_retry(1, 503))
+        self.assertFalse(policy.should_retry(1, 404))
+        self.assertFalse(policy.should_retry(2, 503))
+
+    def test_backoff_with_full_jitter(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, random_func=lambda: 0.5)
+        self.assertEqual([policy.get_delay(attempt) for attempt in range(4)], [0.5, 1, 2, 2.5])
+
+    def test_retry_after(self):
+        """Throttled responses wait as long as the server asks, unless that is too long."""
+        policy = RetryPolicy(max_retry_after=60, random_func=lambda: 0)
+        self.assertEqual(policy.get_delay(0, 429, {'Retry-After': '7'}), 7)
+        self.assertEqual(policy.get_delay(0, 503, {'Retry-After': '7'}), 7)
+        self.assertIsNone(policy.get_delay(0, 429, {'Retry-After': '3600'}))
+        self.assertEqual(policy.get_delay(0, 500, {'Retry-After': '7'}), 0)
+        self.assertEqual(policy.get_delay(0, 429, {}), 0)
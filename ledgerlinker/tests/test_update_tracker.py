@@ -0,0 +1,111 @@
+import json
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
+from datetime import date
+from ledgerlinker.update_tracker import (
+    LastUpdateTracker,
+    SQLiteUpdateTracker,
+    StagedUpdateTracker,
+    get_update_tracker,
+)
+
+
+class LastUpdateTrackerTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, '.last_links.json')
+
+    def read_file(self):
+        with open(self.path) as last_links_file:
+            return json.load(last_links_file)
+
+    def test_update_autocommit(self):
+        tracker = LastUpdateTracker(self.path)
+        tracker.update('export-a', date(2020, 1, 2))
+
+        self.assertEqual(self.read_file(), {'export-a': '2020-01-02'})
+        self.assertEqual(LastUpdateTracker(self.path).get('export-a'), date(2020, 1, 2))
+
+    def test_batched_updates_are_written_once_on_commit(self):
+        tracker = LastUpdateTracker(self.path, autocommit=False)
+        with patch.object(tracker, '_update_last_link_file', wraps=tracker._update_last_link_file) as write:
+            tracker.update('export-a', date(2020, 1, 2))
+            tracker.update('export-b', date(2020, 1, 3))
+            self.assertFalse(os.path.exists(self.path))
+
+            tracker.commit()
+            tracker.commit()
+
+        write.assert_called_once()
+        self.assertEqual(self.read_file(), {'export-a': '2020-01-02', 'export-b': '2020-01-03'})
+
+    def test_failed_write_keeps_previous_file(self):
+        tracker = LastUpdateTracker(self.path)
+        tracker.update('export-a', date(2020, 1, 2))
+
+        with patch('ledgerlinker.update_tracker.json.dumps', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                tracker.update('export-a', date(2020, 1, 3))
+
+        self.assertEqual(self.read_file(), {'export-a': '2020-01-02'})
+        self.assertEqual(os.listdir(self.temp_dir.name), ['.last_links.json'])
+
+
+class StagedUpdateTrackerTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, '.last_links.json')
+        self.tracker = LastUpdateTracker(self.path, autocommit=False)
+
+    def test_updates_are_only_applied_on_their_own_commit(self):
+        self.tracker.update('export-a', date(2020, 1, 1))
+        staged_a = StagedUpdateTracker(self.tracker)
+        staged_b = StagedUpdateTracker(self.tracker)
+
+        staged_a.update('export-a', date(2020, 1, 2))
+        staged_b.update('export-b', date(2020, 1, 3))
+        self.assertEqual(staged_a.get('export-a'), date(2020, 1, 2))
+        self.assertEqual(staged_b.get('export-a'), date(2020, 1, 1))
+
+        staged_b.commit()
+        self.assertEqual(LastUpdateTracker(self.path).last_links, {
+            'export-a': date(2020, 1, 1),
+            'export-b': date(2020, 1, 3),
+        })
+
+        staged_a.commit()
+        self.assertEqual(LastUpdateTracker(self.path).get('export-a'), date(2020, 1, 2))
+
+
+class SQLiteUpdateTrackerTestCase(TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+
+    def test_update_and_get(self):
+        path = os.path.join(self.temp_dir.name, '.last_links.sqlite')
+        tracker = SQLiteUpdateTracker(path, autocommit=False)
+        self.assertIsNone(tracker.get('export-a'))
+
+        tracker.update('export-a', date(2020, 1, 2))
+        tracker.update('export-a', date(2020, 1, 4))
+        tracker.close()
+
+        self.assertEqual(SQLiteUpdateTracker(path).get('export-a'), date(2020, 1, 4))
+
+    def test_get_update_tracker_migrates_json_file(self):
+        LastUpdateTracker(os.path.join(self.temp_dir.name, '.last_links.json')).update(
+            'export-a', date(2020, 1, 2))
+
+        tracker = get_update_tracker(self.temp_dir.name, backend='sqlite')
+
+        self.assertIsInstance(tracker, SQLiteUpdateTracker)
+        self.assertEqual(tracker.get('export-a'), date(2020, 1, 2))
+
+    def test_get_update_tracker_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_update_tracker(self.temp_dir.name, backend='yaml')
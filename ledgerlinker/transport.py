@@ -0,0 +1,221 @@
+"""Shared HTTP plumbing used by the providers.
+
+Requests made with `AsyncHTTPClient` are retried according to a `RetryPolicy`: failed
+connections, timeouts and responses with a transient status are retried with
+exponential backoff and full jitter, waiting as long as a 429 or 503 response's
+`Retry-After` asks. Every attempt is reported to the client's hooks as a
+`RequestEvent`, e.g. to record per host latency.
+"""
+from typing import Callable, Dict, FrozenSet, Optional
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import random
+import threading
+import time
+import weakref
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+DEFAULT_POOL_SIZE = 10
+
+# Every content encoding urllib3 can decode while streaming: gzip and deflate, plus zstd
+# and br when the zstandard and brotli packages are installed.
+ACCEPT_ENCODING = make_headers(accept_encoding=True)['accept-encoding']
+
+# Semaphores shared by hosts without a limit of their own.
+DEFAULT_HOST_BUCKETS = 64
+
+# Seconds to wait for a connection, and for each read from it.
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+
+DEFAULT_MAX_RETRIES = 3
+# Seconds to wait at most before the first retry, doubled for each further retry.
+DEFAULT_RETRY_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+# A longer Retry-After is not waited for; the response is returned instead.
+DEFAULT_MAX_RETRY_AFTER = 300.0
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRY_AFTER_STATUSES = frozenset({429, 503})
+
+
+def parse_retry_after(value : Optional[str], now : Optional[float] = None) -> Optional[float]:
+    """Parse a Retry-After header, given in seconds or as an HTTP date, into seconds to wait."""
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a request."""
+
+    def __init__(
+        self,
+        max_retries : int = DEFAULT_MAX_RETRIES,
+        backoff : float = DEFAULT_RETRY_BACKOFF,
+        max_backoff : float = DEFAULT_MAX_BACKOFF,
+        max_retry_after : float = DEFAULT_MAX_RETRY_AFTER,
+        retry_statuses : FrozenSet[int] = RETRY_STATUSES,
+        random_func : Callable[[], float] = random.random
+    ):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+        self._random = random_func
+
+    def should_retry(self, attempt : int, status_code : Optional[int] = None) -> bool:
+        """Whether to retry after `attempt` (0 for the first request) failed to connect or returned `status_code`."""
+        if attempt >= self.max_retries:
+            return False
+        return status_code is None or status_code in self.retry_statuses
+
+    def get_delay(self, attempt : int, status_code : Optional[int] = None, headers = None) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None if the server asks for too long a wait."""
+        if status_code in RETRY_AFTER_STATUSES and headers is not None:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_retry_after else None
+
+        # Full jitter spreads out the retries of requests that failed together.
+        return self._random() * min(self.max_backoff, self.backoff * 2 ** attempt)
+
+
+NO_RETRIES = RetryPolicy(max_retries=0)
+
+
+class RequestEvent:
+    """The outcome of one attempt at a request, passed to the client's hooks.
+
+    seconds: Time until the response headers arrived, or the attempt failed.
+    status_code: None if no response was received, in which case `error` is set.
+    """
+
+    def __init__(
+        self,
+        url : str,
+        seconds : float,
+        attempt : int,
+        status_code : Optional[int] = None,
+        error : Optional[BaseException] = None
+    ):
+        self.url = url
+        self.host = urlparse(url).hostname
+        self.seconds = seconds
+        self.attempt = attempt
+        self.status_code = status_code
+        self.error = error
+
+
+class HostLimiter:
+    """Limit the number of requests in flight to each host.
+
+    Hosts listed in `host_limits` get their own semaphore. Every other host is hashed
+    to one of `buckets` semaphores allowing `default_limit` requests, so the limiter
+    can be created, and shared with worker processes, before the hosts are known. Two
+    hosts sharing a bucket share its limit.
+
+    `semaphore_factory` creates the semaphores, e.g. `multiprocessing.BoundedSemaphore`
+    to apply the limits across processes.
+    """
+
+    def __init__(
+        self,
+        default_limit : Optional[int] = None,
+        host_limits : Optional[Dict[str, int]] = None,
+        buckets : int = DEFAULT_HOST_BUCKETS,
+        semaphore_factory : Callable = threading.BoundedSemaphore
+    ):
+        self._host_semaphores = {
+            host.lower(): semaphore_factory(limit)
+            for host, limit in (host_limits or {}).items()
+        }
+        self._default_semaphores = []
+        if default_limit is not None:
+            self._default_semaphores = [semaphore_factory(default_limit) for _ in range(buckets)]
+
+    def get_semaphore(self, host : str):
+        host = (host or '').lower()
+        if host in self._host_semaphores:
+            return self._host_semaphores[host]
+        if self._default_semaphores:
+            return self._default_semaphores[zlib.crc32(host.encode('utf-8')) % len(self._default_semaphores)]
+        return None
+
+
+_host_limiter : Optional[HostLimiter] = None
+
+
+def set_host_limiter(host_limiter : Optional[HostLimiter]):
+    """Apply per host request limits to every session of this process."""
+    global _host_limiter
+    _host_limiter = host_limiter
+
+
+def get_host_limiter() -> Optional[HostLimiter]:
+    return _host_limiter
+
+
+class LimitedHTTPAdapter(HTTPAdapter):
+    """An adapter holding a slot of the host limiter while a request is in flight.
+
+    Streamed responses keep their slot until the body is read or the response is closed.
+    """
+
+    def send(self, request, stream=False, **kwargs):
+        semaphore = _host_limiter.get_semaphore(urlparse(request.url).hostname) if _host_limiter else None
+        if semaphore is None:
+            return super().send(request, stream=stream, **kwargs)
+
+        semaphore.acquire()
+        try:
+            response = super().send(request, stream=stream, **kwargs)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        if not stream:
+            semaphore.release()
+            return response
+
+        # urllib3 releases the connection once the body has been read, and requests does
+        # when the response is closed. Free the slot on whichever comes first.
+        released = threading.Lock()
+
+        def release_slot():
+            if released.acquire(blocking=False):
+                semaphore.release()
+
+        release_conn = response.raw.release_conn
+
+        def release_conn_and_slot():
+            release_slot()
+            release_conn()
+
+        response.raw.release_conn = release_conn_and_slot
+        weakref.finalize(response.raw, release_slot)
+        return response
+
+
+def create_session(pool_size : int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Create a session whose keep-alive connection pool can serve `pool_size` concurrent requests."""
+    session = requests.Session()
+    # Response bodies are decompressed incrementally by `iter_content`.
+    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    adapter = LimitedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -1,16 +1,50 @@
+import os
 import sys
+import sqlite3
+import tempfile
 from typing import Dict, Optional
 from datetime import date
 from json import JSONDecodeError
 import json
+import threading
 
+STATE_BACKENDS = ('json', 'sqlite')
 
-class LastUpdateTracker:
-    """Tracks the last time each provider export was synced."""
 
-    def __init__(self, last_link_path : str):
+class UpdateTracker:
+    """Base class for stores tracking the last time each provider export was synced.
+
+    Updates are written as they happen when `autocommit` is set. Otherwise they are
+    held until `commit` is called, letting a whole provider be persisted in one write.
+    """
+
+    def __init__(self, autocommit : bool = True):
+        self.autocommit = autocommit
+        self._lock = threading.Lock()
+
+    def get(self, export_name : str) -> Optional[date]:
+        """Get the last time the given export was synced."""
+        raise NotImplementedError
+
+    def update(self, export_name : str, latest_date : Optional[date]):
+        """Record the latest date for the given export."""
+        raise NotImplementedError
+
+    def commit(self):
+        """Persist any updates that have not been written yet."""
+
+    def close(self):
+        self.commit()
+
+
+class LastUpdateTracker(UpdateTracker):
+    """Tracks the last time each provider export was synced in a JSON file."""
+
+    def __init__(self, last_link_path : str, autocommit : bool = True):
+        super().__init__(autocommit)
         self.last_link_path = last_link_path
         self.last_links = self._load_last_link_file(last_link_path)
+        self._dirty = False
 
     def get(self, export_name : str) -> Optional[date]:
         """Get the last time the given export was synced."""
@@ -19,17 +53,41 @@ class LastUpdateTracker:
     def update(self, export_name : str, latest_date : Optional[date]):
         """Update the last link file with the latest date for the given export."""
 
-        self.last_links[export_name] = latest_date
-        self._update_last_link_file(self.last_link_path, self.last_links)
+        with self._lock:
+            self.last_links[export_name] = latest_date
+            self._dirty = True
+            if self.autocommit:
+                self._commit()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        if self._dirty:
+            self._update_last_link_file(self.last_link_path, self.last_links)
+            self._dirty = False
 
     def _update_last_link_file(self, last_link_path : str, latest_transaction_by_export_id : dict):
-        """Update the last link file which contains the last time each export was synced."""
-        with open(self.last_link_path, 'w') as config_file:
+        """Update the last link file which contains the last time each export was synced.
+
+        The file is replaced atomically so a crash mid-write never leaves it corrupt.
+        """
+        directory = os.path.dirname(os.path.abspath(last_link_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.last_links.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as config_file:
+                config_file.write(json.dumps({
+                    export_id: latest_transaction.isoformat()
+                    for export_id, latest_transaction in latest_transaction_by_export_id.items()
+                }))
+                config_file.flush()
+                os.fsync(config_file.fileno())
 
-            config_file.write(json.dumps({
-                export_id: latest_transaction.isoformat()
-                for export_id, latest_transaction in latest_transaction_by_export_id.items()
-            }))
+            os.replace(temp_path, last_link_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
 
     def _load_last_link_file(self, last_link_path) -> Dict[str, date]:
         """Load lastlink file which contains the last time each export was synced."""
@@ -54,3 +112,103 @@ class LastUpdateTracker:
                 sys.exit(1)
 
         return last_links_by_export_slug
+
+
+class SQLiteUpdateTracker(UpdateTracker):
+    """Tracks the last time each provider export was synced in an SQLite database.
+
+    Each update writes a single row, so the cost does not grow with the number of exports.
+    """
+
+    def __init__(self, database_path : str, autocommit : bool = True):
+        super().__init__(autocommit)
+        self.database_path = database_path
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS last_links (export_name TEXT PRIMARY KEY, latest_date TEXT NOT NULL)')
+        self._connection.commit()
+
+    def get(self, export_name : str) -> Optional[date]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT latest_date FROM last_links WHERE export_name = ?', (export_name,)).fetchone()
+
+        if row is None:
+            return None
+        return date.fromisoformat(row[0])
+
+    def update(self, export_name : str, latest_date : Optional[date]):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO last_links (export_name, latest_date) VALUES (?, ?)',
+                (export_name, latest_date.isoformat()))
+            if self.autocommit:
+                self._connection.commit()
+
+    def import_last_links(self, last_links : Dict[str, date]):
+        """Import dates from another tracker, e.g. when migrating from the JSON file."""
+        with self._lock:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO last_links (export_name, latest_date) VALUES (?, ?)',
+                [(export_name, latest_date.isoformat()) for export_name, latest_date in last_links.items()])
+            self._connection.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM last_links LIMIT 1').fetchone() is None
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+
+class StagedUpdateTracker(UpdateTracker):
+    """Hold the updates of one provider's sync until its outputs are flushed.
+
+    Providers synced at the same time share the client's tracker, so committing it
+    would also write the updates of providers whose rows may still be buffered.
+    Updates are kept here instead, and `commit` applies them to `tracker` and commits
+    it once the provider's outputs were closed.
+    """
+
+    def __init__(self, tracker : UpdateTracker):
+        super().__init__(autocommit=False)
+        self.tracker = tracker
+        self._updates : Dict[str, Optional[date]] = {}
+
+    def get(self, export_name : str) -> Optional[date]:
+        with self._lock:
+            if export_name in self._updates:
+                return self._updates[export_name]
+        return self.tracker.get(export_name)
+
+    def update(self, export_name : str, latest_date : Optional[date]):
+        with self._lock:
+            self._updates[export_name] = latest_date
+
+    def commit(self):
+        with self._lock:
+            updates, self._updates = self._updates, {}
+        for export_name, latest_date in updates.items():
+            self.tracker.update(export_name, latest_date)
+        self.tracker.commit()
+
+
+def get_update_tracker(output_dir : str, backend : str = 'json', autocommit : bool = True) -> UpdateTracker:
+    """Open the update tracker stored in the output directory using the given backend."""
+    json_path = os.path.join(output_dir, '.last_links.json')
+    if backend == 'json':
+        return LastUpdateTracker(json_path, autocommit=autocommit)
+
+    if backend == 'sqlite':
+        tracker = SQLiteUpdateTracker(os.path.join(output_dir, '.last_links.sqlite'), autocommit=autocommit)
+        if tracker.is_empty() and os.path.exists(json_path):
+            print(f'Migrating sync state from {json_path}.')
+            tracker.import_last_links(LastUpdateTracker(json_path).last_links)
+        return tracker
+
+    raise ValueError(f'Unknown state backend {backend}. Expected one of: {", ".join(STATE_BACKENDS)}.')
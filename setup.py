@@ -22,7 +22,12 @@ setuptools.setup(
         'requests',
         'commentjson',
     ],
-    extras_require={},
+    extras_require={
+        'parquet': ['pyarrow'],
+        'async': ['aiohttp'],
+        # zstandard compresses outputs, urllib3's extra decodes zstd responses.
+        'zstd': ['zstandard', 'urllib3[zstd]'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",